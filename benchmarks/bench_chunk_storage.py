@@ -0,0 +1,130 @@
+"""
+Compare full and compact chunk storage: bytes stored and chunk text reconstruction time
+Run with: python benchmarks/bench_chunk_storage.py [--chars 200000 2000000] [--top-k 5] [file.pdf ...]
+
+Without file arguments, synthetic documents of pseudo-random words with the requested
+lengths are used (repeating one sentence would compress unrealistically well). Sizes
+count chunk text and metadata JSON as ingestion writes them; embeddings are the same
+in both modes and left out. With --database the actual sizes of the chunk and text
+tables in the configured database are printed too.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rag_chatbot.settings')
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from document_processor.parsers import TextChunker, parse_and_chunk_file
+from rag_engine.chunk_storage import compress_text, decompress_text, slice_content
+
+WORDS = (
+    "playa muralla ciudad historia hotel museo restaurante comida tipica viaje ruta isla barco "
+    "centro plaza iglesia mercado noche cultura musica festival temporada clima transporte bus "
+    "aeropuerto taxi precio reserva guia tour caminata parque naturaleza montana rio lago "
+    "desayuno almuerzo cena cafe arepa pescado coco fruta artesania calle barrio colonial"
+).split()
+
+
+def synthetic_text(num_chars, seed=7):
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < num_chars:
+        word = rng.choice(WORDS)
+        if rng.random() < 0.08:
+            word = word.capitalize() + ','
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:num_chars]
+
+
+def measure(label, text, chunks, top_k, repeat):
+    full_bytes = 0
+    compact_bytes = len(compress_text(text))
+    for chunk in chunks:
+        pages = {key: chunk[key] for key in ('page_start', 'page_end') if key in chunk}
+        full_metadata = {
+            'title': label, 'author': 'Autor de ejemplo',
+            'start_position': chunk['start_position'], 'end_position': chunk['end_position'], **pages,
+        }
+        full_bytes += len(chunk['content'].encode('utf-8')) + len(json.dumps(full_metadata).encode('utf-8'))
+        compact_bytes += len(json.dumps(pages).encode('utf-8')) + 8
+
+    compressed = compress_text(text)
+    picked = random.Random(1).sample(chunks, min(top_k, len(chunks)))
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        cold_text = decompress_text(compressed)
+        for chunk in picked:
+            slice_content(cold_text, chunk['start_position'], chunk['end_position'])
+    cold = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for chunk in picked:
+            slice_content(text, chunk['start_position'], chunk['end_position'])
+    warm = (time.perf_counter() - start) / repeat
+
+    saved = (full_bytes - compact_bytes) / full_bytes * 100
+    print(
+        f"{label:<28} {len(text):>10,} chars {len(chunks):>6} chunks | full {full_bytes:>11,} B  "
+        f"compact {compact_bytes:>10,} B ({saved:4.1f}% saved) | top-{len(picked)} rebuild: "
+        f"cold {cold * 1000:7.3f}ms  cached {warm * 1000:6.3f}ms"
+    )
+
+
+def print_table_sizes():
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        for table in ('document_chunks', 'document_texts'):
+            # Partitioned tables have no storage of their own; add up their partitions.
+            cursor.execute(
+                "SELECT COALESCE(SUM(pg_total_relation_size(c.oid)), 0) FROM pg_class c "
+                "WHERE c.oid = to_regclass(%s) "
+                "OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))",
+                [table, table]
+            )
+            print(f"{table:<20} {cursor.fetchone()[0]:>14,} bytes (table, TOAST and indexes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--chars', type=int, nargs='*', default=[200_000, 2_000_000])
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--database', action='store_true', help='Also print the table sizes in the database')
+    args = parser.parse_args()
+
+    print(f"CHUNK_SIZE={settings.CHUNK_SIZE} CHUNK_OVERLAP={settings.CHUNK_OVERLAP}")
+    if args.files:
+        for path in args.files:
+            chunks, _, (compressed, _) = parse_and_chunk_file(
+                path, settings.CHUNK_SIZE, settings.CHUNK_OVERLAP, compact=True
+            )
+            measure(os.path.basename(path), decompress_text(compressed), chunks, args.top_k, args.repeat)
+    else:
+        for num_chars in args.chars:
+            text = synthetic_text(num_chars)
+            chunks = TextChunker.chunk_text(text, settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+            measure(f"synthetic {num_chars:,}", text, chunks, args.top_k, args.repeat)
+
+    if args.database:
+        print()
+        print_table_sizes()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark per-request database connection overhead and the prepared vector search
+Run with: python benchmarks/bench_db_connections.py [--requests 200] [--collection default]
+
+Needs the configured Postgres database. Each simulated request sends Django's
+request_started/request_finished signals around one vector search, so CONN_MAX_AGE
+decides whether the connection is reopened, exactly as under a web server. The
+search uses a random query vector, so no Gemini key is needed.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rag_chatbot.settings')
+
+import django
+
+django.setup()
+
+from django.conf import settings
+from django.core import signals
+from django.db import connection
+from rag_engine.models import Collection
+from rag_engine.rag_service import RAGEngine
+
+
+class NoGemini:
+    """Stands in for GeminiService; the benchmark never calls it"""
+    single_flight = None
+
+
+def random_vector():
+    return [random.uniform(-1, 1) for _ in range(settings.EMBEDDING_DIMENSION)]
+
+
+def run_requests(engine, collection_id, num_requests, conn_max_age, prepared):
+    connection.close()
+    connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+    engine.prepared_search = prepared
+    vectors = [random_vector() for _ in range(num_requests)]
+
+    timings = []
+    connects = 0
+    for vector in vectors:
+        start = time.perf_counter()
+        signals.request_started.send(sender=None)
+        if connection.connection is None:
+            connects += 1
+        engine.search_similar_chunks(vector, top_k=5, collection_id=collection_id)
+        signals.request_finished.send(sender=None)
+        timings.append(time.perf_counter() - start)
+
+    connection.close()
+    return timings, connects
+
+
+def report(label, timings, connects):
+    timings_ms = sorted(t * 1000 for t in timings)
+    p95 = timings_ms[int(len(timings_ms) * 0.95) - 1]
+    print(
+        f"{label:<36} connects={connects:>4}  mean={statistics.mean(timings_ms):7.2f}ms  "
+        f"median={statistics.median(timings_ms):7.2f}ms  p95={p95:7.2f}ms"
+    )
+    return statistics.mean(timings_ms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--collection', default=settings.DEFAULT_COLLECTION_SLUG)
+    args = parser.parse_args()
+
+    collection_id = Collection.objects.get(slug=args.collection).id
+    engine = RAGEngine(gemini_service=NoGemini())
+    # Prime the buffer cache so the first scenario does not pay for cold pages.
+    run_requests(engine, collection_id, 10, 60, False)
+
+    print(f"{args.requests} requests, collection '{args.collection}'")
+    scenarios = [
+        ('new connection per request', 0, False),
+        ('persistent connection', 600, False),
+        ('persistent + prepared search', 600, True),
+    ]
+    means = {}
+    for label, conn_max_age, prepared in scenarios:
+        timings, connects = run_requests(engine, collection_id, args.requests, conn_max_age, prepared)
+        means[label] = report(label, timings, connects)
+
+    baseline = means['new connection per request']
+    print(f"\nconnection overhead per request: {baseline - means['persistent connection']:.2f}ms")
+    print(
+        f"planning saved by prepared search: "
+        f"{means['persistent connection'] - means['persistent + prepared search']:.2f}ms"
+    )
+
+
+if __name__ == '__main__':
+    main()
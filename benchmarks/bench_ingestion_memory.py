@@ -0,0 +1,69 @@
+"""
+Compare peak memory of the materialised and streaming parse -> clean -> chunk paths
+Run with: python benchmarks/bench_ingestion_memory.py [--pages 100 1000 2000]
+
+Embedding and database inserts are not exercised; they run in fixed-size batches
+on top of the streaming path.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_processor.parsers import DocumentParser, TextNormalizer, TextChunker
+from bench_pdf_parsing import write_synthetic_pdf
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+def materialised(path):
+    text, _ = DocumentParser.parse_pdf(path)
+    cleaned = TextNormalizer.process_text(text, normalize=False)
+    return len(TextChunker.chunk_text(cleaned, CHUNK_SIZE, CHUNK_OVERLAP))
+
+
+def streaming(path):
+    pages, _ = DocumentParser.stream_pdf(path)
+    chunks = TextChunker.iter_chunks(TextNormalizer.clean_segments(pages), CHUNK_SIZE, CHUNK_OVERLAP)
+    return sum(1 for _ in chunks)
+
+
+def measure(function, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = function(path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', nargs='+', type=int, default=[100, 1000, 2000])
+    args = parser.parse_args()
+
+    print("Ingestion peak memory (tracemalloc)")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for num_pages in args.pages:
+            path = os.path.join(directory, f"synthetic_{num_pages}.pdf")
+            write_synthetic_pdf(path, num_pages)
+
+            for name, function in (('materialised', materialised), ('streaming', streaming)):
+                count, elapsed, peak = measure(function, path)
+                print(
+                    f"{num_pages:>6} pages  {name:<12} {count:>7} chunks  "
+                    f"{elapsed:7.2f}s  peak {peak / 1024 / 1024:8.2f} MiB"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark sequential vs page-parallel PDF text extraction
+Run with: python benchmarks/bench_pdf_parsing.py [--pages 10 200 1200] [--workers 4] [file.pdf ...]
+
+Without file arguments, synthetic text PDFs with the requested page counts are
+generated in a temporary directory.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_processor.parsers import DocumentParser
+
+LINE = "Cartagena de Indias ofrece playas, murallas coloniales y una gastronomia caribena unica."
+
+
+def write_synthetic_pdf(path, num_pages, lines_per_page=45):
+    """Write a minimal PDF with num_pages pages of Helvetica text"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+
+    for page_number in range(num_pages):
+        lines = [f"Pagina {page_number + 1}: {LINE}"] + [LINE] * (lines_per_page - 1)
+        stream = "BT /F1 9 Tf 11 TL 36 800 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        stream = stream.encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % num_pages
+
+    with open(path, 'wb') as output:
+        output.write(b"%PDF-1.4\n")
+        offsets = []
+        for object_id, body in enumerate(objects, start=1):
+            offsets.append(output.tell())
+            output.write(b"%d 0 obj\n" % object_id + body + b"\nendobj\n")
+        xref_offset = output.tell()
+        output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            output.write(b"%010d 00000 n \n" % offset)
+        output.write(
+            b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(objects) + 1, xref_offset)
+        )
+
+
+def time_call(function, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmark_file(path, workers, repeat):
+    sequential_time, (sequential_pages, metadata) = time_call(
+        lambda: DocumentParser.parse_pdf_pages(path, parallel_min_pages=0), repeat
+    )
+    # Warm the process pool so the comparison measures extraction, not worker spawn.
+    DocumentParser.parse_pdf_pages(path, parallel_min_pages=1, max_workers=workers)
+    parallel_time, (parallel_pages, _) = time_call(
+        lambda: DocumentParser.parse_pdf_pages(path, parallel_min_pages=1, max_workers=workers), repeat
+    )
+
+    if parallel_pages != sequential_pages:
+        raise AssertionError(f"Parallel extraction differs from sequential output for {path}")
+
+    pages = metadata['num_pages']
+    print(
+        f"{os.path.basename(path):<28} {pages:>6} pages  "
+        f"sequential {sequential_time:7.2f}s ({pages / sequential_time:7.1f} p/s)  "
+        f"parallel x{workers} {parallel_time:7.2f}s ({pages / parallel_time:7.1f} p/s)  "
+        f"speedup {sequential_time / parallel_time:5.2f}x"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='PDF files to benchmark instead of synthetic ones')
+    parser.add_argument('--pages', nargs='+', type=int, default=[10, 50, 200, 1200])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"Page-parallel PDF extraction benchmark ({args.workers} workers, best of {args.repeat})")
+    print("=" * 60)
+
+    if args.files:
+        for path in args.files:
+            benchmark_file(path, args.workers, args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        for num_pages in args.pages:
+            path = os.path.join(directory, f"synthetic_{num_pages}.pdf")
+            write_synthetic_pdf(path, num_pages)
+            benchmark_file(path, args.workers, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
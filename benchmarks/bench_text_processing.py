@@ -0,0 +1,149 @@
+"""
+Micro-benchmark TextNormalizer and TextChunker on large inputs
+Run with: python benchmarks/bench_text_processing.py [--mb 1 10 100] [--repeat 3] [file.txt ...]
+
+Each TextNormalizer step is timed against the implementation it replaced, kept
+below as the reference, and the outputs are checked to be identical. Inputs are
+synthetic Spanish-like text with accents and PDF-style line breaks, or the given
+UTF-8 text files. Chunks are 1000 characters with 200 of overlap (the CHUNK_SIZE
+and CHUNK_OVERLAP defaults) unless --chunk-size and --overlap say otherwise.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_processor.parsers import TextChunker, TextNormalizer
+
+WORDS = (
+    "playa muralla ciudad historia hotel museo restaurante comida típica viaje ruta isla barco "
+    "centro plaza iglesia mercado noche cultura música festival temporada clima transporte bus "
+    "aeropuerto taxi precio reserva guía tour caminata parque naturaleza montaña río lago "
+    "desayuno almuerzo cena café arepa pescado coco fruta artesanía calle barrio colonial "
+    "también además después información ubicación habitación señal añejo pingüino"
+).split()
+SEPARATORS = [' '] * 12 + ['  ', '\n', ' \n', '\t', '\n\n']
+PAGE_CHARS = 3000
+
+
+def reference_normalize_text(text):
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join([c for c in text if not unicodedata.combining(c)])
+
+
+def reference_clean_text(text):
+    return ' '.join(text.split()).strip()
+
+
+def synthetic_text(num_chars, seed=7):
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < num_chars:
+        word = rng.choice(WORDS)
+        if rng.random() < 0.08:
+            word = word.capitalize() + ','
+        separator = rng.choice(SEPARATORS)
+        parts.append(word + separator)
+        length += len(word) + len(separator)
+    return ''.join(parts)[:num_chars]
+
+
+def best_time(function, argument, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def peak_memory(function, argument):
+    tracemalloc.start()
+    function(argument)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def report(name, size, elapsed, reference_elapsed=None, identical=None):
+    line = f"  {name:<24} {elapsed * 1000:10.1f}ms {size / elapsed / 1e6:8.1f} MB/s"
+    if reference_elapsed is not None:
+        line += f" | reference {reference_elapsed * 1000:10.1f}ms  x{reference_elapsed / elapsed:5.2f}"
+    if identical is not None:
+        line += '  identical' if identical else '  OUTPUT DIFFERS'
+    print(line)
+
+
+def bench(label, text, repeat, chunk_size, overlap):
+    size = len(text.encode('utf-8'))
+    print(f"{label}: {size / 1e6:.1f} MB, {len(text):,} chars")
+
+    elapsed, cleaned = best_time(TextNormalizer.clean_text, text, repeat)
+    reference_elapsed, expected = best_time(reference_clean_text, text, repeat)
+    report('clean_text', size, elapsed, reference_elapsed, cleaned == expected)
+    print(
+        f"  {'clean_text peak memory':<24} {peak_memory(TextNormalizer.clean_text, text) / 1e6:10.1f}MB"
+        f" | reference {peak_memory(reference_clean_text, text) / 1e6:10.1f}MB"
+    )
+
+    pages = [text[i:i + PAGE_CHARS] for i in range(0, len(text), PAGE_CHARS)]
+    elapsed, joined = best_time(
+        lambda segments: ' '.join(cleaned for _, cleaned in TextNormalizer.clean_segments(segments)), pages, repeat
+    )
+    report(
+        f'clean_segments ({len(pages)} pages)', size, elapsed,
+        identical=joined == reference_clean_text('\n'.join(pages))
+    )
+
+    elapsed, normalized = best_time(TextNormalizer.normalize_text, cleaned, repeat)
+    reference_elapsed, expected = best_time(reference_normalize_text, cleaned, repeat)
+    report('normalize_text', size, elapsed, reference_elapsed, normalized == expected)
+
+    ascii_text = normalized.encode('ascii', 'ignore').decode('ascii')
+    elapsed, result = best_time(TextNormalizer.normalize_text, ascii_text, repeat)
+    reference_elapsed, expected = best_time(reference_normalize_text, ascii_text, repeat)
+    report('normalize_text (ASCII)', size, elapsed, reference_elapsed, result == expected)
+
+    elapsed, chunks = best_time(lambda value: TextChunker.chunk_text(value, chunk_size, overlap), cleaned, repeat)
+    report(f'chunk_text ({len(chunks)} chunks)', size, elapsed)
+
+    segments = list(TextNormalizer.clean_segments(pages))
+    elapsed, streamed = best_time(
+        lambda value: list(TextChunker.iter_chunks(((None, segment) for _, segment in value), chunk_size, overlap)),
+        segments, repeat
+    )
+    report('iter_chunks', size, elapsed, identical=[chunk['content'] for chunk in streamed] == [
+        chunk['content'] for chunk in TextChunker.chunk_text(joined, chunk_size, overlap)
+    ])
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='UTF-8 text files to use instead of synthetic text')
+    parser.add_argument('--mb', nargs='+', type=float, default=[1, 10], help='Synthetic input sizes in MB')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per step; the fastest is reported')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--overlap', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.files:
+        for path in args.files:
+            with open(path, encoding='utf-8') as handle:
+                bench(os.path.basename(path), handle.read(), args.repeat, args.chunk_size, args.overlap)
+    else:
+        for mb in args.mb:
+            bench(f"synthetic {mb:g} MB", synthetic_text(int(mb * 1_000_000)), args.repeat, args.chunk_size, args.overlap)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,7 @@ class UserAdmin(BaseUserAdmin):
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'title', 'created_at', 'updated_at']
+    list_display = ['id', 'user', 'title', 'summary_tokens', 'created_at', 'updated_at']
     list_filter = ['created_at', 'updated_at']
     search_fields = ['user__username', 'title']
     ordering = ['-updated_at']
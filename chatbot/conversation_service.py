@@ -0,0 +1,128 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from chatbot.models import Conversation
+from rag_engine.rag_service import GeminiService
+from rag_engine.rate_limit import BACKGROUND, gemini_call_context
+from rag_engine.usage import record_daily_usage, track_usage
+
+
+class ConversationMemoryService:
+    """Loads the recent history window and maintains rolling conversation summaries"""
+
+    _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='conversation-summary')
+    _pending = set()
+    _pending_lock = threading.Lock()
+
+    def __init__(self, gemini_service: GeminiService = None):
+        self.gemini_service = gemini_service
+        self.window = settings.CONVERSATION_HISTORY_WINDOW
+        self.threshold = settings.CONVERSATION_SUMMARY_THRESHOLD
+        self.batch = settings.CONVERSATION_SUMMARY_BATCH
+
+    def get_recent_history(self, conversation: Conversation) -> List[Dict]:
+        """Fetch the messages the summary does not cover yet, oldest first
+
+        That is at least the last CONVERSATION_HISTORY_WINDOW messages, plus any older
+        ones still waiting to be folded into the summary, so no turn ever drops out of
+        the prompt before the summary holds it.
+        """
+        unsummarized = conversation.messages.count() - conversation.summarized_message_count
+        recent = (
+            conversation.messages
+            .order_by('-created_at', '-id')
+            .values('sender', 'content')[:max(self.window, unsummarized)]
+        )
+        return list(reversed(recent))
+
+    def schedule_summary_update(self, conversation: Conversation):
+        """Queue a background summary refresh for the conversation"""
+        with self._pending_lock:
+            if conversation.id in self._pending:
+                return
+            self._pending.add(conversation.id)
+
+        self._executor.submit(self._run_summary_update, conversation.id)
+
+    def _run_summary_update(self, conversation_id: int):
+        close_old_connections()
+        try:
+            self.update_summary(conversation_id)
+        except Exception:
+            # A failed refresh is retried on the next turn; the previous summary stays valid.
+            pass
+        finally:
+            with self._pending_lock:
+                self._pending.discard(conversation_id)
+            close_old_connections()
+
+    def update_summary(self, conversation_id: int) -> bool:
+        """Fold messages that fell out of the history window into the summary
+
+        Until a conversation passes CONVERSATION_SUMMARY_THRESHOLD messages, and between
+        batches of CONVERSATION_SUMMARY_BATCH, the messages not summarized yet are sent
+        as raw history instead (see get_recent_history).
+        """
+        conversation = Conversation.objects.get(id=conversation_id)
+        total_messages = conversation.messages.count()
+
+        if total_messages <= self.threshold:
+            return False
+
+        summarized = conversation.summarized_message_count
+        summarize_until = total_messages - self.window
+
+        if summarize_until - summarized < self.batch:
+            return False
+
+        new_messages = list(
+            conversation.messages
+            .order_by('created_at', 'id')
+            .values('sender', 'content')[summarized:summarize_until]
+        )
+
+        with track_usage() as usage:
+            summary = self.summarize(conversation.summary, new_messages)
+        # Summaries count towards the user's token budget but not as chat requests.
+        record_daily_usage(conversation.user_id, usage, requests=0)
+
+        # Guard against a concurrent refresh having already advanced the summary.
+        updated = Conversation.objects.filter(
+            id=conversation_id,
+            summarized_message_count=summarized
+        ).update(
+            summary=summary,
+            summarized_message_count=summarize_until,
+            summary_tokens=F('summary_tokens') + usage.total_tokens
+        )
+
+        return updated == 1
+
+    def summarize(self, previous_summary: str, messages: List[Dict]) -> str:
+        """Produce an updated summary from the previous one plus new messages"""
+        if self.gemini_service is None:
+            self.gemini_service = GeminiService()
+
+        transcript = "\n".join(
+            f"{'User' if msg['sender'] == 'user' else 'Assistant'}: {msg['content']}"
+            for msg in messages
+        )
+
+        prompt = f"""You maintain a running summary of a conversation between a user and an AI travel guide.
+Update the existing summary with the new messages below. Keep the destinations, dates, budgets,
+preferences and open questions the user mentioned, and drop small talk.
+Write the summary in Spanish, in under 200 words.
+
+Existing summary:
+{previous_summary or '(empty)'}
+
+New messages:
+{transcript}
+
+Updated summary:"""
+
+        with gemini_call_context(BACKGROUND):
+            return self.gemini_service.generate_response(prompt).strip()
@@ -20,6 +20,15 @@ class Conversation(models.Model):
     """Stores conversation sessions"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
     title = models.CharField(max_length=255, blank=True, null=True)
+    summary = models.TextField(blank=True, default='')
+    summarized_message_count = models.IntegerField(
+        default=0,
+        help_text="Number of oldest messages folded into the summary"
+    )
+    summary_tokens = models.IntegerField(
+        default=0,
+        help_text="Gemini tokens spent keeping the summary up to date"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -48,6 +57,10 @@ class Message(models.Model):
     class Meta:
         db_table = 'messages'
         ordering = ['created_at']
+        indexes = [
+            # Serves incremental sync (messages after an id) and the ETag's last id and count.
+            models.Index(fields=['conversation', 'id'], name='messages_conversation_id_idx'),
+        ]
         verbose_name = 'Message'
         verbose_name_plural = 'Messages'
 
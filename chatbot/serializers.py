@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from chatbot.models import User, Conversation, Message
 
@@ -53,12 +54,17 @@ class ChatRequestSerializer(serializers.Serializer):
     conversation_id = serializers.IntegerField(required=False, allow_null=True)
     message = serializers.CharField(required=True)
     instruction = serializers.CharField(required=False, allow_blank=True)
-    top_k = serializers.IntegerField(required=False, default=5)
+    top_k = serializers.IntegerField(required=False, default=5, min_value=1, max_value=settings.RETRIEVAL_MAX_TOP_K)
+    collection = serializers.SlugField(required=False)
 
 
 class ChatResponseSerializer(serializers.Serializer):
     conversation_id = serializers.IntegerField()
+    collection_id = serializers.IntegerField()
     message = MessageSerializer()
     response = MessageSerializer()
     chunks_used = serializers.IntegerField()
+    chunk_distances = serializers.ListField(child=serializers.DictField())
+    route = serializers.CharField()
+    usage = serializers.DictField(child=serializers.IntegerField())
     execution_time = serializers.FloatField()
@@ -1,3 +1,176 @@
-from django.test import TestCase
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from chatbot.conversation_service import ConversationMemoryService
+from chatbot.models import Conversation, Message, User
+from rag_engine.models import Collection, RAGQueryLog
+from rag_engine.rate_limit import RateLimited, user_concurrency_slot
 
-# Create your tests here.
+
+class FakeSummaryGemini:
+    """Summarizes by recording how many summary requests it received"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_response(self, prompt, *args, **kwargs):
+        self.calls += 1
+        return f'summary {self.calls}'
+
+
+class FakeRAGEngine:
+    """Answers every message with a fixed response, or raises the given error"""
+
+    gemini_service = None
+
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.default_collection_id = Collection.get_default().id
+
+    def generate_rag_response(self, **kwargs):
+        if self.error is not None:
+            raise self.error
+        return {
+            'response': 'Te recomiendo Lisboa.', 'route': 'rag', 'route_score': None, 'query_embedding': None,
+            'embedding_model': '', 'chunk_distances': [], 'prompt_breakdown': {}, 'compression_ratio': None,
+            'execution_time': 0.1, 'chunks_used': [], 'num_chunks': 0,
+        }
+
+
+class ConversationMessagesETagTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create_user(username='ana', password='secret')
+        self.conversation = Conversation.objects.create(user=user, title='Trip')
+        self.first = Message.objects.create(conversation=self.conversation, sender='user', content='Hola')
+        Message.objects.create(conversation=self.conversation, sender='assistant', content='Hola, ¿en qué ayudo?')
+        self.url = f'/api/chatbot/conversations/{self.conversation.id}/messages/'
+
+    def test_unchanged_messages_revalidate_with_304(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_full_list_and_after_id_slices_have_different_etags(self):
+        full_etag = self.client.get(self.url)['ETag']
+        slice_response = self.client.get(self.url, {'after_id': self.first.id}, HTTP_IF_NONE_MATCH=full_etag)
+
+        self.assertEqual(slice_response.status_code, 200)
+        self.assertEqual(len(slice_response.data), 1)
+        slice_etag = slice_response['ETag']
+        self.assertNotEqual(slice_etag, full_etag)
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=slice_etag).status_code, 200)
+        other_slice = self.client.get(self.url, {'after_id': 0}, HTTP_IF_NONE_MATCH=slice_etag)
+        self.assertEqual(other_slice.status_code, 200)
+        self.assertEqual(
+            self.client.get(self.url, {'after_id': self.first.id}, HTTP_IF_NONE_MATCH=slice_etag).status_code, 304
+        )
+
+
+@override_settings(CONVERSATION_HISTORY_WINDOW=5, CONVERSATION_SUMMARY_THRESHOLD=20, CONVERSATION_SUMMARY_BATCH=10)
+class ConversationMemoryTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='ana', password='secret')
+        self.conversation = Conversation.objects.create(user=user, title='Trip')
+        self.gemini = FakeSummaryGemini()
+        self.memory = ConversationMemoryService(gemini_service=self.gemini)
+        self.sent = 0
+
+    def send(self, count):
+        for _ in range(count):
+            self.sent += 1
+            Message.objects.create(conversation=self.conversation, sender='user', content=f'message {self.sent}')
+
+    def history(self):
+        self.conversation.refresh_from_db()
+        return [message['content'] for message in self.memory.get_recent_history(self.conversation)]
+
+    def test_messages_below_the_threshold_are_all_sent_raw(self):
+        self.send(12)
+
+        self.assertFalse(self.memory.update_summary(self.conversation.id))
+        self.assertEqual(self.history(), [f'message {number}' for number in range(1, 13)])
+
+    def test_history_starts_where_the_summary_ends(self):
+        self.send(21)
+        self.assertTrue(self.memory.update_summary(self.conversation.id))
+        self.assertEqual(self.history(), [f'message {number}' for number in range(17, 22)])
+
+        # Not enough for another batch: the three new turns stay raw on top of the window.
+        self.send(3)
+        self.assertFalse(self.memory.update_summary(self.conversation.id))
+        self.assertEqual(self.history(), [f'message {number}' for number in range(17, 25)])
+
+    def test_every_message_is_in_the_summary_or_the_history(self):
+        for _ in range(45):
+            self.send(1)
+            self.memory.update_summary(self.conversation.id)
+            history = self.history()
+
+            summarized = self.conversation.summarized_message_count
+            self.assertEqual(history, [f'message {number}' for number in range(summarized + 1, self.sent + 1)])
+            self.assertGreaterEqual(len(history), min(self.sent, 5))
+        self.assertGreater(self.gemini.calls, 1)
+
+
+@override_settings(CHAT_MAX_CONCURRENT_PER_USER=1)
+class SendMessageConcurrencyTests(TestCase):
+    url = '/api/chatbot/chat/send_message/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='ana', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.memory = mock.Mock(get_recent_history=mock.Mock(return_value=[]))
+
+    def send(self, engine, **data):
+        with mock.patch('chatbot.views.get_rag_engine', return_value=engine), \
+                mock.patch('chatbot.views.get_service', return_value=self.memory):
+            return self.client.post(self.url, {'message': '¿A dónde viajo?', **data}, format='json')
+
+    def test_message_is_answered_and_the_slot_released(self):
+        for _ in range(2):
+            response = self.send(FakeRAGEngine())
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(Conversation.objects.count(), 2)
+        self.assertEqual(RAGQueryLog.objects.count(), 2)
+
+    def test_send_while_the_users_slot_is_taken_is_rejected(self):
+        with user_concurrency_slot(f'user:{self.user.pk}'):
+            response = self.send(FakeRAGEngine())
+
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertFalse(Conversation.objects.exists())
+
+            # Another user has slots of their own.
+            self.client.force_authenticate(User.objects.create_user(username='bob', password='secret'))
+            self.assertEqual(self.send(FakeRAGEngine()).status_code, 200)
+
+    def test_rate_limited_answer_removes_the_new_message_and_conversation(self):
+        response = self.send(FakeRAGEngine(error=RateLimited('Gemini quota exhausted', 7)))
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(response.data['retry_after'], 7)
+        self.assertFalse(Conversation.objects.exists())
+        self.assertFalse(Message.objects.exists())
+        # The slot was released despite the error.
+        self.assertEqual(self.send(FakeRAGEngine()).status_code, 200)
+
+    def test_rate_limited_answer_keeps_an_existing_conversation(self):
+        conversation = Conversation.objects.create(user=self.user, title='Trip')
+        Message.objects.create(conversation=conversation, sender='user', content='Hola')
+        engine = FakeRAGEngine(error=RateLimited('Gemini quota exhausted', 3))
+
+        response = self.send(engine, conversation_id=conversation.id)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(Conversation.objects.filter(id=conversation.id).exists())
+        self.assertEqual(list(conversation.messages.values_list('content', flat=True)), ['Hola'])
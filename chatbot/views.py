@@ -1,3 +1,7 @@
+import time
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils.http import parse_etags
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -7,8 +11,11 @@ from chatbot.serializers import (
     ConversationSerializer, ConversationListSerializer,
     MessageSerializer, ChatRequestSerializer, ChatResponseSerializer
 )
-from rag_engine.rag_service import RAGEngine
-from rag_engine.models import RAGQueryLog
+from rag_engine.services import get_rag_engine, get_service
+from rag_engine.models import Collection, RAGQueryLog
+from rag_engine.rate_limit import INTERACTIVE, RateLimited, gemini_call_context, user_concurrency_slot
+from rag_engine.usage import check_token_budget, record_daily_usage, track_usage
+from chatbot.conversation_service import ConversationMemoryService
 
 
 def chat_interface(request):
@@ -16,6 +23,44 @@ def chat_interface(request):
     return render(request, 'chatbot/chat_interface.html')
 
 
+def conversation_etag(conversation, variant: str = '') -> str:
+    """Weak ETag for a conversation and its messages
+
+    Messages are only ever appended or deleted, so the newest id and the count
+    (one index-only lookup) identify the message list; updated_at covers the
+    conversation's own fields. ``variant`` tells apart the different bodies built
+    from the same state, such as a full message list and an ``after_id`` slice.
+    """
+    state = conversation.messages.order_by().aggregate(last_id=Max('id'), count=Count('id'))
+    suffix = f'-{variant}' if variant else ''
+    return (
+        f'W/"{conversation.pk}-{int(conversation.updated_at.timestamp() * 1_000_000)}-'
+        f'{state["last_id"] or 0}-{state["count"]}{suffix}"'
+    )
+
+
+def etag_matches(request, etag: str) -> bool:
+    """If-None-Match uses weak comparison (RFC 9110 13.1.2)"""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.removeprefix('W/') == opaque for tag in parse_etags(header))
+
+
+def with_etag(response, etag: str):
+    response['ETag'] = etag
+    # Clients may keep the copy but must revalidate it before use.
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(etag: str):
+    return with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+
 class ConversationViewSet(viewsets.ModelViewSet):
     """ViewSet for managing conversations"""
     queryset = Conversation.objects.all()
@@ -30,13 +75,42 @@ class ConversationViewSet(viewsets.ModelViewSet):
         user = self.request.user if self.request.user.is_authenticated else User.objects.first()
         serializer.save(user=user)
 
+    def retrieve(self, request, *args, **kwargs):
+        """Get a conversation with its messages, or 304 if the client's copy is current"""
+        conversation = self.get_object()
+        etag = conversation_etag(conversation)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        response = Response(self.get_serializer(conversation).data)
+        return with_etag(response, etag)
+
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
-        """Get all messages for a conversation"""
+        """Get the messages of a conversation
+
+        With ``?after_id=<id>`` only messages newer than that id are returned, so a
+        client can keep its copy in sync by passing the last id it has. Responses
+        carry a weak ETag; a matching If-None-Match gets 304 without a body.
+        """
         conversation = self.get_object()
+
+        after_id = request.query_params.get('after_id')
+        if after_id is not None:
+            try:
+                after_id = int(after_id)
+            except ValueError:
+                return Response({'after_id': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        etag = conversation_etag(conversation, 'm' if after_id is None else f'a{after_id}')
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
         messages = conversation.messages.all()
+        if after_id is not None:
+            messages = messages.filter(id__gt=after_id).order_by('id')
         serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        return with_etag(Response(serializer.data), etag)
 
 
 class ChatViewSet(viewsets.ViewSet):
@@ -44,26 +118,67 @@ class ChatViewSet(viewsets.ViewSet):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.rag_engine = RAGEngine()
+        self.rag_engine = get_rag_engine()
+        self.memory_service = get_service(
+            'conversation_memory',
+            lambda: ConversationMemoryService(self.rag_engine.gemini_service)
+        )
 
     @action(detail=False, methods=['post'])
     def send_message(self, request):
-        """Send a message and get AI response"""
+        """Send a message and get AI response
+
+        Answers 429 with Retry-After when the user already has
+        CHAT_MAX_CONCURRENT_PER_USER messages in progress, when Gemini quota
+        will not be available within GEMINI_MAX_QUEUE_WAIT seconds, or when a
+        daily token budget is used up (until midnight).
+        """
         serializer = ChatRequestSerializer(data=request.data)
         
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        data = serializer.validated_data
+        if request.user.is_authenticated:
+            user_key = f"user:{request.user.pk}"
+        else:
+            user_key = f"ip:{request.META.get('REMOTE_ADDR', '')}"
+        deadline = time.monotonic() + settings.GEMINI_MAX_QUEUE_WAIT
+
+        try:
+            with user_concurrency_slot(user_key), gemini_call_context(INTERACTIVE, deadline):
+                return self._answer(request, serializer.validated_data)
+        except RateLimited as e:
+            return Response(
+                {'error': str(e), 'retry_after': e.retry_after},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(e.retry_after)}
+            )
+
+    def _answer(self, request, data):
         message_content = data['message']
         conversation_id = data.get('conversation_id')
         instruction = data.get('instruction', '')
         top_k = data.get('top_k', 5)
 
+        collection_id = None
+        if data.get('collection'):
+            collection_id = Collection.objects.filter(slug=data['collection']).values_list('id', flat=True).first()
+            if collection_id is None:
+                return Response({'collection': ['Unknown collection']}, status=status.HTTP_400_BAD_REQUEST)
+
         user = request.user if request.user.is_authenticated else User.objects.first()
+        # Raises TokenBudgetExceeded before anything is stored.
+        limits = check_token_budget(user)
 
+        created_conversation = not conversation_id
         if conversation_id:
             conversation = get_object_or_404(Conversation, id=conversation_id)
+            if collection_id is None:
+                # A conversation keeps searching the collection it started in.
+                collection_id = (
+                    conversation.rag_queries.order_by('-timestamp')
+                    .values_list('collection_id', flat=True).first()
+                )
         else:
             conversation = Conversation.objects.create(
                 user=user,
@@ -76,15 +191,30 @@ class ChatViewSet(viewsets.ViewSet):
             content=message_content
         )
 
-        conversation_history = list(conversation.messages.values('sender', 'content'))
+        conversation_history = self.memory_service.get_recent_history(conversation)
 
         query = f"{instruction}\n{message_content}" if instruction else message_content
+        collection_id = collection_id or self.rag_engine.default_collection_id
 
-        rag_result = self.rag_engine.generate_rag_response(
-            query=query,
-            conversation_history=conversation_history,
-            top_k=top_k
-        )
+        try:
+            with track_usage() as usage:
+                rag_result = self.rag_engine.generate_rag_response(
+                    query=query,
+                    conversation_history=conversation_history,
+                    conversation_summary=conversation.summary,
+                    top_k=top_k,
+                    collection_id=collection_id,
+                    message=message_content,
+                    **limits
+                )
+        except RateLimited:
+            # Tokens already spent still count; the client will retry the same
+            # message, so do not keep an unanswered copy.
+            record_daily_usage(user.pk, usage, requests=0)
+            user_message.delete()
+            if created_conversation:
+                conversation.delete()
+            raise
 
         assistant_message = Message.objects.create(
             conversation=conversation,
@@ -94,17 +224,36 @@ class ChatViewSet(viewsets.ViewSet):
 
         rag_log = RAGQueryLog.objects.create(
             conversation=conversation,
+            collection_id=collection_id,
             query=query,
+            route=rag_result['route'],
+            route_score=rag_result['route_score'],
+            query_embedding=rag_result['query_embedding'] if settings.QUERY_LOG_EMBEDDINGS else None,
+            embedding_model=rag_result['embedding_model'] if settings.QUERY_LOG_EMBEDDINGS else '',
+            chunk_distances=rag_result['chunk_distances'],
             response=rag_result['response'],
+            prompt_tokens=usage.prompt_tokens,
+            output_tokens=usage.output_tokens,
+            embedding_tokens=usage.embedding_tokens,
+            prompt_breakdown=rag_result['prompt_breakdown'],
+            compression_ratio=rag_result['compression_ratio'],
+            budget_degraded=bool(limits),
             execution_time=rag_result['execution_time']
         )
         rag_log.chunks_used.set(rag_result['chunks_used'])
+        record_daily_usage(user.pk, usage)
+
+        self.memory_service.schedule_summary_update(conversation)
 
         response_data = {
             'conversation_id': conversation.id,
+            'collection_id': collection_id,
             'message': MessageSerializer(user_message).data,
             'response': MessageSerializer(assistant_message).data,
             'chunks_used': rag_result['num_chunks'],
+            'chunk_distances': rag_result['chunk_distances'],
+            'route': rag_result['route'],
+            'usage': usage.as_dict(),
             'execution_time': rag_result['execution_time']
         }
 
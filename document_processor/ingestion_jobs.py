@@ -0,0 +1,294 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+from typing import Optional
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rag_engine.models import IngestionJob, SourceDocument
+from document_processor.ingestion_service import DocumentIngestionService, IngestionProgress
+from document_processor.storage import remove_if_unreferenced
+from rag_engine.services import get_ingestion_service
+
+
+class IngestionJobProgress(IngestionProgress):
+    """Persists ingestion progress on an IngestionJob row"""
+
+    def __init__(self, job: IngestionJob, min_interval: float = 1.0):
+        self.job = job
+        self.min_interval = min_interval
+        self._last_saved = 0.0
+        self._changes = {}
+
+    def stage(self, stage: str):
+        self._update(force=True, stage=stage)
+
+    def document_created(self, document: SourceDocument):
+        self.job.document = document
+        self._update(force=True, document=document)
+
+    def pages_parsed(self, parsed: int, total: int = None):
+        self._update(pages_parsed=parsed, pages_total=total if total is not None else parsed)
+
+    def chunks_planned(self, total: int):
+        self._update(force=True, chunks_total=total)
+
+    def chunks_embedded(self, embedded: int):
+        self._update(chunks_embedded=embedded)
+
+    def flush(self):
+        self._update(force=True)
+
+    def _update(self, force: bool = False, **fields):
+        self._changes.update(fields)
+        now = time.monotonic()
+
+        if not force and now - self._last_saved < self.min_interval:
+            return
+
+        changes, self._changes = self._changes, {}
+        for name, value in changes.items():
+            setattr(self.job, name, value)
+        changes['heartbeat_at'] = timezone.now()
+        IngestionJob.objects.filter(id=self.job.id).update(**changes)
+        self._last_saved = now
+
+
+class _Heartbeat:
+    """Keeps a running job's heartbeat fresh while a long stage blocks the worker"""
+
+    def __init__(self, job_id: int, interval: float):
+        self.job_id = job_id
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                IngestionJob.objects.filter(id=self.job_id, status='running').update(
+                    heartbeat_at=timezone.now()
+                )
+        finally:
+            close_old_connections()
+
+
+class IngestionJobRunner:
+    """Claims and executes ingestion jobs stored in the database"""
+
+    def __init__(self, worker_id: str = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stale_after = settings.INGESTION_JOB_STALE_AFTER
+        self.retry_delay = settings.INGESTION_JOB_RETRY_DELAY
+
+    def requeue_stale_jobs(self) -> int:
+        """Return jobs whose worker stopped heartbeating to the queue, or fail them"""
+        cutoff = timezone.now() - timedelta(seconds=self.stale_after)
+        stale = IngestionJob.objects.filter(status='running').filter(
+            Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+        )
+
+        exhausted = stale.filter(attempts__gte=F('max_attempts')).update(
+            status='failed',
+            error='Worker stopped responding',
+            finished_at=timezone.now()
+        )
+        requeued = stale.update(
+            status='pending',
+            stage='queued',
+            available_at=timezone.now(),
+            worker_id=''
+        )
+        return exhausted + requeued
+
+    def claim_next_job(self) -> Optional[IngestionJob]:
+        """Lock and mark the oldest available pending job as running"""
+        self.requeue_stale_jobs()
+
+        with transaction.atomic():
+            job = (
+                IngestionJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(status='pending', available_at__lte=timezone.now())
+                .order_by('available_at', 'id')
+                .first()
+            )
+            if job is None:
+                return None
+
+            now = timezone.now()
+            job.status = 'running'
+            job.attempts += 1
+            job.worker_id = self.worker_id
+            job.started_at = now
+            job.heartbeat_at = now
+            job.error = ''
+            job.save(update_fields=['status', 'attempts', 'worker_id', 'started_at', 'heartbeat_at', 'error'])
+
+        return job
+
+    def run_job(self, job: IngestionJob, service: DocumentIngestionService = None):
+        """Execute a claimed job, recording success, retry or failure"""
+        service = service or get_ingestion_service()
+        progress = IngestionJobProgress(job)
+
+        try:
+            with _Heartbeat(job.id, max(self.stale_after / 3, 1)):
+                if job.kind == 'reindex' or job.document_id:
+                    # A retried ingest job that already created its document reindexes it
+                    # instead of creating a duplicate.
+                    document = service.reindex_document(job.document_id, progress=progress)
+                else:
+                    document = service.ingest_document(
+                        file_path=job.file_path,
+                        title=job.title,
+                        author=job.author,
+                        user=job.uploaded_by,
+                        additional_metadata=job.metadata,
+                        progress=progress,
+                        collection=job.collection
+                    )
+            progress.flush()
+
+            IngestionJob.objects.filter(id=job.id).update(
+                status='succeeded',
+                stage='done',
+                document=document,
+                finished_at=timezone.now(),
+                heartbeat_at=timezone.now()
+            )
+        except SourceDocument.DoesNotExist:
+            self._fail(job, 'Document not found', retry=False)
+        except Exception as e:
+            self._fail(job, str(e), retry=job.attempts < job.max_attempts)
+
+    def _fail(self, job: IngestionJob, error: str, retry: bool):
+        if retry:
+            IngestionJob.objects.filter(id=job.id).update(
+                status='pending',
+                stage='queued',
+                error=error,
+                worker_id='',
+                available_at=timezone.now() + timedelta(seconds=self.retry_delay * job.attempts)
+            )
+            return
+
+        IngestionJob.objects.filter(id=job.id).update(
+            status='failed',
+            error=error,
+            finished_at=timezone.now()
+        )
+
+        job.refresh_from_db(fields=['document'])
+        if job.kind == 'ingest' and job.document_id is None:
+            remove_if_unreferenced(job.file_path)
+
+
+class IngestionWorkerPool:
+    """Process-local pool of threads that drain the ingestion job table
+
+    Only processes that start a pool explicitly (``run_ingestion_workers``) claim jobs;
+    web processes merely enqueue them.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, num_workers: int = None, poll_interval: float = None):
+        self.num_workers = num_workers or settings.INGESTION_WORKERS
+        self.poll_interval = poll_interval or settings.INGESTION_WORKER_POLL_INTERVAL
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls) -> 'IngestionWorkerPool':
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def start_process_pool(cls, num_workers: int = None) -> 'IngestionWorkerPool':
+        """Create and start this process's pool, so jobs enqueued here wake it"""
+        with cls._instance_lock:
+            cls._instance = cls(num_workers=num_workers)
+        cls._instance.start()
+        return cls._instance
+
+    @property
+    def started(self) -> bool:
+        return bool(self._threads)
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.num_workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"ingestion-worker-{index}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def notify(self):
+        """Wake idle workers after a job was enqueued (no-op where no pool was started)"""
+        if self.started:
+            self._wakeup.set()
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _worker_loop(self):
+        runner = IngestionJobRunner()
+        service = get_ingestion_service()
+
+        while not self._stopping.is_set():
+            close_old_connections()
+            try:
+                job = runner.claim_next_job()
+            except Exception:
+                job = None
+
+            if job is None:
+                # Idle time goes to removing superseded chunk generations, one short batch
+                # per pass so new jobs are still picked up promptly.
+                try:
+                    collected = service.collect_stale_chunks()
+                except Exception:
+                    collected = 0
+                if not collected:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                continue
+
+            runner.run_job(job, service)
+
+        close_old_connections()
+
+
+def enqueue_ingestion_job(**fields) -> IngestionJob:
+    """Create a pending job and wake the local worker pool"""
+    fields.setdefault('max_attempts', settings.INGESTION_JOB_MAX_ATTEMPTS)
+    job = IngestionJob.objects.create(**fields)
+    transaction.on_commit(IngestionWorkerPool.get().notify)
+    return job
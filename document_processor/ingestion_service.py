@@ -1,22 +1,109 @@
 import os
-from typing import Dict, List
+from typing import Dict, Iterator, List, Tuple
 from django.conf import settings
 from django.core.files.storage import default_storage
-from rag_engine.models import SourceDocument, DocumentChunk
+from django.db import transaction
+from django.db.models import Avg
+from rag_engine.chunk_storage import TextCompressor, compact_storage_enabled
+from rag_engine.embedding_versions import extra_embedding_tags, primary_embedding_tag
+from rag_engine.models import ChunkEmbedding, Collection, SourceDocument, DocumentChunk, DocumentText
 from rag_engine.rag_service import GeminiService
+from rag_engine.rate_limit import BACKGROUND, gemini_call_context
 from document_processor.parsers import DocumentParser, TextNormalizer, TextChunker
+from document_processor.storage import hash_file, remove_if_unreferenced
+from document_processor.telemetry import IngestionTelemetry
+
+# Bump when parsing, cleaning or chunking changes what chunks a file produces.
+PARSER_VERSION = '2'
+
+
+class IngestionProgress:
+    """No-op progress reporter; subclasses persist ingestion progress somewhere"""
+
+    def stage(self, stage: str):
+        pass
+
+    def document_created(self, document: SourceDocument):
+        pass
+
+    def pages_parsed(self, parsed: int, total: int = None):
+        pass
+
+    def chunks_planned(self, total: int):
+        pass
+
+    def chunks_embedded(self, embedded: int):
+        pass
 
 
 class DocumentIngestionService:
-    """Service for ingesting documents into the RAG system"""
+    """Service for ingesting documents into the RAG system
+
+    Documents flow through a streaming pipeline: pages are parsed lazily, cleaned one
+    at a time, chunked with overlap carried across page boundaries, and embedded and
+    inserted in fixed-size batches, so peak memory does not grow with document size.
+    """
 
-    def __init__(self):
-        self.gemini_service = GeminiService()
+    def __init__(self, gemini_service: GeminiService = None):
+        self.gemini_service = gemini_service or GeminiService()
         self.parser = DocumentParser()
         self.normalizer = TextNormalizer()
         self.chunker = TextChunker()
         self.chunk_size = settings.CHUNK_SIZE
         self.chunk_overlap = settings.CHUNK_OVERLAP
+        self.batch_size = settings.INGESTION_BATCH_SIZE
+
+    @property
+    def ingestion_signature(self) -> str:
+        """Identifies the settings that determine a document's chunks and embeddings"""
+        return (
+            f"parser={PARSER_VERSION};chunk_size={self.chunk_size};"
+            f"overlap={self.chunk_overlap};embedding={primary_embedding_tag()}"
+        )
+
+    def find_ingested_duplicate(self, content_hash: str, collection: Collection = None):
+        """Return a fully ingested document of the collection with the same content and settings"""
+        collection = collection or Collection.get_default()
+        candidates = SourceDocument.objects.filter(
+            collection=collection,
+            content_hash=content_hash,
+            ingestion_signature=self.ingestion_signature,
+            canonical_document__isnull=True
+        ).order_by('id')
+
+        for document in candidates[:5]:
+            if document.ingestion_jobs.filter(status__in=('pending', 'running')).exists():
+                continue
+            if document.chunks.active().exists():
+                return document
+        return None
+
+    def create_alias(
+        self,
+        canonical: SourceDocument,
+        title: str = None,
+        author: str = None,
+        user=None,
+        additional_metadata: Dict = None
+    ) -> SourceDocument:
+        """Register a duplicate upload as a document that reuses the canonical chunks"""
+        metadata = dict(canonical.metadata)
+        if additional_metadata:
+            metadata.update(additional_metadata)
+
+        return SourceDocument.objects.create(
+            collection_id=canonical.collection_id,
+            title=title or canonical.title,
+            author=author or canonical.author,
+            file_path=canonical.file_path,
+            file_type=canonical.file_type,
+            file_size=canonical.file_size,
+            content_hash=canonical.content_hash,
+            ingestion_signature=canonical.ingestion_signature,
+            canonical_document=canonical,
+            metadata=metadata,
+            uploaded_by=user
+        )
 
     def ingest_document(
         self,
@@ -24,19 +111,78 @@ class DocumentIngestionService:
         title: str = None,
         author: str = None,
         user=None,
-        additional_metadata: Dict = None
+        additional_metadata: Dict = None,
+        progress: IngestionProgress = None,
+        content_hash: str = None,
+        collection: Collection = None
     ) -> SourceDocument:
-        """Ingest a document into the RAG system"""
-        
+        """Ingest a document into the RAG system
+
+        Chunks are written to a new, inactive generation that retrieval only sees once
+        every chunk (and, in compact mode, the document text) is stored; a failed
+        ingestion removes what it wrote. Stage timings, throughput and peak memory are
+        recorded as an IngestionRun, whether the ingestion succeeds or not.
+        """
+        progress = progress or IngestionProgress()
+        telemetry = IngestionTelemetry('ingest')
+        telemetry.start()
+
         file_extension = os.path.splitext(file_path)[1].lower()
-        
-        if file_extension == '.pdf':
-            text, doc_metadata = self.parser.parse_pdf(file_path)
-        elif file_extension == '.docx':
-            text, doc_metadata = self.parser.parse_docx(file_path)
-        else:
-            raise ValueError(f"Unsupported file type: {file_extension}")
+        source_document = None
+        generation = None
 
+        try:
+            progress.stage('parsing')
+            with telemetry.timed('parsing'):
+                segments, doc_metadata = self._open_file(file_path, file_extension)
+
+            with telemetry.timed('saving'):
+                source_document = self.create_source_document(
+                    file_path=file_path,
+                    doc_metadata=doc_metadata,
+                    title=title,
+                    author=author,
+                    user=user,
+                    additional_metadata=additional_metadata,
+                    content_hash=content_hash,
+                    collection=collection
+                )
+            progress.document_created(source_document)
+            generation = self.allocate_generation(source_document)
+
+            compressor = TextCompressor() if compact_storage_enabled() else None
+            chunks = self._iter_chunks(segments, file_extension, doc_metadata, progress, compressor, telemetry)
+            telemetry.chunks = self._store_chunks(
+                source_document, chunks, progress, generation=generation, telemetry=telemetry
+            )
+            progress.stage('saving')
+            with telemetry.timed('saving'):
+                if compressor is not None:
+                    self.store_text(source_document, compressor.finish(), compressor.length, generation=generation)
+                if self.activate_generation(source_document, generation):
+                    self.update_centroid(source_document, generation)
+        except Exception as e:
+            if generation is not None:
+                self._discard_generation(source_document, generation)
+            self._record_run(telemetry, source_document, file_path, file_extension, error=str(e) or type(e).__name__)
+            raise
+
+        self._record_run(telemetry, source_document, file_path, file_extension)
+        return source_document
+
+    def create_source_document(
+        self,
+        file_path: str,
+        doc_metadata: Dict,
+        title: str = None,
+        author: str = None,
+        user=None,
+        additional_metadata: Dict = None,
+        content_hash: str = None,
+        collection: Collection = None
+    ) -> SourceDocument:
+        """Create the SourceDocument row for a parsed file"""
+        file_extension = os.path.splitext(file_path)[1].lower()
         basic_metadata = self.parser.extract_metadata(file_path, file_extension)
         
         if additional_metadata:
@@ -49,95 +195,343 @@ class DocumentIngestionService:
         if not author:
             author = doc_metadata.get('author', '')
 
-        source_document = SourceDocument.objects.create(
+        return SourceDocument.objects.create(
+            collection=collection or Collection.get_default(),
             title=title,
             author=author,
             file_path=file_path,
             file_type=file_extension,
             file_size=basic_metadata['file_size'],
+            content_hash=content_hash or hash_file(file_path),
+            ingestion_signature=self.ingestion_signature,
             metadata=doc_metadata,
             uploaded_by=user
         )
 
-        cleaned_text = self.normalizer.process_text(text, normalize=False)
-        
-        chunks = self.chunker.chunk_text(
-            cleaned_text,
-            self.chunk_size,
-            self.chunk_overlap
-        )
+    def _open_file(self, file_path: str, file_extension: str) -> Tuple[Iterator[str], Dict]:
+        """Open a file, returning a lazy iterator over its pages/paragraphs and its metadata"""
+        if file_extension == '.pdf':
+            return self.parser.stream_pdf(
+                file_path,
+                parallel_min_pages=settings.PDF_PARALLEL_MIN_PAGES,
+                max_workers=settings.PDF_PARALLEL_WORKERS or None
+            )
+        if file_extension == '.docx':
+            return self.parser.stream_docx(file_path)
+        raise ValueError(f"Unsupported file type: {file_extension}")
 
-        self._create_chunks_with_embeddings(source_document, chunks, doc_metadata)
+    def _iter_chunks(
+        self,
+        segments: Iterator[str],
+        file_extension: str,
+        doc_metadata: Dict,
+        progress: IngestionProgress,
+        compressor: TextCompressor = None,
+        telemetry: IngestionTelemetry = None
+    ) -> Iterator[Dict]:
+        """Stream segments through the normalizer and chunker, reporting pages as they pass
 
-        return source_document
+        A compressor, when given, also receives the cleaned text for compact storage.
+        Each layer's time is charged to its stage in ``telemetry``.
+        """
+        telemetry = telemetry or IngestionTelemetry()
+        total_pages = doc_metadata.get('num_pages', 0)
+        segments = telemetry.wrap(telemetry.count_pages(segments), 'parsing')
+
+        def counted(items):
+            for number, item in enumerate(items, start=1):
+                yield item
+                if total_pages:
+                    progress.pages_parsed(number, total_pages)
+
+        cleaned = telemetry.wrap(self.normalizer.clean_segments(counted(segments)), 'normalizing')
+        if file_extension != '.pdf':
+            # DOCX paragraphs are not pages, so chunks carry no page numbers.
+            cleaned = ((None, text) for _, text in cleaned)
+        if compressor is not None:
+            cleaned = telemetry.wrap(compressor.tee(cleaned), 'compressing')
+
+        return telemetry.wrap(self.chunker.iter_chunks(cleaned, self.chunk_size, self.chunk_overlap), 'chunking')
 
-    def _create_chunks_with_embeddings(
+    def _store_chunks(
         self,
         document: SourceDocument,
-        chunks: List[Dict],
-        doc_metadata: Dict
-    ):
-        """Create document chunks with embeddings"""
-        chunk_objects = []
+        chunks: Iterator[Dict],
+        progress: IngestionProgress = None,
+        generation: int = None,
+        telemetry: IngestionTelemetry = None
+    ) -> int:
+        """Embed and insert chunks in fixed-size batches, returning how many were stored"""
+        progress = progress or IngestionProgress()
+        stored = 0
+        batch = []
 
+        progress.stage('embedding')
         for chunk_data in chunks:
-            embedding = self.gemini_service.generate_embedding(chunk_data['content'])
-            
-            chunk_metadata = {
-                'title': document.title,
-                'author': document.author,
-                'start_position': chunk_data['start_position'],
-                'end_position': chunk_data['end_position'],
+            batch.append(chunk_data)
+            if len(batch) >= self.batch_size:
+                stored += self.store_chunk_batch(document, batch, generation=generation, telemetry=telemetry)
+                progress.chunks_embedded(stored)
+                batch = []
+
+        if batch:
+            stored += self.store_chunk_batch(document, batch, generation=generation, telemetry=telemetry)
+            progress.chunks_embedded(stored)
+
+        progress.chunks_planned(stored)
+        return stored
+
+    def store_chunk_batch(
+        self,
+        document: SourceDocument,
+        batch: List[Dict],
+        embeddings: List[List[float]] = None,
+        generation: int = None,
+        compact: bool = None,
+        telemetry: IngestionTelemetry = None
+    ) -> int:
+        """Insert one batch of chunks, embedding it first unless embeddings are given
+
+        Chunks go into the document's active generation unless another one is given.
+        Compact chunks (CHUNK_STORAGE_MODE=compact by default) keep only their offsets
+        and page numbers; their text comes from the document text saved by store_text.
+        Every version in EMBEDDING_EXTRA_MODELS (and SEARCH_EMBEDDING_MODEL) is embedded
+        and stored alongside.
+        """
+        if generation is None:
+            generation = document.active_generation
+        if compact is None:
+            compact = compact_storage_enabled()
+        telemetry = telemetry or IngestionTelemetry()
+
+        texts = [chunk_data['content'] for chunk_data in batch]
+        # Ingestion yields Gemini quota to chat requests.
+        with gemini_call_context(BACKGROUND), telemetry.timed('embedding'):
+            if embeddings is None:
+                embeddings = telemetry.embedding_call(self.gemini_service.generate_embeddings, texts)
+            extra_embeddings = {
+                tag: telemetry.embedding_call(self.gemini_service.generate_embeddings, texts, model_tag=tag)
+                for tag in extra_embedding_tags()
             }
 
-            chunk = DocumentChunk(
+        chunk_objects = []
+        for chunk_data, embedding in zip(batch, embeddings):
+            if compact:
+                chunk_metadata = {}
+            else:
+                chunk_metadata = {
+                    'title': document.title,
+                    'author': document.author,
+                    'start_position': chunk_data['start_position'],
+                    'end_position': chunk_data['end_position'],
+                }
+            if 'page_start' in chunk_data:
+                chunk_metadata['page_start'] = chunk_data['page_start']
+                chunk_metadata['page_end'] = chunk_data['page_end']
+
+            chunk_objects.append(DocumentChunk(
                 document=document,
-                content=chunk_data['content'],
+                collection_id=document.collection_id,
+                content='' if compact else chunk_data['content'],
                 chunk_index=chunk_data['chunk_index'],
+                generation=generation,
+                start_offset=chunk_data['start_position'] if compact else None,
+                end_offset=chunk_data['end_position'] if compact else None,
                 metadata=chunk_metadata,
                 embedding=embedding
-            )
-            chunk_objects.append(chunk)
+            ))
 
-        DocumentChunk.objects.bulk_create(chunk_objects)
+        with telemetry.timed('saving'), transaction.atomic():
+            DocumentChunk.objects.bulk_create(chunk_objects)
+            ChunkEmbedding.objects.bulk_create([
+                ChunkEmbedding(chunk=chunk, model=tag, embedding=vector)
+                for tag, vectors in extra_embeddings.items()
+                for chunk, vector in zip(chunk_objects, vectors)
+            ])
+        return len(chunk_objects)
+
+    def store_text(self, document: SourceDocument, compressed_text: bytes, length: int, generation: int = None):
+        """Save the compressed document text that compact chunks of a generation point into"""
+        if generation is None:
+            generation = document.active_generation
+        DocumentText.objects.update_or_create(
+            document=document,
+            generation=generation,
+            defaults={'compressed_text': compressed_text, 'length': length}
+        )
+
+    def update_centroid(self, document: SourceDocument, generation: int = None):
+        """Store the mean of a generation's chunk embeddings as the document's routing centroid
+
+        Cosine distance ignores length, so the mean points the same way as the sum of
+        the chunk embeddings; a document without chunks gets no centroid.
+        """
+        if generation is None:
+            generation = document.active_generation
+        centroid = DocumentChunk.objects.filter(document=document, generation=generation).aggregate(
+            centroid=Avg('embedding')
+        )['centroid']
+        SourceDocument.objects.filter(id=document.id).update(centroid=centroid)
+        document.centroid = centroid
 
     def delete_document(self, document_id: int):
-        """Delete a document and all its chunks"""
+        """Delete a document and all its chunks
+
+        Deleting a document that has aliases hands its chunks to the oldest alias, and
+        the stored file is only removed once no document references it.
+        """
         try:
-            document = SourceDocument.objects.get(id=document_id)
-            
-            if os.path.exists(document.file_path):
-                os.remove(document.file_path)
-            
-            document.delete()
+            with transaction.atomic():
+                document = SourceDocument.objects.select_for_update().get(id=document_id)
+                successor = document.aliases.order_by('id').first()
+
+                if successor is not None:
+                    DocumentChunk.objects.filter(document=document).update(document=successor)
+                    DocumentText.objects.filter(document=document).update(document=successor)
+                    document.aliases.exclude(id=successor.id).update(canonical_document=successor)
+                    successor.canonical_document = None
+                    successor.active_generation = document.active_generation
+                    successor.latest_generation = document.latest_generation
+                    successor.has_stale_chunks = document.has_stale_chunks
+                    successor.centroid = document.centroid
+                    successor.save(update_fields=[
+                        'canonical_document', 'active_generation', 'latest_generation', 'has_stale_chunks',
+                        'centroid'
+                    ])
+
+                document.delete()
+
+            remove_if_unreferenced(document.file_path)
             
             return True
         except SourceDocument.DoesNotExist:
             return False
 
-    def reindex_document(self, document_id: int) -> SourceDocument:
-        """Reindex a document (regenerate chunks and embeddings)"""
-        document = SourceDocument.objects.get(id=document_id)
-        
-        document.chunks.all().delete()
-        
+    def reindex_document(self, document_id: int, progress: IngestionProgress = None) -> SourceDocument:
+        """Reindex a document (regenerate chunks and embeddings)
+
+        The new chunks are written as a shadow generation while retrieval keeps serving
+        the active one; the document then switches to them in one short transaction and
+        the old generation is left for ``collect_stale_chunks``.
+        """
+        progress = progress or IngestionProgress()
+        document = SourceDocument.objects.get(id=document_id).chunk_source
+        progress.document_created(document)
+
+        telemetry = IngestionTelemetry('reindex')
+        telemetry.start()
+        generation = self.allocate_generation(document)
         file_extension = document.file_type
-        
-        if file_extension == '.pdf':
-            text, _ = self.parser.parse_pdf(document.file_path)
-        elif file_extension == '.docx':
-            text, _ = self.parser.parse_docx(document.file_path)
-        else:
-            raise ValueError(f"Unsupported file type: {file_extension}")
 
-        cleaned_text = self.normalizer.process_text(text, normalize=False)
-        
-        chunks = self.chunker.chunk_text(
-            cleaned_text,
-            self.chunk_size,
-            self.chunk_overlap
-        )
+        try:
+            progress.stage('parsing')
+            with telemetry.timed('parsing'):
+                segments, doc_metadata = self._open_file(document.file_path, file_extension)
 
-        self._create_chunks_with_embeddings(document, chunks, document.metadata)
+            compressor = TextCompressor() if compact_storage_enabled() else None
+            chunks = self._iter_chunks(segments, file_extension, doc_metadata, progress, compressor, telemetry)
+            telemetry.chunks = self._store_chunks(
+                document, chunks, progress, generation=generation, telemetry=telemetry
+            )
+            if compressor is not None:
+                with telemetry.timed('saving'):
+                    self.store_text(document, compressor.finish(), compressor.length, generation=generation)
+        except Exception as e:
+            self._discard_generation(document, generation)
+            self._record_run(telemetry, document, document.file_path, file_extension, error=str(e) or type(e).__name__)
+            raise
+
+        progress.stage('saving')
+        with telemetry.timed('saving'):
+            if self.activate_generation(document, generation):
+                self.update_centroid(document, generation)
+        self._record_run(telemetry, document, document.file_path, file_extension)
 
         return document
+
+    def _record_run(
+        self,
+        telemetry: IngestionTelemetry,
+        document: SourceDocument,
+        file_path: str,
+        file_type: str,
+        error: str = ''
+    ):
+        """Save the run's telemetry; a failure here never fails the ingestion itself"""
+        try:
+            telemetry.save(document=document, file_path=file_path, file_type=file_type, error=error)
+        except Exception:
+            pass
+
+    def allocate_generation(self, document: SourceDocument) -> int:
+        """Reserve a new chunk generation number to build this document's chunks in"""
+        with transaction.atomic():
+            locked = SourceDocument.objects.select_for_update().get(id=document.id)
+            locked.latest_generation += 1
+            locked.save(update_fields=['latest_generation'])
+
+        document.latest_generation = locked.latest_generation
+        return locked.latest_generation
+
+    def activate_generation(self, document: SourceDocument, generation: int) -> bool:
+        """Make a fully built generation the one retrieval serves
+
+        Returns False when a newer generation was activated meanwhile, in which case
+        this one is simply left to the garbage collector.
+        """
+        with transaction.atomic():
+            locked = SourceDocument.objects.select_for_update().get(id=document.id)
+            if generation <= locked.active_generation:
+                locked.has_stale_chunks = True
+                locked.save(update_fields=['has_stale_chunks'])
+                return False
+
+            locked.active_generation = generation
+            locked.has_stale_chunks = True
+            locked.ingestion_signature = self.ingestion_signature
+            locked.save(update_fields=['active_generation', 'has_stale_chunks', 'ingestion_signature'])
+            locked.aliases.update(ingestion_signature=self.ingestion_signature)
+
+        document.active_generation = generation
+        document.ingestion_signature = self.ingestion_signature
+        return True
+
+    def _discard_generation(self, document: SourceDocument, generation: int):
+        """Best-effort removal of a shadow generation whose build failed"""
+        try:
+            queryset = DocumentChunk.objects.filter(document=document, generation=generation)
+            while self._delete_chunk_batch(queryset):
+                pass
+            DocumentText.objects.filter(document=document, generation=generation).delete()
+        except Exception:
+            # Leftover rows are never served and go once a later reindex supersedes them.
+            pass
+
+    def collect_stale_chunks(self, batch_size: int = None) -> int:
+        """Delete one small batch of superseded chunks, returning how many were removed
+
+        Called repeatedly by idle ingestion workers so that old generations are removed
+        in short transactions instead of one long delete on the chunk table.
+        """
+        for document in SourceDocument.objects.filter(has_stale_chunks=True).order_by('id')[:10]:
+            deleted = self._delete_chunk_batch(DocumentChunk.objects.stale().filter(document=document), batch_size)
+            if deleted:
+                return deleted
+
+            # Nothing left; drop the texts of superseded generations and clear the flag
+            # unless a reindex moved the generations meanwhile.
+            DocumentText.objects.filter(document=document, generation__lt=document.active_generation).delete()
+            SourceDocument.objects.filter(
+                id=document.id,
+                active_generation=document.active_generation,
+                latest_generation=document.latest_generation
+            ).update(has_stale_chunks=False)
+        return 0
+
+    def _delete_chunk_batch(self, queryset, batch_size: int = None) -> int:
+        batch_size = batch_size or settings.CHUNK_GC_BATCH_SIZE
+        ids = list(queryset.order_by().values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        DocumentChunk.objects.filter(id__in=ids).delete()
+        return len(ids)
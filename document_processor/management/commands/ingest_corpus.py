@@ -0,0 +1,247 @@
+import json
+import multiprocessing
+import os
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rag_engine.chunk_storage import compact_storage_enabled
+from rag_engine.models import Collection
+from rag_engine.rate_limit import BACKGROUND, gemini_call_context
+from rag_engine.services import get_ingestion_service
+from document_processor.parsers import parse_and_chunk_file
+from document_processor.storage import HASH_BLOCK_SIZE, remove_if_unreferenced, store_content
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx')
+
+
+class Command(BaseCommand):
+    help = 'Bulk-ingest a directory or zip archive of PDF/DOCX files with resumable checkpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory or .zip archive to ingest')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Parser processes')
+        parser.add_argument('--embed-workers', type=int, default=4, help='Concurrent embedding requests')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: <source>.checkpoint.jsonl)')
+        parser.add_argument('--report-every', type=float, default=10.0, help='Seconds between progress lines')
+        parser.add_argument('--collection', help='Slug of the collection to ingest into (default collection if omitted)')
+
+    def handle(self, *args, **options):
+        source = os.path.abspath(options['source'])
+        if not os.path.exists(source):
+            raise CommandError(f"{source} does not exist")
+
+        self.archive = None
+        if os.path.isfile(source):
+            if not zipfile.is_zipfile(source):
+                raise CommandError(f"{source} is neither a directory nor a zip archive")
+            self.archive = zipfile.ZipFile(source)
+
+        if options['collection']:
+            self.collection = Collection.objects.filter(slug=options['collection']).first()
+            if self.collection is None:
+                raise CommandError(f"Collection '{options['collection']}' does not exist")
+        else:
+            self.collection = Collection.get_default()
+
+        self.source = source
+        self.checkpoint_path = options['checkpoint'] or source.rstrip(os.sep) + '.checkpoint.jsonl'
+        self.service = get_ingestion_service()
+        self.seen_hashes = set()
+        self.stats = {'done': 0, 'skipped': 0, 'failed': 0, 'chunks': 0}
+        self.failures = {}
+
+        completed = self._load_checkpoint()
+        entries = [key for key in self._list_entries() if key not in completed]
+        self.stdout.write(
+            f"{len(entries)} files to ingest ({len(completed)} already recorded in {self.checkpoint_path})"
+        )
+
+        workers = max(1, options['workers'])
+        parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        embed_pool = ThreadPoolExecutor(max_workers=max(1, options['embed_workers']))
+        pending_entries = iter(entries)
+        in_flight = {}
+
+        self.started = time.monotonic()
+        last_report = self.started
+
+        with open(self.checkpoint_path, 'a') as self.checkpoint:
+            try:
+                for _ in range(workers * 2):
+                    if not self._submit_next(pending_entries, parse_pool, in_flight):
+                        break
+
+                while in_flight:
+                    finished, _ = wait(in_flight, timeout=options['report_every'], return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        key, file_path, content_hash = in_flight.pop(future)
+                        try:
+                            chunks, metadata, text = future.result()
+                            document_id = self._store(
+                                key, file_path, content_hash, chunks, metadata, text, embed_pool
+                            )
+                            self.stats['chunks'] += len(chunks)
+                            self._record(key, 'done', hash=content_hash, document_id=document_id, chunks=len(chunks))
+                        except Exception as e:
+                            self.seen_hashes.discard(content_hash)
+                            remove_if_unreferenced(file_path)
+                            self._record(key, 'failed', hash=content_hash, error=str(e))
+                        self._submit_next(pending_entries, parse_pool, in_flight)
+
+                    if time.monotonic() - last_report >= options['report_every']:
+                        self._report(len(entries))
+                        last_report = time.monotonic()
+            finally:
+                parse_pool.shutdown(cancel_futures=True)
+                embed_pool.shutdown(cancel_futures=True)
+
+        self._report(len(entries))
+        self._summary()
+
+    def _list_entries(self):
+        if self.archive is not None:
+            names = [info.filename for info in self.archive.infolist() if not info.is_dir()]
+        else:
+            names = []
+            for root, _, files in os.walk(self.source):
+                for name in files:
+                    names.append(os.path.relpath(os.path.join(root, name), self.source))
+        return sorted(name for name in names if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS)
+
+    def _load_checkpoint(self):
+        """Return keys finished in a previous run; failed files are retried"""
+        statuses = {}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as checkpoint:
+                for line in checkpoint:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    statuses[record['key']] = record['status']
+        return {key for key, status in statuses.items() if status in ('done', 'skipped')}
+
+    def _record(self, key, status, **fields):
+        self.stats[status] += 1
+        if status == 'failed':
+            self.failures[key] = fields.get('error', '')
+        self.checkpoint.write(json.dumps({'key': key, 'status': status, **fields}) + '\n')
+        self.checkpoint.flush()
+        os.fsync(self.checkpoint.fileno())
+
+    def _submit_next(self, pending_entries, parse_pool, in_flight):
+        """Queue the next new file for parsing; returns False when no entries are left"""
+        for key in pending_entries:
+            try:
+                file_path, content_hash = self._materialize(key)
+            except Exception as e:
+                self._record(key, 'failed', error=str(e))
+                continue
+
+            if file_path is None:
+                self._record(key, 'skipped', hash=content_hash)
+                continue
+
+            future = parse_pool.submit(
+                parse_and_chunk_file, file_path, settings.CHUNK_SIZE, settings.CHUNK_OVERLAP,
+                compact_storage_enabled()
+            )
+            in_flight[future] = (key, file_path, content_hash)
+            return True
+        return False
+
+    def _materialize(self, key):
+        """Copy an entry into content storage and return its stored path, or None when already ingested
+
+        Documents always point at their own stored copy, so deleting one never touches
+        the files of the corpus being imported.
+        """
+        file_path, content_hash = self._copy(key)
+
+        if content_hash in self.seen_hashes:
+            # Same content earlier in this run, stored at this same path.
+            return None, content_hash
+
+        if self.service.find_ingested_duplicate(content_hash, self.collection) is not None:
+            remove_if_unreferenced(file_path)
+            return None, content_hash
+
+        self.seen_hashes.add(content_hash)
+        return file_path, content_hash
+
+    def _copy(self, key):
+        """Stream a directory file or zip member into content-addressed storage"""
+        extension = os.path.splitext(key)[1].lower()
+        if self.archive is None:
+            source = open(os.path.join(self.source, key), 'rb')
+        else:
+            source = self.archive.open(key)
+        with source:
+            return store_content(iter(lambda: source.read(HASH_BLOCK_SIZE), b''), extension)
+
+    def _store(self, key, file_path, content_hash, chunks, metadata, text, embed_pool):
+        """Create the document and insert its chunks, embedding batches concurrently"""
+        document = self.service.create_source_document(
+            file_path=file_path,
+            doc_metadata=metadata,
+            title=metadata.get('title') or os.path.basename(key),
+            additional_metadata={'corpus_path': key},
+            content_hash=content_hash,
+            collection=self.collection
+        )
+
+        try:
+            # Built as an inactive generation so searches never see a partial document.
+            generation = self.service.allocate_generation(document)
+            batch_size = self.service.batch_size
+            batches = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+            futures = [
+                embed_pool.submit(self._embed_batch, [chunk_data['content'] for chunk_data in batch])
+                for batch in batches
+            ]
+            for batch, future in zip(batches, futures):
+                self.service.store_chunk_batch(
+                    document, batch, future.result(), generation=generation, compact=text is not None
+                )
+            if text is not None:
+                self.service.store_text(document, *text, generation=generation)
+            self.service.activate_generation(document, generation)
+            self.service.update_centroid(document, generation)
+        except Exception:
+            # Leave no half-ingested document behind so a resumed run starts clean.
+            document.delete()
+            raise
+
+        return document.id
+
+    def _embed_batch(self, texts):
+        # Pool threads do not inherit context; bulk ingestion yields Gemini quota to chat.
+        with gemini_call_context(BACKGROUND):
+            return self.service.gemini_service.generate_embeddings(texts)
+
+    def _report(self, total):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        processed = self.stats['done'] + self.stats['skipped'] + self.stats['failed']
+        self.stdout.write(
+            f"[{processed}/{total}] {self.stats['done']} ingested, {self.stats['skipped']} skipped, "
+            f"{self.stats['failed']} failed | {self.stats['done'] / elapsed:.2f} files/s, "
+            f"{self.stats['chunks'] / elapsed:.1f} chunks/s"
+        )
+
+    def _summary(self):
+        elapsed = time.monotonic() - self.started
+        self.stdout.write('=' * 60)
+        self.stdout.write(
+            f"Finished in {elapsed:.1f}s: {self.stats['done']} ingested, {self.stats['skipped']} skipped "
+            f"as duplicates, {self.stats['failed']} failed, {self.stats['chunks']} chunks stored"
+        )
+
+        if not self.failures:
+            self.stdout.write(self.style.SUCCESS('✓ Corpus ingested without failures'))
+            return
+
+        self.stdout.write(self.style.WARNING(f"{len(self.failures)} files failed (rerun to retry them):"))
+        for key, error in sorted(self.failures.items()):
+            self.stdout.write(f"  ✗ {key}: {error}")
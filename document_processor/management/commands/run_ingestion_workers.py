@@ -0,0 +1,27 @@
+import signal
+import threading
+from django.core.management.base import BaseCommand
+from document_processor.ingestion_jobs import IngestionWorkerPool
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of ingestion workers that process queued ingestion jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Number of worker threads')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+
+        signal.signal(signal.SIGINT, lambda *_: stop.set())
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+        pool = IngestionWorkerPool.start_process_pool(num_workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS(f'✓ Started {pool.num_workers} ingestion workers'))
+
+        while not stop.wait(1):
+            pass
+
+        self.stdout.write('Stopping ingestion workers...')
+        pool.stop()
+        self.stdout.write(self.style.SUCCESS('✓ Ingestion workers stopped'))
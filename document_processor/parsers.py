@@ -1,50 +1,170 @@
+import math
+import multiprocessing
 import os
+import re
+import threading
 import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Tuple
-from pypdf import PdfReader
-from docx import Document
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# pypdf and python-docx are imported where they are used so that processes serving only
+# the chat API or admin do not load them.
+
+
+# Pages handled by one PdfReader; fresh readers keep pypdf's object cache bounded.
+PDF_PAGE_RANGE_SIZE = 64
+
+_pdf_pool = None
+_pdf_pool_workers = 0
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Return the shared page-extraction process pool, creating it on first use"""
+    global _pdf_pool, _pdf_pool_workers
+
+    with _pdf_pool_lock:
+        if _pdf_pool is None or _pdf_pool_workers != max_workers:
+            if _pdf_pool is not None:
+                _pdf_pool.shutdown(wait=False)
+            # Spawned workers are safe to start from threaded servers and ingestion workers.
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _pdf_pool_workers = max_workers
+        return _pdf_pool
+
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) with a reader private to this call"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    return [reader.pages[index].extract_text() or '' for index in range(start, end)]
 
 
 class DocumentParser:
     """Handles parsing of different document types"""
 
     @staticmethod
-    def parse_pdf(file_path: str) -> Tuple[str, Dict]:
+    def parse_pdf(
+        file_path: str,
+        parallel_min_pages: int = 0,
+        max_workers: int = None
+    ) -> Tuple[str, Dict]:
         """Parse PDF file and extract text and metadata"""
+        pages, metadata = DocumentParser.parse_pdf_pages(file_path, parallel_min_pages, max_workers)
+        text = "".join(page + "\n" for page in pages)
+        return text, metadata
+
+    @staticmethod
+    def parse_pdf_pages(
+        file_path: str,
+        parallel_min_pages: int = 0,
+        max_workers: int = None
+    ) -> Tuple[List[str], Dict]:
+        """Parse PDF file into per-page text and metadata"""
+        pages, metadata = DocumentParser.stream_pdf(file_path, parallel_min_pages, max_workers)
+        return list(pages), metadata
+
+    @staticmethod
+    def stream_pdf(
+        file_path: str,
+        parallel_min_pages: int = 0,
+        max_workers: int = None
+    ) -> Tuple[Iterator[str], Dict]:
+        """Read PDF metadata and return a lazy iterator over page text
+
+        Documents with at least ``parallel_min_pages`` pages (0 disables) are split
+        into page ranges that are extracted on a process pool.
+        """
+        from pypdf import PdfReader
+
         try:
             reader = PdfReader(file_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
+            num_pages = len(reader.pages)
 
             metadata = {
-                'num_pages': len(reader.pages),
+                'num_pages': num_pages,
                 'title': reader.metadata.get('/Title', '') if reader.metadata else '',
                 'author': reader.metadata.get('/Author', '') if reader.metadata else '',
                 'creation_date': str(reader.metadata.get('/CreationDate', '')) if reader.metadata else '',
             }
+        except Exception as e:
+            raise Exception(f"Error parsing PDF: {str(e)}")
+
+        max_workers = max_workers or os.cpu_count() or 1
+        if not (parallel_min_pages and num_pages >= parallel_min_pages and max_workers > 1):
+            max_workers = 1
+
+        return DocumentParser._iter_pdf_pages(file_path, num_pages, max_workers), metadata
 
-            return text, metadata
+    @staticmethod
+    def _iter_pdf_pages(file_path: str, num_pages: int, max_workers: int) -> Iterator[str]:
+        """Yield page text in order, keeping at most a few page ranges in flight"""
+        try:
+            if max_workers <= 1:
+                for start in range(0, num_pages, PDF_PAGE_RANGE_SIZE):
+                    end = min(start + PDF_PAGE_RANGE_SIZE, num_pages)
+                    yield from _extract_pdf_page_range(file_path, start, end)
+                return
+
+            # A few ranges per worker keeps the pool busy when some pages are much heavier.
+            range_size = max(1, min(PDF_PAGE_RANGE_SIZE, math.ceil(num_pages / (max_workers * 4))))
+            ranges = iter(
+                (start, min(start + range_size, num_pages))
+                for start in range(0, num_pages, range_size)
+            )
+
+            pool = _get_pdf_pool(max_workers)
+            pending = deque()
+            try:
+                for start, end in ranges:
+                    pending.append(pool.submit(_extract_pdf_page_range, file_path, start, end))
+                    if len(pending) >= max_workers * 2:
+                        break
+
+                while pending:
+                    pages = pending.popleft().result()
+                    next_range = next(ranges, None)
+                    if next_range is not None:
+                        pending.append(pool.submit(_extract_pdf_page_range, file_path, *next_range))
+                    yield from pages
+            finally:
+                for future in pending:
+                    future.cancel()
+        except GeneratorExit:
+            raise
         except Exception as e:
             raise Exception(f"Error parsing PDF: {str(e)}")
 
     @staticmethod
     def parse_docx(file_path: str) -> Tuple[str, Dict]:
         """Parse DOCX file and extract text and metadata"""
+        paragraphs, metadata = DocumentParser.stream_docx(file_path)
+        return "\n".join(paragraphs), metadata
+
+    @staticmethod
+    def stream_docx(file_path: str) -> Tuple[Iterator[str], Dict]:
+        """Open DOCX file and return an iterator over paragraph text plus metadata"""
+        from docx import Document
+
         try:
             doc = Document(file_path)
-            text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+            paragraphs = doc.paragraphs
 
             metadata = {
-                'num_paragraphs': len(doc.paragraphs),
+                'num_paragraphs': len(paragraphs),
                 'author': doc.core_properties.author or '',
                 'title': doc.core_properties.title or '',
                 'created': str(doc.core_properties.created) if doc.core_properties.created else '',
                 'modified': str(doc.core_properties.modified) if doc.core_properties.modified else '',
             }
 
-            return text, metadata
+            return (paragraph.text for paragraph in paragraphs), metadata
         except Exception as e:
             raise Exception(f"Error parsing DOCX: {str(e)}")
 
@@ -61,22 +181,82 @@ class DocumentParser:
         }
 
 
+# Texts longer than this are whitespace-collapsed a block at a time, which keeps the
+# token list str.split builds (several times the size of the text) bounded.
+CLEAN_BLOCK_SIZE = 1 << 20
+
+# Runs of non-ASCII characters at most this long are memoized once accent-stripped.
+STRIPPED_RUN_CACHE_LENGTH = 4
+STRIPPED_RUN_CACHE_SIZE = 65536
+
+_NON_ASCII_RUN = re.compile(r'[^\x00-\x7f]+')
+_WHITESPACE = re.compile(r'\s')
+
+
+def _strip_accents(text: str) -> str:
+    return ''.join([c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c)])
+
+
+# Accent-stripped forms of the Latin-1 Supplement and Latin Extended-A/B letters,
+# which cover nearly all the non-ASCII characters of Spanish and other Latin-script text.
+_stripped_runs = {chr(code): _strip_accents(chr(code)) for code in range(0x80, 0x250)}
+
+
+def _stripped_run(match) -> str:
+    run = match.group()
+    stripped = _stripped_runs.get(run)
+    if stripped is None:
+        stripped = _strip_accents(run)
+        if len(run) <= STRIPPED_RUN_CACHE_LENGTH and len(_stripped_runs) < STRIPPED_RUN_CACHE_SIZE:
+            _stripped_runs[run] = stripped
+    return stripped
+
+
 class TextNormalizer:
     """Handles text normalization and cleaning"""
 
     @staticmethod
     def normalize_text(text: str) -> str:
-        """Normalize text by removing accents and special characters"""
-        text = unicodedata.normalize('NFKD', text)
-        text = ''.join([c for c in text if not unicodedata.combining(c)])
-        return text
+        """Normalize text by removing accents and special characters
+
+        Same result as NFKD followed by dropping combining characters. ASCII is left
+        as it is by both, so only the runs of non-ASCII characters between ASCII ones
+        are decomposed; ASCII characters never combine or reorder with their
+        neighbours, so each run normalizes on its own.
+        """
+        if text.isascii():
+            return text
+        return _NON_ASCII_RUN.sub(_stripped_run, text)
 
     @staticmethod
     def clean_text(text: str) -> str:
-        """Clean text by removing extra whitespace and normalizing"""
-        text = ' '.join(text.split())
-        text = text.strip()
-        return text
+        """Clean text by collapsing runs of whitespace to single spaces and trimming the ends"""
+        if len(text) <= CLEAN_BLOCK_SIZE:
+            return ' '.join(text.split())
+
+        # Cut only at whitespace so no word is split across blocks.
+        blocks = []
+        start = 0
+        while start < len(text):
+            match = _WHITESPACE.search(text, start + CLEAN_BLOCK_SIZE)
+            end = match.start() if match else len(text)
+            block = ' '.join(text[start:end].split())
+            if block:
+                blocks.append(block)
+            start = end
+        return ' '.join(blocks)
+
+    @staticmethod
+    def clean_segments(segments: Iterable[str]) -> Iterator[Tuple[int, str]]:
+        """Clean text segments lazily, yielding (1-based segment number, text) for non-empty ones
+
+        Joining the yielded texts with single spaces gives the same result as ``clean_text``
+        applied to the newline-joined segments.
+        """
+        for number, segment in enumerate(segments, start=1):
+            cleaned = TextNormalizer.clean_text(segment)
+            if cleaned:
+                yield number, cleaned
 
     @staticmethod
     def process_text(text: str, normalize: bool = True) -> str:
@@ -121,3 +301,114 @@ class TextChunker:
             chunk_index += 1
 
         return chunks
+
+    @staticmethod
+    def iter_chunks(
+        segments: Iterable[Tuple[Optional[int], str]],
+        chunk_size: int,
+        overlap: int
+    ) -> Iterator[Dict]:
+        """Split a stream of cleaned (page, text) segments into overlapping chunks
+
+        Produces the same chunks as ``chunk_text`` over the space-joined segments while
+        only buffering about one chunk plus one segment. When segments carry page
+        numbers, chunks are tagged with the first and last page they cover.
+        """
+        segments = iter(segments)
+        buffer = ''
+        base = 0
+        total = 0
+        pages = deque()
+        exhausted = False
+        start = 0
+        chunk_index = 0
+
+        def page_at(position):
+            page = None
+            for page_start, page_number in pages:
+                if page_start > position:
+                    break
+                page = page_number
+            return page
+
+        while True:
+            while not exhausted and total <= start + chunk_size:
+                try:
+                    page_number, text = next(segments)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if total:
+                    buffer += ' '
+                    total += 1
+                if page_number is not None:
+                    pages.append((total, page_number))
+                buffer += text
+                total += len(text)
+
+            if start >= total:
+                break
+
+            end = start + chunk_size
+
+            if end >= total:
+                chunk_content = buffer[start - base:]
+            else:
+                chunk_content = buffer[start - base:end - base]
+                last_space = chunk_content.rfind(' ')
+                if last_space != -1 and last_space > chunk_size * 0.5:
+                    end = start + last_space
+                    chunk_content = buffer[start - base:end - base]
+
+            chunk = {
+                'content': chunk_content.strip(),
+                'chunk_index': chunk_index,
+                'start_position': start,
+                'end_position': end,
+            }
+            if pages:
+                chunk['page_start'] = page_at(start)
+                chunk['page_end'] = page_at(max(start, min(end, total) - 1))
+            yield chunk
+
+            start = end - overlap
+            chunk_index += 1
+
+            # Drop consumed text once it is the larger part of the buffer to keep trimming amortised.
+            if start - base > len(buffer) // 2:
+                buffer = buffer[start - base:]
+                base = start
+            while len(pages) > 1 and pages[1][0] <= start:
+                pages.popleft()
+
+
+def parse_and_chunk_file(
+    file_path: str,
+    chunk_size: int,
+    overlap: int,
+    compact: bool = False
+) -> Tuple[List[Dict], Dict, Optional[Tuple[bytes, int]]]:
+    """Parse, clean and chunk a whole file in one call, for use in worker processes
+
+    With ``compact`` the third value is the compressed cleaned text and its length,
+    for compact chunk storage; otherwise it is None.
+    """
+    file_extension = os.path.splitext(file_path)[1].lower()
+
+    if file_extension == '.pdf':
+        segments, metadata = DocumentParser.stream_pdf(file_path)
+        cleaned = TextNormalizer.clean_segments(segments)
+    elif file_extension == '.docx':
+        segments, metadata = DocumentParser.stream_docx(file_path)
+        cleaned = ((None, text) for _, text in TextNormalizer.clean_segments(segments))
+    else:
+        raise ValueError(f"Unsupported file type: {file_extension}")
+
+    if not compact:
+        return list(TextChunker.iter_chunks(cleaned, chunk_size, overlap)), metadata, None
+
+    from rag_engine.chunk_storage import TextCompressor
+
+    compressor = TextCompressor()
+    chunks = list(TextChunker.iter_chunks(compressor.tee(cleaned), chunk_size, overlap))
+    return chunks, metadata, (compressor.finish(), compressor.length)
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import tempfile
+from typing import Iterable, Tuple
+from django.conf import settings
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """Return the SHA-256 hex digest of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as source:
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_path(content_hash: str, extension: str) -> str:
+    """Content-addressed location of a stored file, fanned out over two directory levels"""
+    return os.path.join(
+        settings.MEDIA_ROOT, 'documents', content_hash[:2], content_hash[2:4], content_hash + extension
+    )
+
+
+def store_content(blocks: Iterable[bytes], extension: str) -> Tuple[str, str]:
+    """Write blocks to content-addressed storage, hashing while streaming to disk
+
+    Returns the stored path and SHA-256 hash. Identical content always lands on the
+    same path, so a second copy simply replaces the first with the same bytes.
+    """
+    staging_dir = os.path.join(settings.MEDIA_ROOT, 'documents', 'tmp')
+    os.makedirs(staging_dir, exist_ok=True)
+    digest = hashlib.sha256()
+
+    with tempfile.NamedTemporaryFile(dir=staging_dir, suffix=extension, delete=False) as destination:
+        try:
+            for block in blocks:
+                digest.update(block)
+                destination.write(block)
+        except BaseException:
+            destination.close()
+            os.remove(destination.name)
+            raise
+
+    content_hash = digest.hexdigest()
+    file_path = content_path(content_hash, extension)
+
+    if os.path.exists(file_path):
+        os.remove(destination.name)
+    else:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(destination.name, file_path)
+
+    return file_path, content_hash
+
+
+def is_stored_content(file_path: str) -> bool:
+    """Whether a path lies inside MEDIA_ROOT, where uploads and imported files are stored"""
+    media_root = os.path.realpath(settings.MEDIA_ROOT)
+    return os.path.commonpath([media_root, os.path.realpath(file_path)]) == media_root
+
+
+def remove_if_unreferenced(file_path: str) -> bool:
+    """Delete a stored file unless a document or queued job still points at it
+
+    Files outside MEDIA_ROOT are never deleted; they belong to whoever put them there.
+    """
+    from rag_engine.models import IngestionJob, SourceDocument
+
+    if not is_stored_content(file_path):
+        return False
+    if SourceDocument.objects.filter(file_path=file_path).exists():
+        return False
+    if IngestionJob.objects.filter(file_path=file_path, status__in=('pending', 'running')).exists():
+        return False
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    return True
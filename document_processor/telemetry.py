@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+from django.conf import settings
+from django.utils import timezone
+from rag_engine.usage import TokenUsage, track_usage
+
+_tracing_lock = threading.Lock()
+_tracing_runs = 0
+_tracing_started_here = False
+
+
+def _start_tracing() -> int:
+    """Start tracemalloc for one more run, returning the traced size at its start
+
+    Several ingestions can share a worker process; tracing stays on until the last
+    of them finishes and the peak is only reset when no other run is traced.
+    """
+    global _tracing_runs, _tracing_started_here
+    with _tracing_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started_here = True
+        elif _tracing_runs == 0:
+            tracemalloc.reset_peak()
+        _tracing_runs += 1
+        return tracemalloc.get_traced_memory()[0]
+
+
+def _stop_tracing() -> int:
+    """Finish one traced run, returning the traced peak seen during it"""
+    global _tracing_runs, _tracing_started_here
+    with _tracing_lock:
+        peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+        _tracing_runs -= 1
+        if _tracing_runs == 0 and _tracing_started_here:
+            tracemalloc.stop()
+            _tracing_started_here = False
+        return peak
+
+
+def percentile(values, share):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(share * len(ordered))) - 1))]
+
+
+class IngestionTelemetry:
+    """Collects stage timings, embedding call latencies and peak memory for one ingestion
+
+    Parsing, normalizing and chunking are lazy generators stacked on each other, so
+    each layer is timed while it produces an item and the time its inner layers took
+    is subtracted: every second is counted in exactly one stage. Embedding requests
+    include any wait for Gemini quota. The memory peak is the tracemalloc peak above
+    the traced size at the start, and also covers other ingestions running in the
+    same process meanwhile; PDF pages extracted in worker processes are not traced.
+    """
+
+    def __init__(self, kind: str = 'ingest', trace_memory: bool = None):
+        self.kind = kind
+        self.trace_memory = settings.INGESTION_TRACE_MEMORY if trace_memory is None else trace_memory
+        self.stage_seconds = defaultdict(float)
+        self.embedding_latencies = []
+        self.usage = TokenUsage()
+        self.pages = 0
+        self.chunks = 0
+        self._nested = []
+        self._started = None
+        self._started_at = None
+        self._memory_base = None
+
+    def start(self):
+        self._started_at = timezone.now()
+        self._started = time.perf_counter()
+        if self.trace_memory:
+            self._memory_base = _start_tracing()
+
+    @contextmanager
+    def timed(self, stage: str):
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = self._nested.pop()
+            self.stage_seconds[stage] += elapsed - inner
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def wrap(self, items: Iterable, stage: str) -> Iterator:
+        """Yield from an iterable, charging the time spent producing each item to a stage"""
+        items = iter(items)
+        while True:
+            with self.timed(stage):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            yield item
+
+    def count_pages(self, segments: Iterable) -> Iterator:
+        for segment in segments:
+            self.pages += 1
+            yield segment
+
+    def embedding_call(self, function: Callable, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with track_usage(self.usage):
+                return function(*args, **kwargs)
+        finally:
+            self.embedding_latencies.append((time.perf_counter() - start) * 1000)
+
+    def save(self, document=None, file_path: str = '', file_type: str = '', error: str = ''):
+        """Persist the run as an IngestionRun, stopping memory tracing
+
+        Time spent outside every timed stage (building rows, bookkeeping) is
+        reported as ``other``.
+        """
+        from rag_engine.models import IngestionRun
+
+        total_seconds = time.perf_counter() - self._started
+        peak_memory = None
+        if self._memory_base is not None:
+            peak_memory = max(0, _stop_tracing() - self._memory_base)
+            self._memory_base = None
+        self.stage_seconds['other'] = max(0.0, total_seconds - sum(self.stage_seconds.values()))
+
+        file_size = 0
+        if file_path and os.path.exists(file_path):
+            file_size = os.path.getsize(file_path)
+
+        latencies = self.embedding_latencies
+        return IngestionRun.objects.create(
+            document=document,
+            kind=self.kind,
+            status='failed' if error else 'succeeded',
+            error=error,
+            file_name=os.path.basename(file_path),
+            file_type=file_type,
+            file_size=file_size,
+            pages=self.pages,
+            chunks=self.chunks,
+            stage_seconds={stage: round(seconds, 4) for stage, seconds in self.stage_seconds.items()},
+            total_seconds=total_seconds,
+            pages_per_second=self.pages / total_seconds if total_seconds else None,
+            chunks_per_second=self.chunks / total_seconds if total_seconds else None,
+            embedding_calls=len(latencies),
+            embedding_tokens=self.usage.embedding_tokens,
+            embedding_latency_ms={
+                'p50': round(percentile(latencies, 0.50), 1),
+                'p95': round(percentile(latencies, 0.95), 1),
+                'max': round(max(latencies), 1),
+            } if latencies else {},
+            peak_memory_bytes=peak_memory,
+            started_at=self._started_at,
+        )
@@ -1,3 +1,409 @@
-from django.test import TestCase
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+import docx
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rag_engine.chunk_storage import chunk_content, hydrate_chunks
+from rag_engine.models import DocumentChunk, DocumentText, IngestionJob, SourceDocument
+from document_processor.ingestion_jobs import IngestionJobRunner, IngestionWorkerPool
+from document_processor.ingestion_service import DocumentIngestionService
+from document_processor.storage import remove_if_unreferenced, store_content
 
-# Create your tests here.
+
+def write_docx(file_path: str, paragraphs: int = 12):
+    document = docx.Document()
+    for number in range(paragraphs):
+        document.add_paragraph(f"Section {number} of the employee handbook describes a policy in detail. " * 3)
+    document.save(file_path)
+
+
+class FailingIngestionService:
+    """Stands in for DocumentIngestionService; every ingestion raises"""
+
+    def ingest_document(self, **kwargs):
+        raise RuntimeError('Gemini unavailable')
+
+
+class FakeGeminiService:
+    """Returns constant embeddings, optionally failing on a given call"""
+
+    def __init__(self, fail_on_call: int = None, on_call=None):
+        self.calls = 0
+        self.batch_sizes = []
+        self.fail_on_call = fail_on_call
+        self.on_call = on_call
+
+    def generate_embeddings(self, texts, task_type='retrieval_document', model_tag=None):
+        self.calls += 1
+        self.batch_sizes.append(len(texts))
+        if self.on_call:
+            self.on_call(self.calls)
+        if self.calls == self.fail_on_call:
+            raise RuntimeError('Gemini unavailable')
+        return [[0.1] * settings.EMBEDDING_DIMENSION for _ in texts]
+
+
+@override_settings(INGESTION_JOB_STALE_AFTER=300, INGESTION_JOB_RETRY_DELAY=30)
+class IngestionJobRunnerTests(TestCase):
+    def create_job(self, **fields):
+        available_at = fields.pop('available_at', None)
+        fields.setdefault('file_path', 'uploads/report.pdf')
+        job = IngestionJob.objects.create(**fields)
+        if available_at is not None:
+            IngestionJob.objects.filter(id=job.id).update(available_at=available_at)
+            job.refresh_from_db()
+        return job
+
+    def test_claim_takes_oldest_available_job_and_marks_it_running(self):
+        now = timezone.now()
+        newer = self.create_job(available_at=now - timedelta(seconds=10))
+        older = self.create_job(available_at=now - timedelta(seconds=60))
+        self.create_job(available_at=now + timedelta(minutes=5))
+
+        job = IngestionJobRunner(worker_id='worker-a').claim_next_job()
+
+        self.assertEqual(job.id, older.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.worker_id, 'worker-a')
+        self.assertIsNotNone(job.heartbeat_at)
+
+        second = IngestionJobRunner(worker_id='worker-b').claim_next_job()
+        self.assertEqual(second.id, newer.id)
+        # The remaining job is not due yet.
+        self.assertIsNone(IngestionJobRunner(worker_id='worker-c').claim_next_job())
+
+    def test_claim_ignores_jobs_that_are_not_pending(self):
+        self.create_job(status='running', heartbeat_at=timezone.now())
+        self.create_job(status='succeeded')
+        self.assertIsNone(IngestionJobRunner().claim_next_job())
+
+    def test_stale_running_jobs_are_requeued_or_failed(self):
+        long_ago = timezone.now() - timedelta(seconds=600)
+        stale = self.create_job(status='running', attempts=1, max_attempts=3, heartbeat_at=long_ago, worker_id='gone')
+        exhausted = self.create_job(status='running', attempts=3, max_attempts=3, heartbeat_at=long_ago)
+        never_beat = self.create_job(status='running', attempts=1, started_at=long_ago)
+        alive = self.create_job(status='running', attempts=1, heartbeat_at=timezone.now())
+
+        self.assertEqual(IngestionJobRunner().requeue_stale_jobs(), 3)
+
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'pending')
+        self.assertEqual(stale.stage, 'queued')
+        self.assertEqual(stale.worker_id, '')
+        exhausted.refresh_from_db()
+        self.assertEqual(exhausted.status, 'failed')
+        self.assertEqual(exhausted.error, 'Worker stopped responding')
+        never_beat.refresh_from_db()
+        self.assertEqual(never_beat.status, 'pending')
+        alive.refresh_from_db()
+        self.assertEqual(alive.status, 'running')
+
+    def test_failed_attempt_is_retried_with_growing_backoff(self):
+        self.create_job(max_attempts=3, available_at=timezone.now() - timedelta(seconds=1))
+        runner = IngestionJobRunner()
+
+        job = runner.claim_next_job()
+        before = timezone.now()
+        runner.run_job(job, FailingIngestionService())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(job.error, 'Gemini unavailable')
+        self.assertGreaterEqual(job.available_at, before + timedelta(seconds=30))
+        self.assertLess(job.available_at, before + timedelta(seconds=60))
+        self.assertIsNone(runner.claim_next_job())
+
+        IngestionJob.objects.filter(id=job.id).update(available_at=timezone.now())
+        job = runner.claim_next_job()
+        before = timezone.now()
+        runner.run_job(job, FailingIngestionService())
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertGreaterEqual(job.available_at, before + timedelta(seconds=60))
+
+    def test_last_attempt_fails_the_job_and_releases_the_upload(self):
+        self.create_job(attempts=2, max_attempts=3, available_at=timezone.now() - timedelta(seconds=1))
+        runner = IngestionJobRunner()
+        job = runner.claim_next_job()
+
+        with mock.patch('document_processor.ingestion_jobs.remove_if_unreferenced') as remove:
+            runner.run_job(job, FailingIngestionService())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 3)
+        self.assertIsNotNone(job.finished_at)
+        remove.assert_called_once_with('uploads/report.pdf')
+
+
+class IngestionWorkerPoolTests(TestCase):
+    def test_notify_does_not_start_workers(self):
+        pool = IngestionWorkerPool(num_workers=1)
+        pool.notify()
+        self.assertFalse(pool.started)
+
+
+@override_settings(CHUNK_SIZE=200, CHUNK_OVERLAP=20, INGESTION_BATCH_SIZE=2, CHUNK_STORAGE_MODE='full')
+class FirstIngestionVisibilityTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(directory, 'handbook.docx')
+        write_docx(self.file_path)
+
+    def active_chunks(self):
+        return DocumentChunk.objects.active().filter(document__file_path=self.file_path)
+
+    def test_chunks_are_only_served_once_the_document_is_complete(self):
+        visible_during_ingestion = []
+        gemini = FakeGeminiService(on_call=lambda call: visible_during_ingestion.append(self.active_chunks().count()))
+
+        document = DocumentIngestionService(gemini_service=gemini).ingest_document(self.file_path)
+
+        self.assertGreater(gemini.calls, 1)
+        self.assertEqual(set(visible_during_ingestion), {0})
+        self.assertEqual(self.active_chunks().count(), DocumentChunk.objects.filter(document=document).count())
+        self.assertGreater(self.active_chunks().count(), 0)
+        self.assertIsNotNone(SourceDocument.objects.get(id=document.id).centroid)
+
+    def test_failed_ingestion_leaves_no_chunks(self):
+        service = DocumentIngestionService(gemini_service=FakeGeminiService(fail_on_call=2))
+
+        with self.assertRaises(RuntimeError):
+            service.ingest_document(self.file_path)
+
+        self.assertFalse(DocumentChunk.objects.filter(document__file_path=self.file_path).exists())
+
+
+@override_settings(
+    CHUNK_SIZE=200, CHUNK_OVERLAP=20, INGESTION_BATCH_SIZE=3, CHUNK_STORAGE_MODE='full', EMBEDDING_EXTRA_MODELS=''
+)
+class StreamingIngestionTests(TestCase):
+    def test_chunks_are_embedded_in_batches_while_the_file_is_still_being_read(self):
+        file_path = os.path.join(tempfile.mkdtemp(), 'handbook.docx')
+        write_docx(file_path, paragraphs=30)
+        read, read_at_call = [], []
+        gemini = FakeGeminiService(on_call=lambda call: read_at_call.append(len(read)))
+        service = DocumentIngestionService(gemini_service=gemini)
+        open_file = service._open_file
+
+        def open_counted(path, extension):
+            segments, metadata = open_file(path, extension)
+            return (read.append(segment) or segment for segment in segments), metadata
+
+        service._open_file = open_counted
+        document = service.ingest_document(file_path)
+
+        sizes = gemini.batch_sizes
+        self.assertGreater(len(sizes), 2)
+        self.assertEqual(sizes[:-1], [3] * (len(sizes) - 1))
+        self.assertLessEqual(sizes[-1], 3)
+        self.assertEqual(sum(sizes), DocumentChunk.objects.filter(document=document).count())
+        self.assertLess(read_at_call[0], len(read))
+
+
+@override_settings(CHUNK_SIZE=200, CHUNK_OVERLAP=20, INGESTION_BATCH_SIZE=4)
+class CompactChunkStorageTests(TestCase):
+    def ingest(self, storage_mode):
+        file_path = os.path.join(tempfile.mkdtemp(), 'handbook.docx')
+        write_docx(file_path)
+        with override_settings(CHUNK_STORAGE_MODE=storage_mode):
+            document = DocumentIngestionService(gemini_service=FakeGeminiService()).ingest_document(file_path)
+        return list(document.chunks.active().order_by('chunk_index'))
+
+    def test_compact_chunks_hydrate_to_the_full_mode_text(self):
+        full = self.ingest('full')
+        compact = self.ingest('compact')
+
+        self.assertEqual({chunk.content for chunk in compact}, {''})
+        self.assertEqual(DocumentText.objects.filter(document=compact[0].document_id).count(), 1)
+        hydrated = hydrate_chunks(compact)
+        self.assertEqual([chunk.content for chunk in hydrated], [chunk.content for chunk in full])
+        self.assertEqual(chunk_content(compact[-1]), full[-1].content)
+
+
+@override_settings(CHUNK_SIZE=200, CHUNK_OVERLAP=20, INGESTION_BATCH_SIZE=2, CHUNK_STORAGE_MODE='compact')
+class StaleChunkCollectionTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(directory, 'handbook.docx')
+        write_docx(self.file_path)
+        self.gemini = FakeGeminiService()
+        self.service = DocumentIngestionService(gemini_service=self.gemini)
+        self.document = self.service.ingest_document(self.file_path)
+        self.chunk_count = self.document.chunks.active().count()
+
+    def collect_all(self):
+        while self.service.collect_stale_chunks():
+            pass
+
+    def test_collection_during_reindexes_keeps_the_generations_being_built(self):
+        # Generation 1 is superseded and waiting for the collector.
+        self.service.reindex_document(self.document.id)
+
+        first_call = self.gemini.calls + 1
+
+        def during_reindex(call):
+            if call == first_call:
+                # A second reindex starts while this one (generation 3) is still embedding.
+                self.service.allocate_generation(SourceDocument.objects.get(id=self.document.id))
+            else:
+                self.collect_all()
+
+        self.gemini.on_call = during_reindex
+        reindexed = self.service.reindex_document(self.document.id)
+
+        self.assertEqual(reindexed.active_generation, 3)
+        self.assertEqual(DocumentChunk.objects.active().filter(document=reindexed).count(), self.chunk_count)
+        self.assertTrue(DocumentText.objects.filter(document=reindexed, generation=3).exists())
+
+        self.gemini.on_call = None
+        self.collect_all()
+        self.assertEqual(
+            set(DocumentChunk.objects.filter(document=reindexed).values_list('generation', flat=True)), {3}
+        )
+        self.assertEqual(list(DocumentText.objects.filter(document=reindexed).values_list('generation', flat=True)), [3])
+
+    def test_generation_activated_too_late_is_collected(self):
+        stale_generation = self.service.allocate_generation(self.document)
+        self.service.reindex_document(self.document.id)
+        self.collect_all()
+        self.service.store_chunk_batch(
+            self.document, [{'content': 'late', 'chunk_index': 0, 'start_position': 0, 'end_position': 4}],
+            generation=stale_generation
+        )
+
+        self.assertFalse(self.service.activate_generation(self.document, stale_generation))
+        self.collect_all()
+
+        self.assertFalse(DocumentChunk.objects.filter(document=self.document, generation=stale_generation).exists())
+        self.assertEqual(self.document.chunks.active().count(), self.chunk_count)
+
+
+@override_settings(CHUNK_SIZE=200, CHUNK_OVERLAP=20, INGESTION_BATCH_SIZE=4, CHUNK_STORAGE_MODE='compact')
+class DocumentAliasTests(TestCase):
+    def setUp(self):
+        media = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        media.enable()
+        self.addCleanup(media.disable)
+        source = os.path.join(tempfile.mkdtemp(), 'handbook.docx')
+        write_docx(source)
+        with open(source, 'rb') as handle:
+            self.file_path, self.content_hash = store_content([handle.read()], '.docx')
+        self.service = DocumentIngestionService(gemini_service=FakeGeminiService())
+        self.canonical = self.service.ingest_document(self.file_path, content_hash=self.content_hash)
+        self.chunk_ids = set(self.canonical.chunks.active().values_list('id', flat=True))
+
+    def test_duplicate_upload_reuses_the_canonical_chunks(self):
+        duplicate = self.service.find_ingested_duplicate(self.content_hash)
+        alias = self.service.create_alias(duplicate, title='Copy', additional_metadata={'team': 'hr'})
+
+        self.assertEqual(duplicate, self.canonical)
+        self.assertEqual(alias.chunk_source, self.canonical)
+        self.assertEqual(alias.file_path, self.file_path)
+        self.assertEqual(alias.metadata['team'], 'hr')
+        self.assertFalse(alias.chunks.exists())
+
+    def test_deleting_the_canonical_hands_its_chunks_to_the_oldest_alias(self):
+        first = self.service.create_alias(self.canonical, title='First copy')
+        second = self.service.create_alias(self.canonical, title='Second copy')
+
+        self.assertTrue(self.service.delete_document(self.canonical.id))
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertIsNone(first.canonical_document)
+        self.assertEqual(first.active_generation, self.canonical.active_generation)
+        self.assertEqual(set(first.chunks.active().values_list('id', flat=True)), self.chunk_ids)
+        self.assertTrue(DocumentText.objects.filter(document=first, generation=first.active_generation).exists())
+        self.assertIsNotNone(first.centroid)
+        self.assertEqual(second.chunk_source, first)
+        self.assertTrue(os.path.exists(self.file_path))
+
+        self.service.delete_document(first.id)
+        self.service.delete_document(second.id)
+
+        self.assertFalse(DocumentChunk.objects.filter(id__in=self.chunk_ids).exists())
+        self.assertFalse(os.path.exists(self.file_path))
+
+
+class IngestionSignatureTests(TestCase):
+    def test_signature_changes_with_the_embedding_dimension(self):
+        service = DocumentIngestionService(gemini_service=FakeGeminiService())
+        signature = service.ingestion_signature
+
+        with override_settings(EMBEDDING_DIMENSION=settings.EMBEDDING_DIMENSION * 2):
+            self.assertNotEqual(service.ingestion_signature, signature)
+            self.assertIn(f"@{settings.EMBEDDING_DIMENSION}", service.ingestion_signature)
+
+
+class RemoveIfUnreferencedTests(TestCase):
+    def test_files_outside_media_root_are_kept(self):
+        outside = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+        outside.close()
+
+        with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            self.assertFalse(remove_if_unreferenced(outside.name))
+
+        self.assertTrue(os.path.exists(outside.name))
+        os.remove(outside.name)
+
+
+@override_settings(CHUNK_SIZE=200, CHUNK_OVERLAP=20, INGESTION_BATCH_SIZE=4)
+class IngestCorpusCommandTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.corpus = tempfile.mkdtemp()
+        self.source_file = os.path.join(self.corpus, 'handbook.docx')
+        write_docx(self.source_file)
+        self.service = DocumentIngestionService(gemini_service=FakeGeminiService())
+
+    def ingest(self, run=1):
+        checkpoint = os.path.join(tempfile.mkdtemp(), f'run-{run}.jsonl')
+        with mock.patch(
+            'document_processor.management.commands.ingest_corpus.ProcessPoolExecutor',
+            lambda max_workers, mp_context: ThreadPoolExecutor(max_workers)
+        ), mock.patch(
+            'document_processor.management.commands.ingest_corpus.get_ingestion_service',
+            return_value=self.service
+        ):
+            call_command('ingest_corpus', self.corpus, workers=1, checkpoint=checkpoint, stdout=StringIO())
+
+    def test_documents_point_at_a_stored_copy_of_directory_files(self):
+        self.ingest()
+
+        document = SourceDocument.objects.get()
+        self.assertTrue(document.file_path.startswith(self.media_root))
+        self.assertTrue(document.chunks.active().exists())
+
+        self.service.delete_document(document.id)
+
+        self.assertFalse(os.path.exists(document.file_path))
+        self.assertTrue(os.path.exists(self.source_file))
+
+    def test_fully_ingested_content_is_skipped(self):
+        self.ingest(run=1)
+        self.ingest(run=2)
+
+        self.assertEqual(SourceDocument.objects.count(), 1)
+
+    def test_content_ingested_with_other_settings_is_ingested_again(self):
+        self.ingest(run=1)
+        SourceDocument.objects.update(ingestion_signature='parser=1;chunk_size=1000;overlap=200;embedding=old@768')
+
+        self.ingest(run=2)
+
+        self.assertEqual(SourceDocument.objects.count(), 2)
+        latest = SourceDocument.objects.latest('id')
+        self.assertEqual(latest.ingestion_signature, self.service.ingestion_signature)
+        self.assertTrue(latest.chunks.active().exists())
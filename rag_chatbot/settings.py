@@ -41,6 +41,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    # Registers OpClass as an index wrapper, needed by the trigram indexes
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'chatbot',
@@ -82,6 +84,12 @@ WSGI_APPLICATION = 'rag_chatbot.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Set DB_PGBOUNCER when DB_HOST/DB_PORT point at pgbouncer in transaction pooling mode:
+# session state such as prepared statements does not survive between transactions there.
+DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', 'False') == 'True'
+# Prepare the chunk similarity query once per connection (ignored with DB_PGBOUNCER)
+DB_PREPARED_SEARCH = os.getenv('DB_PREPARED_SEARCH', 'True') == 'True'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -90,6 +98,20 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        # Keep connections open between requests (seconds; 0 closes after each request)
+        # and check them before reuse so a restarted server does not fail a request.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True',
+        # Behind pgbouncer in transaction mode, named cursors cannot span transactions.
+        'DISABLE_SERVER_SIDE_CURSORS': DB_PGBOUNCER,
+    }
+}
+
+# Cache (per-process by default; point it at Redis or Memcached to share state between workers)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
     }
 }
 
@@ -160,12 +182,111 @@ print("GEMINI_API_KEY:", GEMINI_API_KEY)
 LLM_MODEL = os.getenv('LLM_MODEL', 'gemini-2.0-flash-exp')
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'models/text-embedding-004')
 EMBEDDING_DIMENSION = int(os.getenv('EMBEDDING_DIMENSION', '768'))
+# Embedding versions are tagged <model>@<dimension>. Versions listed in EMBEDDING_EXTRA_MODELS
+# are also written for new chunks (backfill old ones with `manage.py reembed_corpus`), and
+# SEARCH_EMBEDDING_MODEL switches query embeddings and search to a version together
+# (empty: EMBEDDING_MODEL@EMBEDDING_DIMENSION, stored on the chunk itself).
+EMBEDDING_EXTRA_MODELS = os.getenv('EMBEDDING_EXTRA_MODELS', '')
+SEARCH_EMBEDDING_MODEL = os.getenv('SEARCH_EMBEDDING_MODEL', '')
 
 # RAG Configuration
 CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '1000'))
 CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '200'))
+# 'full' stores each chunk's text; 'compact' stores each document's text once, compressed,
+# and chunks as offsets into it (convert existing chunks with `manage.py convert_chunk_storage`)
+CHUNK_STORAGE_MODE = os.getenv('CHUNK_STORAGE_MODE', 'full')
+CHUNK_TEXT_CACHE_DOCUMENTS = int(os.getenv('CHUNK_TEXT_CACHE_DOCUMENTS', '64'))
 TOP_K_RESULTS = int(os.getenv('TOP_K_RESULTS', '5'))
 MAX_CONTEXT_TOKENS = int(os.getenv('MAX_CONTEXT_TOKENS', '4000'))
+# Server-side cap on top_k, cosine distance beyond which hits are dropped (0 disables),
+# and the relative similarity drop from the best hit at which retrieval stops (0 disables)
+RETRIEVAL_MAX_TOP_K = int(os.getenv('RETRIEVAL_MAX_TOP_K', '20'))
+RETRIEVAL_MAX_DISTANCE = float(os.getenv('RETRIEVAL_MAX_DISTANCE', '0.6'))
+RETRIEVAL_RELATIVE_GAP = float(os.getenv('RETRIEVAL_RELATIVE_GAP', '0.25'))
+# Two-stage retrieval: search only the chunks of the N documents whose centroid (mean
+# chunk embedding) is nearest the query (0 searches every document of the collection)
+DOCUMENT_ROUTING_TOP_M = int(os.getenv('DOCUMENT_ROUTING_TOP_M', '0'))
+# Keep each query's embedding in the query log so `manage.py replay_queries` can rerun
+# retrieval offline without calling Gemini
+QUERY_LOG_EMBEDDINGS = os.getenv('QUERY_LOG_EMBEDDINGS', 'True') == 'True'
+
+# Context compression between retrieval and the prompt: off, lexical (query term overlap)
+# or embedding (similarity to the query embedding, with sentence embeddings cached for
+# CONTEXT_COMPRESSION_CACHE_TTL seconds). Each chunk offers its best
+# CONTEXT_COMPRESSION_SENTENCES_PER_CHUNK sentences to a budget of
+# CONTEXT_COMPRESSION_MAX_WORDS words (0 for no budget).
+CONTEXT_COMPRESSION_MODE = os.getenv('CONTEXT_COMPRESSION_MODE', 'off')
+CONTEXT_COMPRESSION_SENTENCES_PER_CHUNK = int(os.getenv('CONTEXT_COMPRESSION_SENTENCES_PER_CHUNK', '3'))
+CONTEXT_COMPRESSION_MAX_WORDS = int(os.getenv('CONTEXT_COMPRESSION_MAX_WORDS', '400'))
+CONTEXT_COMPRESSION_LEXICAL_WEIGHT = float(os.getenv('CONTEXT_COMPRESSION_LEXICAL_WEIGHT', '0.3'))
+CONTEXT_COMPRESSION_CACHE_TTL = int(os.getenv('CONTEXT_COMPRESSION_CACHE_TTL', '86400'))
+
+# PDF parsing (0 workers means one per CPU; 0 min pages disables parallel extraction)
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '100'))
+PDF_PARALLEL_WORKERS = int(os.getenv('PDF_PARALLEL_WORKERS', '0'))
+
+# Service warm-up (run on app ready so readiness turns green before serving traffic)
+SERVICE_WARMUP_ON_READY = os.getenv('SERVICE_WARMUP_ON_READY', 'False') == 'True'
+
+# Startup import budget, checked by `manage.py startup_profile` (milliseconds, 0 disables)
+STARTUP_IMPORT_BUDGET_MS = int(os.getenv('STARTUP_IMPORT_BUDGET_MS', '1000'))
+STARTUP_APP_IMPORT_BUDGET_MS = int(os.getenv('STARTUP_APP_IMPORT_BUDGET_MS', '300'))
+
+# Conversation memory: the last WINDOW messages plus any not yet summarized go into the
+# prompt; summaries start past THRESHOLD messages and fold in BATCH messages at a time.
+CONVERSATION_HISTORY_WINDOW = int(os.getenv('CONVERSATION_HISTORY_WINDOW', '5'))
+CONVERSATION_SUMMARY_THRESHOLD = int(os.getenv('CONVERSATION_SUMMARY_THRESHOLD', '20'))
+CONVERSATION_SUMMARY_BATCH = int(os.getenv('CONVERSATION_SUMMARY_BATCH', '10'))
+
+# Ingestion jobs
+INGESTION_BATCH_SIZE = int(os.getenv('INGESTION_BATCH_SIZE', '50'))
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', '2'))
+INGESTION_WORKER_POLL_INTERVAL = float(os.getenv('INGESTION_WORKER_POLL_INTERVAL', '2'))
+INGESTION_JOB_MAX_ATTEMPTS = int(os.getenv('INGESTION_JOB_MAX_ATTEMPTS', '3'))
+INGESTION_JOB_RETRY_DELAY = int(os.getenv('INGESTION_JOB_RETRY_DELAY', '30'))
+INGESTION_JOB_STALE_AFTER = int(os.getenv('INGESTION_JOB_STALE_AFTER', '300'))
+# Superseded chunk generations are deleted by idle workers this many rows at a time
+CHUNK_GC_BATCH_SIZE = int(os.getenv('CHUNK_GC_BATCH_SIZE', '500'))
+# Record the tracemalloc peak of each ingestion run (tracing slows allocation-heavy parsing)
+INGESTION_TRACE_MEMORY = os.getenv('INGESTION_TRACE_MEMORY', 'True') == 'True'
+
+# Collections: the knowledge base searched and ingested into when a request does not name one
+DEFAULT_COLLECTION_SLUG = os.getenv('DEFAULT_COLLECTION_SLUG', 'default')
+
+# Intent router: answers small talk and off-topic messages without retrieval or the LLM
+INTENT_ROUTER_ENABLED = os.getenv('INTENT_ROUTER_ENABLED', 'True') == 'True'
+INTENT_ROUTER_RULES_FILE = os.getenv('INTENT_ROUTER_RULES_FILE', '')
+INTENT_CENTROID_THRESHOLD = float(os.getenv('INTENT_CENTROID_THRESHOLD', '0.80'))
+INTENT_CENTROID_MARGIN = float(os.getenv('INTENT_CENTROID_MARGIN', '0.05'))
+INTENT_ROUTER_MAX_WORDS = int(os.getenv('INTENT_ROUTER_MAX_WORDS', '20'))
+
+# Single-flight: identical concurrent Gemini calls share one upstream request. With
+# SINGLE_FLIGHT_SHARED the cache also coalesces across workers (needs a shared CACHES backend);
+# SINGLE_FLIGHT_RESULT_TTL is how long waiting workers can still collect a finished result.
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'True') == 'True'
+SINGLE_FLIGHT_SHARED = os.getenv('SINGLE_FLIGHT_SHARED', 'False') == 'True'
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_WAIT_TIMEOUT', '60'))
+SINGLE_FLIGHT_RESULT_TTL = int(os.getenv('SINGLE_FLIGHT_RESULT_TTL', '10'))
+
+# Gemini admission control: per-minute call budgets shared by all workers through the cache
+# (0 disables). Background work may use RATE_LIMIT_BACKGROUND_SHARE of each window; chat
+# requests wait at most GEMINI_MAX_QUEUE_WAIT seconds for quota before getting a 429.
+GEMINI_EMBED_CALLS_PER_MINUTE = int(os.getenv('GEMINI_EMBED_CALLS_PER_MINUTE', '1500'))
+GEMINI_GENERATE_CALLS_PER_MINUTE = int(os.getenv('GEMINI_GENERATE_CALLS_PER_MINUTE', '60'))
+RATE_LIMIT_WINDOW = float(os.getenv('RATE_LIMIT_WINDOW', '10'))
+RATE_LIMIT_BACKGROUND_SHARE = float(os.getenv('RATE_LIMIT_BACKGROUND_SHARE', '0.5'))
+RATE_LIMIT_MAX_WAITERS = int(os.getenv('RATE_LIMIT_MAX_WAITERS', '32'))
+GEMINI_MAX_QUEUE_WAIT = float(os.getenv('GEMINI_MAX_QUEUE_WAIT', '10'))
+CHAT_MAX_CONCURRENT_PER_USER = int(os.getenv('CHAT_MAX_CONCURRENT_PER_USER', '2'))
+
+# Daily Gemini token budgets per user and for all users together (0 disables). Once
+# TOKEN_BUDGET_DEGRADE_AT of a budget is used, answers get a smaller context and fewer
+# output tokens; a used-up budget answers 429 until midnight.
+TOKEN_BUDGET_USER_DAILY = int(os.getenv('TOKEN_BUDGET_USER_DAILY', '0'))
+TOKEN_BUDGET_DAILY = int(os.getenv('TOKEN_BUDGET_DAILY', '0'))
+TOKEN_BUDGET_DEGRADE_AT = float(os.getenv('TOKEN_BUDGET_DEGRADE_AT', '0.8'))
+TOKEN_BUDGET_DEGRADED_CONTEXT_TOKENS = int(os.getenv('TOKEN_BUDGET_DEGRADED_CONTEXT_TOKENS', '1500'))
+TOKEN_BUDGET_DEGRADED_MAX_OUTPUT_TOKENS = int(os.getenv('TOKEN_BUDGET_DEGRADED_MAX_OUTPUT_TOKENS', '300'))
 
 # Media files
 MEDIA_URL = '/media/'
@@ -1,38 +1,214 @@
 from django.contrib import admin
-from rag_engine.models import SourceDocument, DocumentChunk, RAGQueryLog
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connection
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html, format_html_join
+from rag_engine.chunk_storage import compact_storage_enabled, hydrate_chunks
+from rag_engine.models import (
+    Collection, SourceDocument, DocumentChunk, RAGQueryLog, IngestionJob, IngestionRun, DailyTokenUsage
+)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that reads the row count of an unfiltered changelist from the planner's
+    statistics (pg_class.reltuples) instead of running COUNT(*) over a large table
+
+    Filtered or searched querysets, and tables estimated below EXACT_COUNT_BELOW rows,
+    are still counted exactly.
+    """
+    EXACT_COUNT_BELOW = 10000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None or query.where or connection.vendor != 'postgresql':
+            return super().count
+
+        estimate = self._estimate(self.object_list.model._meta.db_table)
+        if estimate < self.EXACT_COUNT_BELOW:
+            return super().count
+        return estimate
+
+    @staticmethod
+    def _estimate(table: str) -> int:
+        # A partitioned table has no statistics of its own; add up its partitions.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint FROM pg_class c "
+                "WHERE c.oid = to_regclass(%s) "
+                "OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))",
+                [table, table]
+            )
+            return cursor.fetchone()[0]
+
+
+@admin.register(Collection)
+class CollectionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'slug', 'created_at']
+    search_fields = ['name', 'slug']
+    prepopulated_fields = {'slug': ('name',)}
+    ordering = ['name']
+
+
+class IngestionRunInline(admin.TabularInline):
+    model = IngestionRun
+    fields = [
+        'kind', 'status', 'started_at', 'total_seconds', 'pages_per_second', 'chunks_per_second',
+        'embedding_calls', 'peak_memory_bytes'
+    ]
+    readonly_fields = fields
+    extra = 0
+    max_num = 0
+    can_delete = False
+    show_change_link = True
 
 
 @admin.register(SourceDocument)
 class SourceDocumentAdmin(admin.ModelAdmin):
-    list_display = ['id', 'title', 'author', 'file_type', 'file_size', 'upload_date', 'uploaded_by']
-    list_filter = ['file_type', 'upload_date']
+    list_display = [
+        'id', 'title', 'collection', 'author', 'file_type', 'file_size', 'active_generation', 'upload_date',
+        'uploaded_by'
+    ]
+    list_filter = ['collection', 'file_type', 'upload_date']
     search_fields = ['title', 'author']
     ordering = ['-upload_date']
     raw_id_fields = ['uploaded_by']
+    exclude = ['centroid']
+    inlines = [IngestionRunInline]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('centroid')
+
+
+class DocumentChunkChangeList(ChangeList):
+    """Loads the stored texts of a page's compact chunks together, not once per row"""
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.result_list = hydrate_chunks(list(self.result_list), drop_missing=False)
 
 
 @admin.register(DocumentChunk)
 class DocumentChunkAdmin(admin.ModelAdmin):
-    list_display = ['id', 'document', 'chunk_index', 'content_preview', 'created_at']
+    list_display = ['id', 'document', 'chunk_index', 'generation', 'content_preview', 'created_at']
     list_filter = ['created_at']
-    search_fields = ['content', 'document__title']
-    ordering = ['document', 'chunk_index']
-    raw_id_fields = ['document']
+    ordering = ['document_id', 'chunk_index']
+    raw_id_fields = ['document', 'collection']
+    exclude = ['embedding']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('embedding').select_related('document')
+
+    def get_changelist(self, request, **kwargs):
+        return DocumentChunkChangeList
+
+    def get_search_fields(self, request):
+        # Only content is searched so the trigram index can serve the query without a join.
+        # Compact chunks store no content of their own, so they are found by document title.
+        return ['document__title'] if compact_storage_enabled() else ['content']
+
+    @property
+    def search_help_text(self):
+        if compact_storage_enabled():
+            return 'Searches document titles: compact chunks keep their text in the document text.'
+        return 'Searches chunk content.'
+
+    def lookup_allowed(self, lookup, value):
+        # Lets a query log link to the chunks it used.
+        if lookup == 'used_in_queries__id__exact':
+            return True
+        return super().lookup_allowed(lookup, value)
 
     def content_preview(self, obj):
-        return obj.content[:100] + '...' if len(obj.content) > 100 else obj.content
+        # Compact chunks were hydrated by DocumentChunkChangeList.
+        content = obj.content
+        return content[:100] + '...' if len(content) > 100 else content
     content_preview.short_description = 'Content'
 
 
 @admin.register(RAGQueryLog)
 class RAGQueryLogAdmin(admin.ModelAdmin):
-    list_display = ['id', 'query_preview', 'conversation', 'timestamp', 'execution_time']
-    list_filter = ['timestamp']
+    list_display = [
+        'id', 'query_preview', 'conversation', 'route', 'prompt_tokens', 'output_tokens', 'timestamp', 'execution_time'
+    ]
+    list_filter = ['route', 'budget_degraded', 'timestamp']
     search_fields = ['query', 'response']
     ordering = ['-timestamp']
-    raw_id_fields = ['conversation']
-    filter_horizontal = ['chunks_used']
+    raw_id_fields = ['conversation', 'collection']
+    exclude = ['chunks_used', 'query_embedding']
+    readonly_fields = ['chunk_ids']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    CHUNK_IDS_SHOWN = 50
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('query_embedding')
 
     def query_preview(self, obj):
         return obj.query[:100] + '...' if len(obj.query) > 100 else obj.query
     query_preview.short_description = 'Query'
+
+    def chunk_ids(self, obj):
+        """The first chunk ids used, linked, with a link to all of them in the chunk changelist"""
+        if obj.pk is None:
+            return '-'
+
+        ids = list(
+            obj.chunks_used.order_by('id').values_list('id', flat=True)[:self.CHUNK_IDS_SHOWN]
+        )
+        if not ids:
+            return '-'
+
+        links = format_html_join(
+            ', ', '<a href="{}">{}</a>',
+            ((reverse('admin:rag_engine_documentchunk_change', args=[chunk_id]), chunk_id) for chunk_id in ids)
+        )
+        total = obj.chunks_used.count()
+        if total <= len(ids):
+            return links
+        changelist = reverse('admin:rag_engine_documentchunk_changelist')
+        return format_html(
+            '{} &hellip; <a href="{}?used_in_queries__id__exact={}">all {} chunks</a>',
+            links, changelist, obj.pk, total
+        )
+    chunk_ids.short_description = 'Chunks used'
+
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'stage', 'document', 'chunks_embedded', 'chunks_total', 'attempts', 'created_at']
+    list_filter = ['kind', 'status', 'stage', 'created_at']
+    search_fields = ['title', 'file_path', 'error']
+    ordering = ['-created_at']
+    raw_id_fields = ['document', 'uploaded_by']
+
+
+@admin.register(IngestionRun)
+class IngestionRunAdmin(admin.ModelAdmin):
+    list_display = [
+        'id', 'file_name', 'kind', 'status', 'document', 'pages', 'chunks', 'total_seconds', 'pages_per_second',
+        'chunks_per_second', 'embedding_calls', 'embedding_tokens', 'peak_memory_bytes', 'started_at'
+    ]
+    list_filter = ['kind', 'status', 'file_type', 'started_at']
+    search_fields = ['file_name', 'error']
+    ordering = ['-started_at']
+    raw_id_fields = ['document']
+    readonly_fields = [
+        'document', 'kind', 'status', 'error', 'file_name', 'file_type', 'file_size', 'pages', 'chunks',
+        'stage_seconds', 'total_seconds', 'pages_per_second', 'chunks_per_second', 'embedding_calls',
+        'embedding_tokens', 'embedding_latency_ms', 'peak_memory_bytes', 'started_at', 'finished_at'
+    ]
+
+
+@admin.register(DailyTokenUsage)
+class DailyTokenUsageAdmin(admin.ModelAdmin):
+    list_display = ['day', 'user', 'prompt_tokens', 'output_tokens', 'embedding_tokens', 'requests']
+    list_filter = ['day']
+    search_fields = ['user__username']
+    ordering = ['-day']
+    raw_id_fields = ['user']
@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class RagEngineConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag_engine'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+        from rag_engine.models import Collection
+        from rag_engine.partitioning import create_collection_partition, drop_collection_partition
+        from rag_engine.prepared_search import reset_prepared_state
+
+        connection_created.connect(reset_prepared_state, dispatch_uid='rag_engine.prepared_search')
+        post_save.connect(create_collection_partition, sender=Collection, dispatch_uid='rag_engine.partitioning.create')
+        post_delete.connect(drop_collection_partition, sender=Collection, dispatch_uid='rag_engine.partitioning.drop')
+
+        if settings.SERVICE_WARMUP_ON_READY:
+            from rag_engine.services import warm_up_in_background
+            warm_up_in_background()
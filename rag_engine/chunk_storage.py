@@ -0,0 +1,141 @@
+"""
+Compact chunk storage
+
+With CHUNK_STORAGE_MODE=compact a document's normalized text is stored once per chunk
+generation, zlib-compressed, in DocumentText, and its chunks keep only start/end
+offsets into it (plus the embedding and page numbers) instead of their own overlapping
+copy of the text and of the document's title and author. Chunk content is cut back out
+of the text when chunks are read; decompressed texts of recently used documents are
+kept in a small per-process cache, so retrieval usually only pays for a slice.
+"""
+
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from django.conf import settings
+
+FULL = 'full'
+COMPACT = 'compact'
+
+COMPRESSION_LEVEL = 6
+
+_text_cache = OrderedDict()
+_text_cache_lock = threading.Lock()
+
+
+def compact_storage_enabled() -> bool:
+    return settings.CHUNK_STORAGE_MODE == COMPACT
+
+
+def compress_text(text: str) -> bytes:
+    return zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def decompress_text(data) -> str:
+    return zlib.decompress(bytes(data)).decode('utf-8')
+
+
+class TextCompressor:
+    """Compresses the cleaned segments of a document as they stream past the chunker
+
+    Segments are joined with single spaces exactly as TextChunker.iter_chunks joins
+    them, so chunk offsets index into the decompressed result.
+    """
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(COMPRESSION_LEVEL)
+        self._parts = []
+        self.length = 0
+
+    def tee(self, segments: Iterable[Tuple[Optional[int], str]]) -> Iterator[Tuple[Optional[int], str]]:
+        for page_number, text in segments:
+            if self.length:
+                self._write(' ')
+            self._write(text)
+            yield page_number, text
+
+    def _write(self, text: str):
+        self._parts.append(self._compressor.compress(text.encode('utf-8')))
+        self.length += len(text)
+
+    def finish(self) -> bytes:
+        self._parts.append(self._compressor.flush())
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def is_compact(chunk) -> bool:
+    return chunk.start_offset is not None
+
+
+def slice_content(text: str, start: int, end: int) -> str:
+    """The content TextChunker produced for a chunk spanning [start, end) of the text"""
+    return text[start:end].strip()
+
+
+def load_texts(keys: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], str]:
+    """Decompressed texts for (document_id, generation) pairs, from the cache or one query"""
+    from django.db.models import Q
+    from rag_engine.models import DocumentText
+
+    texts = {}
+    missing = set()
+    with _text_cache_lock:
+        for key in set(keys):
+            if key in _text_cache:
+                _text_cache.move_to_end(key)
+                texts[key] = _text_cache[key]
+            else:
+                missing.add(key)
+
+    if missing:
+        condition = Q()
+        for document_id, generation in missing:
+            condition |= Q(document_id=document_id, generation=generation)
+        rows = DocumentText.objects.filter(condition).values_list('document_id', 'generation', 'compressed_text')
+
+        loaded = {(document_id, generation): decompress_text(data) for document_id, generation, data in rows}
+        texts.update(loaded)
+        with _text_cache_lock:
+            for key, text in loaded.items():
+                _text_cache[key] = text
+            while len(_text_cache) > settings.CHUNK_TEXT_CACHE_DOCUMENTS:
+                _text_cache.popitem(last=False)
+
+    return texts
+
+
+def hydrate_chunks(chunks: List, drop_missing: bool = True) -> List:
+    """Fill in the content of compact chunks, dropping any whose text is not stored yet
+
+    Texts are saved once all of a generation's chunks are, so chunks read outside the
+    active generation (the admin, a re-embedding pass) may not be reconstructable yet.
+    With drop_missing=False those chunks are kept with empty content.
+    """
+    keys = [(chunk.document_id, chunk.generation) for chunk in chunks if is_compact(chunk)]
+    if not keys:
+        return chunks
+
+    texts = load_texts(keys)
+    hydrated = []
+    for chunk in chunks:
+        if is_compact(chunk):
+            text = texts.get((chunk.document_id, chunk.generation))
+            if text is None:
+                if drop_missing:
+                    continue
+                chunk.content = ''
+            else:
+                chunk.content = slice_content(text, chunk.start_offset, chunk.end_offset)
+        hydrated.append(chunk)
+    return hydrated
+
+
+def chunk_content(chunk) -> str:
+    """The text of one chunk, whichever way it is stored"""
+    if not is_compact(chunk):
+        return chunk.content
+    text = load_texts([(chunk.document_id, chunk.generation)]).get((chunk.document_id, chunk.generation))
+    return slice_content(text, chunk.start_offset, chunk.end_offset) if text is not None else ''
@@ -0,0 +1,176 @@
+import copy
+import hashlib
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from django.core.cache import cache
+from rag_engine.intent_router import cosine_similarity, normalize_message
+
+LEXICAL = 'lexical'
+EMBEDDING = 'embedding'
+
+# Sentence ends, plus line breaks, which separate list items and headings in parsed documents.
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?…])\s+|\s*\n+\s*')
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence for sentence in (part.strip() for part in _SENTENCE_BREAK.split(text)) if sentence]
+
+
+def _terms(text: str) -> set:
+    # Words of one or two letters are nearly all articles and prepositions.
+    return {word for word in normalize_message(text).split() if len(word) > 2}
+
+
+class ContextCompressor:
+    """Keeps the sentences of retrieved chunks that are most relevant to the query
+
+    Each chunk is split into sentences, scored against the query, and only its
+    ``sentences_per_chunk`` best sentences compete for the ``max_words`` budget,
+    best first; the kept sentences stay in their original order. In lexical mode
+    the score is the IDF-weighted share of query terms a sentence contains, with
+    IDF taken over the sentences retrieved for the query. In embedding mode it is
+    the sentence's cosine similarity to the query embedding plus ``lexical_weight``
+    times the lexical score; sentence embeddings are cached for ``cache_ttl``
+    seconds and fetched in batches of INGESTION_BATCH_SIZE, and a request whose
+    embeddings cannot be fetched is scored lexically and counted in ``stats()``.
+    """
+
+    def __init__(self, gemini_service=None, mode: str = None):
+        self.gemini_service = gemini_service
+        self.mode = mode or settings.CONTEXT_COMPRESSION_MODE
+        self.sentences_per_chunk = settings.CONTEXT_COMPRESSION_SENTENCES_PER_CHUNK
+        self.max_words = settings.CONTEXT_COMPRESSION_MAX_WORDS
+        self.lexical_weight = settings.CONTEXT_COMPRESSION_LEXICAL_WEIGHT
+        self.cache_ttl = settings.CONTEXT_COMPRESSION_CACHE_TTL
+        self.batch_size = settings.INGESTION_BATCH_SIZE
+
+        self._lock = threading.Lock()
+        self._stats = {'compressed': 0, 'embedding_scored': 0, 'lexical_fallbacks': 0}
+        self._last_fallback_error = ''
+
+    def compress(
+        self,
+        query: str,
+        query_embedding: Optional[List[float]],
+        chunks: List,
+        embedding_tag: str = ''
+    ) -> Tuple[List, Optional[float]]:
+        """Copies of the chunks holding only their kept sentences, in rank order, and
+        the ratio of kept to retrieved words (None when nothing was retrieved)
+
+        Chunks left without sentences are dropped; the originals are not modified.
+        """
+        sentences = [split_sentences(chunk.content) for chunk in chunks]
+        retrieved_words = sum(len(sentence.split()) for chunk_sentences in sentences for sentence in chunk_sentences)
+        if not retrieved_words:
+            return chunks, None
+
+        self._count('compressed')
+        scores = self._scores(query, query_embedding, sentences, embedding_tag)
+
+        candidates = []
+        for chunk_index, chunk_scores in enumerate(scores):
+            ranked = sorted(range(len(chunk_scores)), key=lambda i: chunk_scores[i], reverse=True)
+            for sentence_index in ranked[:self.sentences_per_chunk]:
+                candidates.append((chunk_scores[sentence_index], -chunk_index, chunk_index, sentence_index))
+        candidates.sort(reverse=True)
+
+        kept = [set() for _ in chunks]
+        kept_words = 0
+        for _, _, chunk_index, sentence_index in candidates:
+            words = len(sentences[chunk_index][sentence_index].split())
+            # The best sentence is always kept, even when it alone exceeds the budget.
+            if self.max_words and kept_words and kept_words + words > self.max_words:
+                continue
+            kept[chunk_index].add(sentence_index)
+            kept_words += words
+
+        compressed = []
+        for chunk, chunk_sentences, chunk_kept in zip(chunks, sentences, kept):
+            if not chunk_kept:
+                continue
+            chunk = copy.copy(chunk)
+            chunk.content = ' '.join(chunk_sentences[i] for i in sorted(chunk_kept))
+            compressed.append(chunk)
+        return compressed, kept_words / retrieved_words
+
+    def _scores(self, query, query_embedding, sentences, embedding_tag) -> List[List[float]]:
+        lexical = self._lexical_scores(query, sentences)
+        if self.mode != EMBEDDING or query_embedding is None or self.gemini_service is None:
+            return lexical
+
+        flat = [sentence for chunk_sentences in sentences for sentence in chunk_sentences]
+        try:
+            embeddings = self._sentence_embeddings(flat, embedding_tag)
+        except Exception as e:
+            # Compression is an optimisation; without embeddings fall back to lexical scores.
+            with self._lock:
+                self._stats['lexical_fallbacks'] += 1
+                self._last_fallback_error = str(e) or type(e).__name__
+            return lexical
+        self._count('embedding_scored')
+
+        scores = []
+        position = 0
+        for chunk_lexical in lexical:
+            scores.append([
+                cosine_similarity(query_embedding, embeddings[flat[position + i]]) + self.lexical_weight * score
+                for i, score in enumerate(chunk_lexical)
+            ])
+            position += len(chunk_lexical)
+        return scores
+
+    @staticmethod
+    def _lexical_scores(query: str, sentences: List[List[str]]) -> List[List[float]]:
+        query_terms = _terms(query)
+        sentence_terms = [[_terms(sentence) for sentence in chunk_sentences] for chunk_sentences in sentences]
+
+        count = sum(len(chunk_terms) for chunk_terms in sentence_terms)
+        weights = {}
+        for term in query_terms:
+            frequency = sum(term in terms for chunk_terms in sentence_terms for terms in chunk_terms)
+            weights[term] = math.log(1 + count / (1 + frequency))
+        total = sum(weights.values())
+        if not total:
+            return [[0.0] * len(chunk_terms) for chunk_terms in sentence_terms]
+
+        return [
+            [sum(weights[term] for term in query_terms & terms) / total for terms in chunk_terms]
+            for chunk_terms in sentence_terms
+        ]
+
+    def _sentence_embeddings(self, sentences: List[str], embedding_tag: str) -> Dict[str, List[float]]:
+        """Embeddings of the sentences with the query's embedding version, from the cache
+        when possible and otherwise in requests of at most ``batch_size`` sentences"""
+        keys = {
+            sentence: f"sentence-embedding:{embedding_tag}:{hashlib.sha256(sentence.encode('utf-8')).hexdigest()}"
+            for sentence in sentences
+        }
+        cached = cache.get_many(list(keys.values()))
+        embeddings = {sentence: cached[key] for sentence, key in keys.items() if key in cached}
+
+        missing = [sentence for sentence in keys if sentence not in embeddings]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            fetched = self.gemini_service.generate_embeddings(
+                batch, task_type='retrieval_document', model_tag=embedding_tag or None
+            )
+            embeddings.update(zip(batch, fetched))
+            # Cached per batch, so a later failure does not waste the batches already paid for.
+            cache.set_many({keys[sentence]: embedding for sentence, embedding in zip(batch, fetched)}, self.cache_ttl)
+        return embeddings
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict:
+        """Counters since process start; lexical_fallbacks are embedding-mode requests
+        scored lexically because sentence embeddings could not be fetched"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['last_fallback_error'] = self._last_fallback_error
+        return stats
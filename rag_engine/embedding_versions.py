@@ -0,0 +1,74 @@
+"""
+Embedding model versions
+
+An embedding version is tagged ``<model>@<dimension>``, e.g.
+``models/text-embedding-004@768``. The version configured by EMBEDDING_MODEL and
+EMBEDDING_DIMENSION lives in ``DocumentChunk.embedding``; any other version is stored
+in ChunkEmbedding rows, backfilled by ``manage.py reembed_corpus`` and written for new
+chunks when listed in EMBEDDING_EXTRA_MODELS. SEARCH_EMBEDDING_MODEL picks the version
+that both query embeddings and the similarity search use, so changing it cuts over
+both at once.
+"""
+
+import re
+from typing import List, Tuple
+from django.conf import settings
+from django.db import connection
+
+
+def embedding_tag(model: str, dimension: int) -> str:
+    return f"{model}@{int(dimension)}"
+
+
+def parse_embedding_tag(tag: str) -> Tuple[str, int]:
+    model, separator, dimension = tag.rpartition('@')
+    if not separator or not model or not dimension.isdigit():
+        raise ValueError(f"Embedding version must look like <model>@<dimension>, got {tag!r}")
+    return model, int(dimension)
+
+
+def primary_embedding_tag() -> str:
+    """The version stored in DocumentChunk.embedding"""
+    return embedding_tag(settings.EMBEDDING_MODEL, settings.EMBEDDING_DIMENSION)
+
+
+def search_embedding_tag() -> str:
+    """The version queries are embedded with and searched against"""
+    return settings.SEARCH_EMBEDDING_MODEL or primary_embedding_tag()
+
+
+def extra_embedding_tags() -> List[str]:
+    """Versions besides the primary one that new chunks are embedded with too"""
+    tags = [tag.strip() for tag in settings.EMBEDDING_EXTRA_MODELS.split(',') if tag.strip()]
+    search_tag = search_embedding_tag()
+    if search_tag not in tags:
+        tags.append(search_tag)
+    primary = primary_embedding_tag()
+    return [tag for tag in tags if tag != primary]
+
+
+def embedding_tag_slug(tag: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '_', tag.lower()).strip('_')
+
+
+def embedding_index_name(tag: str) -> str:
+    return f"chunk_embeddings_hnsw_{embedding_tag_slug(tag)}"[:63]
+
+
+def ensure_embedding_index(tag: str):
+    """Create the HNSW index for one version's rows of chunk_embeddings
+
+    The column holds vectors of any dimension, so the index is on a cast to the
+    version's dimension and limited to its rows; searches use the same cast.
+    """
+    from rag_engine.models import ChunkEmbedding
+
+    _, dimension = parse_embedding_tag(tag)
+    q = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {q(embedding_index_name(tag))} "
+            f"ON {q(ChunkEmbedding._meta.db_table)} "
+            f"USING hnsw ((embedding::vector({dimension})) vector_cosine_ops) WHERE model = %s",
+            [tag]
+        )
@@ -0,0 +1,222 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+from django.conf import settings
+
+RAG_ROUTE = 'rag'
+
+# Whole-message rules, matched against lowercase text without accents or punctuation.
+DEFAULT_PATTERNS = {
+    'greeting': [
+        r'(hola|holi|buenas|buen dia|buenos dias|buenas tardes|buenas noches|hey|hi|hello|saludos)'
+        r'( (que tal|que mas|como estas|como vas|como va todo|como te va))?',
+        r'(que tal|que mas|como estas|como vas)',
+    ],
+    'thanks': [
+        r'(ok |vale |listo |perfecto |genial )?(muchas |mil |muchisimas )?gracias'
+        r'( (por (todo|la ayuda|tu ayuda|la informacion)|amigo|crack))?',
+        r'te lo agradezco|thanks|thank you',
+    ],
+    'farewell': [
+        r'((muchas )?gracias )?(adios|chao|chau|hasta luego|hasta pronto|hasta manana|nos vemos|bye)',
+    ],
+    'off_topic': [],
+}
+
+# Labelled examples whose mean embedding is each route's centroid; the rag examples
+# anchor what an on-topic travel question looks like.
+DEFAULT_EXAMPLES = {
+    'greeting': [
+        'Hola', 'Buenos días', 'Hola, ¿cómo estás?', 'Buenas tardes', '¿Qué más?', 'Hey, ¿qué tal?',
+    ],
+    'thanks': [
+        'Gracias', 'Muchas gracias por la ayuda', 'Te lo agradezco mucho', 'Mil gracias, muy útil',
+    ],
+    'farewell': [
+        'Adiós', 'Hasta luego', 'Nos vemos', 'Chao, que estés bien',
+    ],
+    'off_topic': [
+        '¿Cuánto es 2 + 2?',
+        'Escríbeme una función en Python que ordene una lista',
+        '¿Quién ganó el partido de fútbol ayer?',
+        '¿Cómo arreglo mi computador que no enciende?',
+        'Explícame la teoría de la relatividad',
+        '¿Cuál es el precio del bitcoin hoy?',
+        'Ayúdame a redactar un correo para mi jefe',
+        '¿Qué opinas de las elecciones presidenciales?',
+    ],
+    RAG_ROUTE: [
+        '¿Qué lugares puedo visitar en Cartagena?',
+        'Recomiéndame un hotel cerca de la playa',
+        '¿Cómo llego del aeropuerto al centro histórico?',
+        '¿Cuál es la comida típica de la región?',
+        'Quiero un itinerario de tres días',
+        '¿Qué se puede hacer en un día lluvioso?',
+        '¿Es seguro salir de noche por la ciudad?',
+        '¿Dónde puedo bucear o hacer snorkel?',
+        '¿Cuál es la mejor época para viajar?',
+        '¿Qué museos recomiendas?',
+    ],
+}
+
+DEFAULT_RESPONSES = {
+    'greeting': [
+        '¡Hola! ¿A dónde te gustaría viajar hoy?',
+        '¡Hola! Soy tu guía de viajes. Cuéntame, ¿qué destino tienes en mente?',
+    ],
+    'thanks': [
+        '¡Con mucho gusto! Si necesitas más ideas para tu viaje, aquí estoy.',
+        '¡De nada! ¿Te ayudo con algo más para tu viaje?',
+    ],
+    'farewell': [
+        '¡Hasta pronto! Que disfrutes mucho tu viaje.',
+        '¡Chao! Aquí estaré cuando quieras planear tu próxima aventura.',
+    ],
+    'off_topic': [
+        'Parece que eso no está relacionado con viajes, pero puedo ayudarte a planear tu próxima aventura si quieres 😄.',
+        'Recuerda que soy tu guía de viajes. ¿Te gustaría que te recomiende un destino o una actividad turística?',
+        'No tengo información sobre eso, pero puedo contarte sobre destinos increíbles para visitar.',
+    ],
+}
+
+
+def normalize_message(text: str) -> str:
+    """Lowercase, strip accents and punctuation and collapse whitespace"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class IntentRouter:
+    """Answers greetings, thanks, farewells and off-topic messages without retrieval or the LLM
+
+    Pattern rules run first and cost nothing. Otherwise the query embedding that
+    retrieval needs anyway is compared with the centroid of each route's labelled
+    examples; a non-RAG route wins only when it is similar enough and ahead of the
+    RAG centroid by a margin. Patterns, examples and responses can be overridden
+    per route from the JSON file in INTENT_ROUTER_RULES_FILE.
+    """
+
+    def __init__(self, gemini_service=None):
+        self.gemini_service = gemini_service
+        self.threshold = settings.INTENT_CENTROID_THRESHOLD
+        self.margin = settings.INTENT_CENTROID_MARGIN
+        self.max_words = settings.INTENT_ROUTER_MAX_WORDS
+
+        patterns, examples, responses = self._load_rules(settings.INTENT_ROUTER_RULES_FILE)
+        self.patterns = {
+            route: [re.compile(pattern) for pattern in route_patterns]
+            for route, route_patterns in patterns.items()
+        }
+        self.examples = examples
+        self.responses = responses
+
+        self._centroids = None
+        self._centroid_lock = threading.Lock()
+        self._failed_at = None
+
+    @staticmethod
+    def _load_rules(path: str):
+        patterns = dict(DEFAULT_PATTERNS)
+        examples = dict(DEFAULT_EXAMPLES)
+        responses = dict(DEFAULT_RESPONSES)
+
+        if path:
+            with open(path, encoding='utf-8') as rules_file:
+                overrides = json.load(rules_file)
+            patterns.update(overrides.get('patterns', {}))
+            examples.update(overrides.get('examples', {}))
+            responses.update(overrides.get('responses', {}))
+
+        return patterns, examples, responses
+
+    def match_rules(self, message: str) -> Optional[Dict]:
+        """Route a message by pattern rules alone"""
+        text = normalize_message(message)
+        if not text:
+            return None
+
+        for route, route_patterns in self.patterns.items():
+            if route in self.responses and any(pattern.fullmatch(text) for pattern in route_patterns):
+                return self._routed(route, 1.0, 'rules')
+        return None
+
+    def match_centroid(self, message: str, query_embedding: List[float]) -> Optional[Dict]:
+        """Route a message by its nearest labelled centroid, or None to use RAG"""
+        # Long messages carry real questions even when they open like small talk.
+        if self.max_words and len(message.split()) > self.max_words:
+            return None
+
+        try:
+            centroids = self.prepare()
+        except Exception:
+            # Routing is an optimisation; without centroids every message goes to RAG.
+            return None
+        if not centroids:
+            return None
+
+        scores = {route: cosine_similarity(query_embedding, centroid) for route, centroid in centroids.items()}
+        route = max(scores, key=scores.get)
+        score = scores[route]
+
+        if route == RAG_ROUTE or route not in self.responses or score < self.threshold:
+            return None
+        if score - scores.get(RAG_ROUTE, -1.0) < self.margin:
+            return None
+        return self._routed(route, score, 'centroid')
+
+    def prepare(self) -> Dict[str, List[float]]:
+        """Embed the labelled examples once per process and average them per route"""
+        if self._centroids is not None or self.gemini_service is None:
+            return self._centroids
+        # After a failed attempt, wait before spending another embedding request.
+        if self._failed_at is not None and time.monotonic() - self._failed_at < 60:
+            return None
+
+        with self._centroid_lock:
+            if self._centroids is None:
+                labelled = [(route, text) for route, texts in self.examples.items() for text in texts]
+                try:
+                    # Same embedding version as the query embeddings the centroids are compared with.
+                    embeddings = self.gemini_service.generate_embeddings(
+                        [text for _, text in labelled],
+                        task_type='retrieval_query',
+                        model_tag=self.gemini_service.search_embedding_tag
+                    )
+                except Exception:
+                    self._failed_at = time.monotonic()
+                    raise
+
+                sums = {}
+                counts = {}
+                for (route, _), embedding in zip(labelled, embeddings):
+                    if route not in sums:
+                        sums[route] = [0.0] * len(embedding)
+                        counts[route] = 0
+                    sums[route] = [total + value for total, value in zip(sums[route], embedding)]
+                    counts[route] += 1
+
+                self._centroids = {
+                    route: [value / counts[route] for value in total] for route, total in sums.items()
+                }
+        return self._centroids
+
+    def _routed(self, route: str, score: float, stage: str) -> Dict:
+        return {
+            'route': route,
+            'score': round(score, 4),
+            'stage': stage,
+            'response': random.choice(self.responses[route]),
+        }
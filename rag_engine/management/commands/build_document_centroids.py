@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from rag_engine.models import SourceDocument
+from rag_engine.services import get_ingestion_service
+
+
+class Command(BaseCommand):
+    help = 'Compute the routing centroid of documents ingested before centroids were kept'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute every document, not only missing ones')
+        parser.add_argument('--collection', type=int, help='Only documents of this collection id')
+
+    def handle(self, *args, **options):
+        documents = SourceDocument.objects.filter(canonical_document__isnull=True).defer('centroid').order_by('id')
+        if not options['all']:
+            documents = documents.filter(centroid__isnull=True)
+        if options['collection']:
+            documents = documents.filter(collection_id=options['collection'])
+
+        service = get_ingestion_service()
+        updated = 0
+        for document in documents.iterator():
+            service.update_centroid(document)
+            updated += 1
+
+        self.stdout.write(self.style.SUCCESS(f"✓ Updated the centroid of {updated} documents"))
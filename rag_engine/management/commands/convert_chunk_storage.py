@@ -0,0 +1,141 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rag_engine.chunk_storage import COMPACT, FULL, compress_text, decompress_text, slice_content
+from rag_engine.models import DocumentChunk, DocumentText, SourceDocument
+from rag_engine.services import get_ingestion_service
+
+
+class Command(BaseCommand):
+    help = 'Convert the active chunks of existing documents between full and compact storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', choices=[FULL, COMPACT], required=True, help='Target storage mode')
+        parser.add_argument('--document', type=int, nargs='*', help='Only convert these document ids')
+        parser.add_argument('--dry-run', action='store_true', help='Report the size change without writing')
+
+    def handle(self, *args, **options):
+        documents = SourceDocument.objects.filter(canonical_document__isnull=True).order_by('id')
+        if options['document']:
+            documents = documents.filter(id__in=options['document'])
+
+        convert = self._to_compact if options['to'] == COMPACT else self._to_full
+        converted = skipped = 0
+        size_before = size_after = 0
+
+        for document in documents.iterator():
+            try:
+                result = convert(document, options['dry_run'])
+            except Exception as e:
+                self.stdout.write(self.style.WARNING(f"  ✗ {document.id} {document.title}: {e}"))
+                skipped += 1
+                continue
+            if result is None:
+                continue
+
+            before, after = result
+            size_before += before
+            size_after += after
+            converted += 1
+            self.stdout.write(f"  ✓ {document.id} {document.title}: {before:,} -> {after:,} bytes")
+
+        saved = size_before - size_after
+        share = saved / size_before * 100 if size_before else 0
+        verb = 'Would convert' if options['dry_run'] else 'Converted'
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {verb} {converted} documents, skipped {skipped}: chunk text and metadata "
+            f"{size_before:,} -> {size_after:,} bytes ({share:.1f}% saved)"
+        ))
+        if converted and not options['dry_run']:
+            if settings.CHUNK_STORAGE_MODE != options['to']:
+                self.stdout.write(f"Set CHUNK_STORAGE_MODE={options['to']} so new documents are stored the same way.")
+            self.stdout.write('Run VACUUM (FULL) on document_chunks to return the freed space to the OS.')
+
+    @staticmethod
+    def _row_size(content: str, metadata: dict) -> int:
+        return len(content.encode('utf-8')) + len(json.dumps(metadata).encode('utf-8'))
+
+    def _to_compact(self, document, dry_run):
+        """Store the document text once and point its active chunks into it
+
+        The text is rebuilt by parsing the file again; the document is skipped unless
+        every chunk's stored content matches its slice of that text.
+        """
+        chunks = list(
+            DocumentChunk.objects.filter(
+                document=document, generation=document.active_generation, start_offset__isnull=True
+            ).only('id', 'content', 'metadata').order_by('chunk_index')
+        )
+        if not chunks:
+            return None
+
+        service = get_ingestion_service()
+        segments, _ = service._open_file(document.file_path, document.file_type)
+        text = ' '.join(cleaned for _, cleaned in service.normalizer.clean_segments(segments))
+
+        for chunk in chunks:
+            start = chunk.metadata.get('start_position')
+            end = chunk.metadata.get('end_position')
+            if start is None or end is None or slice_content(text, start, end) != chunk.content:
+                raise ValueError('parsing the file again gives different text; reindex it instead')
+
+        compressed = compress_text(text)
+        before = sum(self._row_size(chunk.content, chunk.metadata) for chunk in chunks)
+        after = len(compressed)
+
+        for chunk in chunks:
+            chunk.start_offset = chunk.metadata['start_position']
+            chunk.end_offset = chunk.metadata['end_position']
+            chunk.content = ''
+            chunk.metadata = {
+                key: value for key, value in chunk.metadata.items() if key in ('page_start', 'page_end')
+            }
+            after += self._row_size('', chunk.metadata) + 8
+
+        if not dry_run:
+            with transaction.atomic():
+                service.store_text(document, compressed, len(text), generation=document.active_generation)
+                DocumentChunk.objects.bulk_update(
+                    chunks, ['content', 'start_offset', 'end_offset', 'metadata'], batch_size=500
+                )
+        return before, after
+
+    def _to_full(self, document, dry_run):
+        """Copy each active chunk's text back into the chunk and drop the document text"""
+        stored = DocumentText.objects.filter(document=document, generation=document.active_generation).first()
+        chunks = list(
+            DocumentChunk.objects.filter(
+                document=document, generation=document.active_generation, start_offset__isnull=False
+            ).only('id', 'start_offset', 'end_offset', 'metadata').order_by('chunk_index')
+        )
+        if not chunks:
+            return None
+        if stored is None:
+            raise ValueError('no stored document text for the active generation; reindex it instead')
+
+        text = decompress_text(stored.compressed_text)
+        before = len(bytes(stored.compressed_text))
+        after = 0
+
+        for chunk in chunks:
+            before += self._row_size('', chunk.metadata) + 8
+            chunk.content = slice_content(text, chunk.start_offset, chunk.end_offset)
+            chunk.metadata = {
+                'title': document.title,
+                'author': document.author,
+                'start_position': chunk.start_offset,
+                'end_position': chunk.end_offset,
+                **chunk.metadata,
+            }
+            chunk.start_offset = None
+            chunk.end_offset = None
+            after += self._row_size(chunk.content, chunk.metadata)
+
+        if not dry_run:
+            with transaction.atomic():
+                DocumentChunk.objects.bulk_update(
+                    chunks, ['content', 'start_offset', 'end_offset', 'metadata'], batch_size=500
+                )
+                stored.delete()
+        return before, after
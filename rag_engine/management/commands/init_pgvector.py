@@ -3,7 +3,7 @@ from django.db import connection
 
 
 class Command(BaseCommand):
-    help = 'Initialize PostgreSQL database with pgvector extension'
+    help = 'Initialize PostgreSQL database with the pgvector and pg_trgm extensions'
 
     def handle(self, *args, **options):
         self.stdout.write('Enabling pgvector extension...')
@@ -12,4 +12,10 @@ class Command(BaseCommand):
             cursor.execute('CREATE EXTENSION IF NOT EXISTS vector;')
         
         self.stdout.write(self.style.SUCCESS('✓ pgvector extension enabled successfully!'))
+
+        # Trigram indexes back the admin's text search over chunks and query logs.
+        self.stdout.write('Enabling pg_trgm extension...')
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm;')
+        self.stdout.write(self.style.SUCCESS('✓ pg_trgm extension enabled successfully!'))
         self.stdout.write('Database is ready for vector operations.')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from rag_engine.models import Collection
+from rag_engine.partitioning import (
+    create_vector_index, ensure_partition, existing_partitions, is_partitioned, partition_chunk_table
+)
+
+
+class Command(BaseCommand):
+    help = 'Partition document_chunks by collection and create per-partition vector indexes'
+
+    def handle(self, *args, **options):
+        # Documents ingested before collections existed belong to the default one.
+        Collection.get_default()
+
+        if is_partitioned():
+            self.stdout.write('document_chunks is already partitioned, checking partitions...')
+        else:
+            self.stdout.write('Rebuilding document_chunks as a partitioned table (this locks the table)...')
+            partition_chunk_table()
+            self.stdout.write(self.style.SUCCESS('✓ document_chunks partitioned by collection'))
+
+        for collection in Collection.objects.all():
+            if ensure_partition(collection.id):
+                self.stdout.write(f"  ✓ Created partition for {collection.slug}")
+
+        create_vector_index()
+
+        partitions = existing_partitions()
+        self.stdout.write(self.style.SUCCESS(f"✓ {len(partitions)} partitions with HNSW vector indexes"))
@@ -0,0 +1,141 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+from rag_engine.chunk_storage import hydrate_chunks
+from rag_engine.embedding_versions import (
+    embedding_tag_slug, ensure_embedding_index, extra_embedding_tags, parse_embedding_tag,
+    primary_embedding_tag, search_embedding_tag
+)
+from rag_engine.models import ChunkEmbedding, DocumentChunk
+from rag_engine.rate_limit import BACKGROUND, gemini_call_context
+from rag_engine.services import get_gemini_service
+
+
+class Command(BaseCommand):
+    help = 'Backfill chunk embeddings for another embedding model version, with resumable checkpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='Embedding version to backfill, as <model>@<dimension>')
+        parser.add_argument('--batch-size', type=int, default=settings.INGESTION_BATCH_SIZE, help='Texts per request')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent embedding requests')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: reembed_<model>.checkpoint.jsonl)')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and rescan every chunk')
+        parser.add_argument('--status', action='store_true', help='Only report how many chunks have this version')
+        parser.add_argument('--report-every', type=float, default=10.0, help='Seconds between progress lines')
+
+    def handle(self, *args, **options):
+        tag = options['model']
+        try:
+            parse_embedding_tag(tag)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if tag == primary_embedding_tag():
+            raise CommandError(f"{tag} is the primary version stored on the chunks themselves")
+
+        if options['status']:
+            self._report_coverage(tag)
+            return
+
+        if tag not in extra_embedding_tags():
+            self.stdout.write(self.style.WARNING(
+                f"New chunks are not embedded with {tag}; add it to EMBEDDING_EXTRA_MODELS "
+                f"before backfilling so nothing ingested meanwhile is missed."
+            ))
+
+        self.tag = tag
+        self.gemini_service = get_gemini_service()
+        self.checkpoint_path = options['checkpoint'] or f"reembed_{embedding_tag_slug(tag)}.checkpoint.jsonl"
+        last_id = 0 if options['restart'] else self._load_checkpoint()
+        self.stdout.write(f"Backfilling {tag} from chunk id {last_id} (checkpoint: {self.checkpoint_path})")
+
+        batch_size = max(1, options['batch_size'])
+        workers = max(1, options['workers'])
+        pool = ThreadPoolExecutor(max_workers=workers)
+        embedded = 0
+        started = last_report = time.monotonic()
+
+        with open(self.checkpoint_path, 'a') as checkpoint:
+            while True:
+                window = list(
+                    DocumentChunk.objects.active()
+                    .filter(id__gt=last_id)
+                    .exclude(Exists(ChunkEmbedding.objects.filter(chunk=OuterRef('pk'), model=tag)))
+                    .defer('embedding')
+                    .order_by('id')[:batch_size * workers]
+                )
+                if not window:
+                    break
+
+                chunks = hydrate_chunks(window)
+                batches = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+                futures = [pool.submit(self._embed, [chunk.content for chunk in batch]) for batch in batches]
+
+                rows = []
+                for batch, future in zip(batches, futures):
+                    rows.extend(
+                        ChunkEmbedding(chunk=chunk, model=tag, embedding=vector)
+                        for chunk, vector in zip(batch, future.result())
+                    )
+                ChunkEmbedding.objects.bulk_create(rows, ignore_conflicts=True)
+
+                embedded += len(rows)
+                last_id = window[-1].id
+                checkpoint.write(json.dumps({'model': tag, 'last_chunk_id': last_id, 'embedded': embedded}) + '\n')
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+
+                now = time.monotonic()
+                if now - last_report >= options['report_every']:
+                    self.stdout.write(
+                        f"  {embedded} chunks embedded, up to id {last_id} | "
+                        f"{embedded / max(now - started, 1e-9):.1f} chunks/s"
+                    )
+                    last_report = now
+
+        pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(f"✓ Embedded {embedded} chunks with {tag}"))
+
+        self.stdout.write('Creating the vector index for this version...')
+        ensure_embedding_index(tag)
+        self._report_coverage(tag)
+
+    def _embed(self, texts):
+        # Pool threads do not inherit context; a backfill yields Gemini quota to chat.
+        with gemini_call_context(BACKGROUND):
+            return self.gemini_service.generate_embeddings(texts, model_tag=self.tag)
+
+    def _load_checkpoint(self) -> int:
+        """The last chunk id recorded for this version, or 0"""
+        last_id = 0
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as checkpoint:
+                for line in checkpoint:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get('model') == self.tag:
+                        last_id = max(last_id, entry['last_chunk_id'])
+        return last_id
+
+    def _report_coverage(self, tag):
+        active = DocumentChunk.objects.active()
+        total = active.count()
+        covered = active.filter(embeddings__model=tag).count()
+        self.stdout.write(f"{covered}/{total} active chunks have {tag} embeddings")
+
+        if search_embedding_tag() == tag:
+            self.stdout.write(f"Search already uses {tag}.")
+        elif covered == total:
+            self.stdout.write(self.style.SUCCESS(
+                f"Ready to cut over: set SEARCH_EMBEDDING_MODEL={tag} and restart the workers."
+            ))
+        else:
+            self.stdout.write(
+                'Not every chunk is covered yet; run the command again (with --restart to rescan '
+                'chunks skipped because their text was not stored yet) before cutting over.'
+            )
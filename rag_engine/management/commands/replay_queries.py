@@ -0,0 +1,373 @@
+import json
+import random
+import re
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rag_engine.embedding_versions import search_embedding_tag
+from rag_engine.intent_router import RAG_ROUTE
+from rag_engine.models import DocumentChunk, RAGQueryLog, SourceDocument
+from rag_engine.rag_service import RAGEngine
+from rag_engine.usage import estimate_tokens
+from document_processor.telemetry import percentile
+
+# Settings a configuration may override; anything with a dot (hnsw.ef_search) is a
+# Postgres session parameter instead, and `collection` searches another collection,
+# e.g. a copy of the corpus ingested with a different CHUNK_SIZE.
+REPLAY_SETTINGS = [
+    'TOP_K_RESULTS', 'RETRIEVAL_MAX_TOP_K', 'RETRIEVAL_MAX_DISTANCE', 'RETRIEVAL_RELATIVE_GAP',
+    'MAX_CONTEXT_TOKENS', 'DB_PREPARED_SEARCH', 'SEARCH_EMBEDDING_MODEL', 'CHUNK_TEXT_CACHE_DOCUMENTS',
+    'DOCUMENT_ROUTING_TOP_M', 'CONTEXT_COMPRESSION_MODE', 'CONTEXT_COMPRESSION_SENTENCES_PER_CHUNK',
+    'CONTEXT_COMPRESSION_MAX_WORDS', 'CONTEXT_COMPRESSION_LEXICAL_WEIGHT',
+]
+SESSION_PARAMETER = re.compile(r'^[a-z_]+\.[a-z_]+$')
+
+
+class NoGeminiService:
+    """Stands in for GeminiService so a replay can never reach the API"""
+
+    def __getattr__(self, name):
+        raise CommandError(f"replay_queries does not call Gemini (GeminiService.{name})")
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def recall(retrieved, expected):
+    return len(retrieved & expected) / len(expected) if expected else None
+
+
+def mean(values):
+    values = [value for value in values if value is not None]
+    return statistics.fmean(values) if values else None
+
+
+class ReplayConfig:
+    """One set of retrieval settings to replay the sampled queries with"""
+
+    def __init__(self, name, assignments):
+        self.name = name
+        self.settings = {}
+        self.session = {}
+        self.collection_id = None
+
+        for assignment in assignments:
+            key, separator, value = assignment.partition('=')
+            if not separator:
+                raise CommandError(f"Expected KEY=VALUE, got {assignment!r}")
+            if key == 'collection':
+                self.collection_id = int(value)
+            elif SESSION_PARAMETER.match(key):
+                self.session[key] = value
+            elif key in REPLAY_SETTINGS:
+                self.settings[key] = self._coerce(key, value)
+            else:
+                raise CommandError(
+                    f"Cannot override {key!r}; use one of {', '.join(REPLAY_SETTINGS)}, "
+                    f"collection or a Postgres parameter such as hnsw.ef_search"
+                )
+
+        # RAGEngine reads its settings once; build it with the overrides in place.
+        with override_settings(INTENT_ROUTER_ENABLED=False, **self.settings):
+            self.engine = RAGEngine(gemini_service=NoGeminiService())
+            self.embedding_tag = search_embedding_tag()
+
+    @staticmethod
+    def _coerce(key, value):
+        current = getattr(settings, key)
+        if isinstance(current, bool):
+            return value == 'True'
+        if isinstance(current, (int, float)):
+            return type(current)(value)
+        return value
+
+    def describe(self):
+        parts = [f"{key}={value}" for key, value in {**self.settings, **self.session}.items()]
+        if self.collection_id is not None:
+            parts.append(f"collection={self.collection_id}")
+        return ', '.join(parts) or 'current settings'
+
+    @contextmanager
+    def applied(self):
+        with override_settings(**self.settings):
+            with connection.cursor() as cursor:
+                for key, value in self.session.items():
+                    cursor.execute("SELECT set_config(%s, %s, false)", [key, value])
+            try:
+                yield
+            finally:
+                with connection.cursor() as cursor:
+                    for key in self.session:
+                        cursor.execute(f"RESET {key}")
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a sample of logged queries against the current retrieval settings (or two '
+        'configurations side by side) using the embeddings stored in the query log'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help='Sample queries logged in the last N days')
+        parser.add_argument('--since', help='Start of the window (ISO datetime), instead of --days')
+        parser.add_argument('--until', help='End of the window (ISO datetime, default: now)')
+        parser.add_argument('--limit', type=int, default=500, help='Queries to sample from the window')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the sample')
+        parser.add_argument('--collection', type=int, help='Only replay queries logged for this collection')
+        parser.add_argument(
+            '--config', nargs='+', default=[], metavar='KEY=VALUE',
+            help='Overrides for the replayed configuration, e.g. RETRIEVAL_RELATIVE_GAP=0 hnsw.ef_search=100'
+        )
+        parser.add_argument(
+            '--compare', nargs='+', metavar='KEY=VALUE',
+            help='Overrides for a second configuration, replayed and reported side by side'
+        )
+        parser.add_argument('--repeat', type=int, default=1, help='Searches per query; the median latency is kept')
+        parser.add_argument('--show', type=int, default=10, help='Queries with the largest result changes to list')
+        parser.add_argument('--json', dest='json_path', help='Also write per-query results to this file')
+
+    def handle(self, *args, **options):
+        configs = [ReplayConfig('A', options['config'])]
+        if options['compare']:
+            configs.append(ReplayConfig('B', options['compare']))
+
+        logs = self._sample(options)
+        if not logs:
+            self.stdout.write(self.style.WARNING(
+                'No logged retrieval queries with stored embeddings in this window '
+                '(QUERY_LOG_EMBEDDINGS must be on while queries are logged).'
+            ))
+            return
+
+        baselines = self._baselines(logs)
+        self.chunk_counts = {}
+        for config in configs:
+            self.stdout.write(f"{config.name}: {config.describe()} (embeddings {config.embedding_tag})")
+        self.stdout.write(f"Replaying {len(logs)} logged queries...")
+
+        results = {config.name: {} for config in configs}
+        skipped = {config.name: 0 for config in configs}
+        for log in logs:
+            # Configurations take turns per query so cache warmth favours neither.
+            for config in configs:
+                if log.embedding_model != config.embedding_tag:
+                    skipped[config.name] += 1
+                    continue
+                results[config.name][log.id] = self._replay(config, log, baselines[log.id], options['repeat'])
+
+        self._report(configs, logs, results, skipped)
+        if len(configs) == 2:
+            self._report_differences(logs, results, options['show'])
+        if options['json_path']:
+            self._write_json(options['json_path'], configs, logs, baselines, results)
+
+    def _sample(self, options):
+        until = self._parse_datetime(options['until']) if options['until'] else timezone.now()
+        if options['since']:
+            since = self._parse_datetime(options['since'])
+        else:
+            since = until - timedelta(days=options['days'])
+
+        logs = RAGQueryLog.objects.filter(
+            route=RAG_ROUTE, query_embedding__isnull=False, timestamp__gte=since, timestamp__lt=until
+        )
+        if options['collection']:
+            logs = logs.filter(collection_id=options['collection'])
+
+        # Sample ids rather than ORDER BY random() over the whole window.
+        ids = list(logs.values_list('id', flat=True))
+        if len(ids) > options['limit']:
+            ids = random.Random(options['seed']).sample(ids, options['limit'])
+        return list(
+            RAGQueryLog.objects.filter(id__in=ids)
+            .only(
+                'id', 'query', 'collection_id', 'query_embedding', 'embedding_model', 'chunk_distances',
+                'prompt_breakdown'
+            )
+            .order_by('id')
+        )
+
+    @staticmethod
+    def _parse_datetime(value):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f"Not an ISO datetime: {value!r}")
+        return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+    @staticmethod
+    def _baselines(logs):
+        """The chunk ids each query originally used, and the documents they belong to
+
+        chunk_distances is recorded with the log, so it survives reindexing; the
+        chunks_used relation only covers logs written before distances were kept.
+        """
+        chunk_ids = {log.id: {entry['chunk_id'] for entry in log.chunk_distances} for log in logs}
+        missing = [log.id for log in logs if not chunk_ids[log.id]]
+        if missing:
+            through = RAGQueryLog.chunks_used.through
+            for log_id, chunk_id in through.objects.filter(ragquerylog_id__in=missing).values_list(
+                'ragquerylog_id', 'documentchunk_id'
+            ):
+                chunk_ids[log_id].add(chunk_id)
+
+        all_ids = set().union(*chunk_ids.values())
+        documents = dict(DocumentChunk.objects.filter(id__in=all_ids).values_list('id', 'document_id'))
+        return {
+            log_id: {
+                'chunks': ids,
+                'documents': {documents[chunk_id] for chunk_id in ids if chunk_id in documents},
+            }
+            for log_id, ids in chunk_ids.items()
+        }
+
+    def _replay(self, config, log, baseline, repeat):
+        engine = config.engine
+        collection_id = config.collection_id or log.collection_id
+        timings = []
+        with config.applied():
+            for _ in range(max(1, repeat)):
+                start = time.perf_counter()
+                chunks = engine.search_similar_chunks(log.query_embedding, collection_id=collection_id)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            documents = SourceDocument.objects.defer('centroid').in_bulk({chunk.document_id for chunk in chunks})
+            for chunk in chunks:
+                chunk.document = documents[chunk.document_id]
+            context_chunks, compression_ratio = chunks, None
+            if engine.context_compressor:
+                # Sentence embeddings come from the cache only; a miss scores the query lexically.
+                context_chunks, compression_ratio = engine.context_compressor.compress(
+                    log.query, log.query_embedding, chunks, config.embedding_tag
+                )
+            context = engine.build_context(context_chunks)
+
+            counts = self._chunk_counts(collection_id or engine.default_collection_id)
+            if engine.document_routing_top_m:
+                routed = engine.route_documents(log.query_embedding, collection_id or engine.default_collection_id)
+                candidates = sum(counts.get(document_id, 0) for document_id in routed)
+            else:
+                candidates = sum(counts.values())
+
+        chunk_ids = {chunk.id for chunk in chunks}
+        document_ids = {chunk.document_id for chunk in chunks}
+        return {
+            'chunk_ids': [chunk.id for chunk in chunks],
+            'latency_ms': statistics.median(timings),
+            # Estimated like prompt_breakdown['context'], so it compares with the logged value.
+            'context_tokens': estimate_tokens(context),
+            'logged_context_tokens': log.prompt_breakdown.get('context'),
+            'compression_ratio': compression_ratio,
+            'candidate_chunks': candidates,
+            'chunk_jaccard': jaccard(chunk_ids, baseline['chunks']) if baseline['chunks'] else None,
+            'chunk_recall': recall(chunk_ids, baseline['chunks']),
+            'document_recall': recall(document_ids, baseline['documents']),
+        }
+
+    def _chunk_counts(self, collection_id):
+        """Active chunks per document of a collection, for the candidate set sizes"""
+        if collection_id not in self.chunk_counts:
+            self.chunk_counts[collection_id] = dict(
+                DocumentChunk.objects.active().filter(collection_id=collection_id).order_by()
+                .values('document_id').annotate(count=Count('id')).values_list('document_id', 'count')
+            )
+        return self.chunk_counts[collection_id]
+
+    def _report(self, configs, logs, results, skipped):
+        rows = []
+        for config in configs:
+            replayed = list(results[config.name].values())
+            latencies = [result['latency_ms'] for result in replayed] or [0.0]
+            tokens = [result['context_tokens'] for result in replayed] or [0]
+            rows.append({
+                'queries replayed': len(replayed),
+                'skipped (other embedding)': skipped[config.name],
+                'candidate chunks (mean)': mean([result['candidate_chunks'] for result in replayed]),
+                'chunks returned (mean)': mean([len(result['chunk_ids']) for result in replayed]),
+                'chunk jaccard vs logged': mean([result['chunk_jaccard'] for result in replayed]),
+                'chunk recall vs logged': mean([result['chunk_recall'] for result in replayed]),
+                'document recall vs logged': mean([result['document_recall'] for result in replayed]),
+                'latency p50 ms': percentile(latencies, 0.50),
+                'latency p95 ms': percentile(latencies, 0.95),
+                'latency p99 ms': percentile(latencies, 0.99),
+                'latency max ms': max(latencies),
+                'context tokens (mean)': mean(tokens),
+                'context tokens p95': percentile(tokens, 0.95),
+                'logged context tokens (mean)': mean([result['logged_context_tokens'] for result in replayed]),
+                'compression ratio (mean)': mean([result['compression_ratio'] for result in replayed]),
+            })
+
+        self.stdout.write('')
+        header = f"{'':<28}" + ''.join(f"{config.name:>12}" for config in configs)
+        if len(configs) == 2:
+            header += f"{'B - A':>12}"
+        self.stdout.write(header)
+        for metric in rows[0]:
+            values = [row[metric] for row in rows]
+            line = f"{metric:<28}" + ''.join(f"{self._format(value):>12}" for value in values)
+            if len(values) == 2 and None not in values:
+                line += f"{self._format(values[1] - values[0], signed=True):>12}"
+            self.stdout.write(line)
+        self.stdout.write(
+            'Overlap is measured against the chunks each query used when it was logged; chunk '
+            'ids change when documents are reindexed, document recall does not. Context tokens '
+            'are estimated the way RAGQueryLog.prompt_breakdown records them, so they compare '
+            'with the logged context tokens of the same queries.'
+        )
+
+    @staticmethod
+    def _format(value, signed=False):
+        if value is None:
+            return '-'
+        if isinstance(value, float):
+            return f"{value:+.3f}" if signed else f"{value:.3f}"
+        return f"{value:+d}" if signed else str(value)
+
+    def _report_differences(self, logs, results, show):
+        a, b = results['A'], results['B']
+        both = [log for log in logs if log.id in a and log.id in b]
+        if not both:
+            return
+
+        agreement = {
+            log.id: jaccard(set(a[log.id]['chunk_ids']), set(b[log.id]['chunk_ids'])) for log in both
+        }
+        changed = [log for log in both if a[log.id]['chunk_ids'] != b[log.id]['chunk_ids']]
+        self.stdout.write('')
+        self.stdout.write(
+            f"A vs B: mean result jaccard {mean(agreement.values()):.3f}; "
+            f"{len(changed)}/{len(both)} queries return different chunks or order"
+        )
+
+        for log in sorted(changed, key=lambda log: agreement[log.id])[:show]:
+            query = log.query if len(log.query) <= 70 else log.query[:67] + '...'
+            self.stdout.write(
+                f"  log {log.id} jaccard {agreement[log.id]:.2f}  A {a[log.id]['chunk_ids']}  "
+                f"B {b[log.id]['chunk_ids']}  {query!r}"
+            )
+
+    def _write_json(self, path, configs, logs, baselines, results):
+        entries = []
+        for log in logs:
+            entries.append({
+                'log_id': log.id,
+                'query': log.query,
+                'logged_chunk_ids': sorted(baselines[log.id]['chunks']),
+                **{config.name: results[config.name].get(log.id) for config in configs},
+            })
+        with open(path, 'w') as output:
+            json.dump({
+                'configs': {config.name: config.describe() for config in configs},
+                'queries': entries,
+            }, output, indent=2)
+        self.stdout.write(f"Per-query results written to {path}")
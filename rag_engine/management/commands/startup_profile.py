@@ -0,0 +1,184 @@
+import os
+import re
+import subprocess
+import sys
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Boot the project the way a worker does: app registry, admin autodiscovery and URLconf.
+# importlib.import_module bypasses the import-time hook, so it is routed through
+# __import__ first or apps, admin modules and URLconfs would not be reported.
+STARTUP_SCRIPT = """
+import importlib, importlib.util, sys
+
+def _import_module(name, package=None):
+    if name.startswith('.'):
+        name = importlib.util.resolve_name(name, package)
+    __import__(name)
+    return sys.modules[name]
+
+importlib.import_module = _import_module
+
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+"""
+
+# Heavy SDKs and parsers that are imported on first use and must stay out of a cold start.
+# requests, urllib3 and yaml are not listed: rest_framework.compat imports them (and its
+# other optional integrations) whenever they are installed, and google-api-core and libcst
+# install them, so every DRF view pays for them and the project cannot defer that import.
+LAZY_MODULES = ('google.generativeai', 'pypdf', 'docx')
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+class ImportNode:
+    def __init__(self, name, self_us, cumulative_us, depth):
+        self.name = name
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.depth = depth
+        self.children = []
+
+
+def parse_importtime(output):
+    """Build the import tree from `-X importtime` output
+
+    Modules are reported after everything they import, each one indented two
+    spaces deeper than its importer, so children are the deeper lines waiting
+    right before their parent.
+    """
+    pending = []
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        node = ImportNode(name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2)
+        while pending and pending[-1].depth > node.depth:
+            node.children.insert(0, pending.pop())
+        pending.append(node)
+    return pending
+
+
+def top_package(name):
+    return name.split('.', 1)[0]
+
+
+class Command(BaseCommand):
+    help = 'Profile import time of a cold start and fail when the configured budget is exceeded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help='Cold starts to run; the fastest is reported')
+        parser.add_argument('--top', type=int, default=10, help='Third-party packages to list')
+        parser.add_argument('--budget-ms', type=int, help='Total import budget (default: STARTUP_IMPORT_BUDGET_MS)')
+        parser.add_argument(
+            '--app-budget-ms', type=int,
+            help='Per-app cumulative budget (default: STARTUP_APP_IMPORT_BUDGET_MS)'
+        )
+
+    def handle(self, *args, **options):
+        budget_ms = options['budget_ms']
+        if budget_ms is None:
+            budget_ms = settings.STARTUP_IMPORT_BUDGET_MS
+        app_budget_ms = options['app_budget_ms']
+        if app_budget_ms is None:
+            app_budget_ms = settings.STARTUP_APP_IMPORT_BUDGET_MS
+
+        project_apps = self._project_apps()
+        project_packages = self._project_packages()
+        roots = min((self._profile() for _ in range(max(1, options['repeat']))), key=self._total_us)
+        total_ms = self._total_us(roots) / 1000
+
+        app_costs = {name: 0 for name in project_apps}
+        package_costs = {}
+        self._attribute(roots, set(project_apps), project_packages, app_costs, package_costs, None)
+
+        self.stdout.write(f"Cold start imports: {total_ms:.1f}ms")
+        self.stdout.write('=' * 60)
+        self.stdout.write('Project apps (cumulative, including what they import):')
+        for name, cost_us in sorted(app_costs.items(), key=lambda item: -item[1]):
+            self.stdout.write(f"  {name:<30} {cost_us / 1000:8.1f}ms")
+
+        self.stdout.write('Heaviest third-party packages:')
+        ranked = sorted(package_costs.items(), key=lambda item: -item[1][0])[:options['top']]
+        for name, (cost_us, importer) in ranked:
+            self.stdout.write(f"  {name:<30} {cost_us / 1000:8.1f}ms  (first imported by {importer or '-'})")
+
+        failures = []
+        if budget_ms and total_ms > budget_ms:
+            failures.append(f"total {total_ms:.1f}ms > {budget_ms}ms")
+        if app_budget_ms:
+            for name, cost_us in app_costs.items():
+                if cost_us / 1000 > app_budget_ms:
+                    failures.append(f"{name} {cost_us / 1000:.1f}ms > {app_budget_ms}ms")
+
+        loaded = self._module_names(roots)
+        failures.extend(f"{name} imported at startup" for name in LAZY_MODULES if name in loaded)
+
+        if failures:
+            raise CommandError('Startup import check failed: ' + '; '.join(failures))
+        self.stdout.write(self.style.SUCCESS('✓ Startup imports within budget'))
+
+    def _project_apps(self):
+        base_dir = str(settings.BASE_DIR)
+        return [
+            config.name for config in apps.get_app_configs()
+            if os.path.abspath(config.path).startswith(base_dir + os.sep)
+        ]
+
+    def _project_packages(self):
+        """Top-level packages that live in the project, apps or not (e.g. the settings package)"""
+        base_dir = str(settings.BASE_DIR)
+        return {
+            name for name in os.listdir(base_dir)
+            if os.path.isfile(os.path.join(base_dir, name, '__init__.py'))
+        }
+
+    def _profile(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'rag_chatbot.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+            cwd=str(settings.BASE_DIR), env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Startup failed:\n{result.stderr[-2000:]}")
+        return parse_importtime(result.stderr)
+
+    def _module_names(self, nodes):
+        names = set()
+        for node in nodes:
+            names.add(node.name)
+            names |= self._module_names(node.children)
+        return names
+
+    @staticmethod
+    def _total_us(roots):
+        return sum(node.cumulative_us for node in roots)
+
+    def _attribute(
+        self, nodes, project_apps, project_packages, app_costs, package_costs, importer, inside=frozenset()
+    ):
+        """Charge each import subtree to the outermost project app and third-party package it belongs to"""
+        for node in nodes:
+            package = top_package(node.name)
+            charged = inside
+
+            if package in project_packages:
+                if package in project_apps and package not in inside:
+                    app_costs[package] += node.cumulative_us
+                    charged = inside | {package}
+                child_importer = node.name
+            else:
+                if package not in inside:
+                    cost_us, first_importer = package_costs.get(package, (0, importer))
+                    package_costs[package] = (cost_us + node.cumulative_us, first_importer)
+                    charged = inside | {package}
+                child_importer = importer
+
+            self._attribute(
+                node.children, project_apps, project_packages, app_costs, package_costs, child_importer, charged
+            )
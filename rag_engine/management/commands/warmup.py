@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from rag_engine.services import warm_up
+
+
+class Command(BaseCommand):
+    help = 'Create shared services, open connections and prime the vector index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-embedding', action='store_true', help='Do not call the embedding API')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Warming up services...')
+        state = warm_up(embedding=not options['skip_embedding'])
+
+        for step, duration in state['steps'].items():
+            self.stdout.write(f"  ✓ {step} ({duration:.3f}s)")
+        for step, error in state['errors'].items():
+            self.stdout.write(self.style.ERROR(f"  ✗ {step}: {error}"))
+
+        if not state['warm']:
+            raise CommandError('Warm-up failed')
+        self.stdout.write(self.style.SUCCESS(f"✓ Services warm in {state['duration']:.2f}s"))
@@ -1,15 +1,86 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Upper
 from django.conf import settings
-from pgvector.django import VectorField
+from pgvector.django import HnswIndex, VectorField
+
+
+class Collection(models.Model):
+    """A knowledge base whose documents are searched separately from every other one"""
+    name = models.CharField(max_length=255)
+    slug = models.SlugField(max_length=100, unique=True)
+    description = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'collections'
+        ordering = ['name']
+        verbose_name = 'Collection'
+        verbose_name_plural = 'Collections'
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def get_default(cls) -> 'Collection':
+        """The collection used when a request does not name one"""
+        collection, _ = cls.objects.get_or_create(
+            slug=settings.DEFAULT_COLLECTION_SLUG,
+            defaults={'name': settings.DEFAULT_COLLECTION_SLUG.replace('-', ' ').title()}
+        )
+        return collection
+
+
+def get_default_collection_id() -> int:
+    return Collection.get_default().id
 
 
 class SourceDocument(models.Model):
     """Stores source documents for RAG"""
+    collection = models.ForeignKey(
+        Collection,
+        on_delete=models.PROTECT,
+        default=get_default_collection_id,
+        related_name='documents'
+    )
     title = models.CharField(max_length=255)
     author = models.CharField(max_length=255, blank=True, null=True)
     file_path = models.CharField(max_length=500)
     file_type = models.CharField(max_length=10)
     file_size = models.IntegerField()
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    ingestion_signature = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Parser version and chunk settings the chunks were produced with"
+    )
+    canonical_document = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='aliases',
+        help_text="Document that owns the chunks when this upload duplicated it"
+    )
+    active_generation = models.IntegerField(
+        default=0,
+        help_text="Chunk generation served to retrieval"
+    )
+    latest_generation = models.IntegerField(
+        default=0,
+        help_text="Newest chunk generation allocated, possibly still being built by a reindex"
+    )
+    has_stale_chunks = models.BooleanField(
+        default=False,
+        help_text="Superseded chunk generations are waiting to be garbage-collected"
+    )
+    centroid = VectorField(
+        dimensions=settings.EMBEDDING_DIMENSION,
+        null=True,
+        blank=True,
+        help_text="Mean embedding of the active chunks, used to route queries to documents"
+    )
     upload_date = models.DateTimeField(auto_now_add=True)
     metadata = models.JSONField(default=dict, blank=True)
     uploaded_by = models.ForeignKey(
@@ -22,27 +93,74 @@ class SourceDocument(models.Model):
     class Meta:
         db_table = 'source_documents'
         ordering = ['-upload_date']
+        indexes = [
+            HnswIndex(
+                name='source_documents_centroid_hnsw',
+                fields=['centroid'],
+                m=16,
+                ef_construction=64,
+                opclasses=['vector_cosine_ops']
+            ),
+        ]
         verbose_name = 'Source Document'
         verbose_name_plural = 'Source Documents'
 
     def __str__(self):
         return self.title
 
+    @property
+    def chunk_source(self):
+        """The document whose chunks serve this one (itself unless it is an alias)"""
+        return self.canonical_document or self
+
+
+class DocumentChunkQuerySet(models.QuerySet):
+    def active(self):
+        """Chunks of each document's active generation, the only ones retrieval should see"""
+        return self.filter(generation=F('document__active_generation'))
+
+    def stale(self):
+        """Chunks of generations older than the active one
+
+        Newer generations may still be written by a reindex, possibly one of several
+        running at once, so they are only collected after a later activation.
+        """
+        return self.filter(generation__lt=F('document__active_generation'))
+
 
 class DocumentChunk(models.Model):
     """Stores chunked text from documents with embeddings"""
     document = models.ForeignKey(SourceDocument, on_delete=models.CASCADE, related_name='chunks')
-    content = models.TextField()
+    collection = models.ForeignKey(
+        Collection,
+        on_delete=models.PROTECT,
+        default=get_default_collection_id,
+        related_name='chunks',
+        help_text="Copy of the document's collection; the partition key of document_chunks"
+    )
+    content = models.TextField(blank=True, help_text="Empty for compact storage; see start_offset")
     chunk_index = models.IntegerField()
+    generation = models.IntegerField(default=0)
+    start_offset = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Compact storage: where the chunk starts in the document text of its generation"
+    )
+    end_offset = models.IntegerField(null=True, blank=True)
     metadata = models.JSONField(default=dict, blank=True)
     embedding = VectorField(dimensions=settings.EMBEDDING_DIMENSION)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = DocumentChunkQuerySet.as_manager()
+
     class Meta:
         db_table = 'document_chunks'
         ordering = ['document', 'chunk_index']
         indexes = [
             models.Index(fields=['document', 'chunk_index']),
+            models.Index(fields=['document', 'generation']),
+            # Trigram index for the admin's case-insensitive search (UPPER(...) LIKE on Postgres)
+            GinIndex(OpClass(Upper('content'), name='gin_trgm_ops'), name='document_chunks_content_trgm'),
         ]
         verbose_name = 'Document Chunk'
         verbose_name_plural = 'Document Chunks'
@@ -51,6 +169,59 @@ class DocumentChunk(models.Model):
         return f"{self.document.title} - Chunk {self.chunk_index}"
 
 
+class ChunkEmbedding(models.Model):
+    """Embedding of a chunk by a model version other than the one in DocumentChunk.embedding
+
+    ``model`` is the version tag ``<model>@<dimension>``; vectors of any dimension share
+    the column and each version has its own partial HNSW index (see embedding_versions).
+    """
+    # No database constraint: the partitioned chunk table's primary key is (id, collection_id).
+    chunk = models.ForeignKey(
+        DocumentChunk, on_delete=models.CASCADE, related_name='embeddings', db_constraint=False
+    )
+    model = models.CharField(max_length=150)
+    embedding = VectorField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'chunk_embeddings'
+        constraints = [
+            models.UniqueConstraint(fields=['chunk', 'model'], name='chunk_embeddings_chunk_model'),
+        ]
+        indexes = [
+            models.Index(fields=['model', 'chunk']),
+        ]
+        verbose_name = 'Chunk Embedding'
+        verbose_name_plural = 'Chunk Embeddings'
+
+    def __str__(self):
+        return f"Chunk {self.chunk_id} - {self.model}"
+
+
+class DocumentText(models.Model):
+    """Normalized text of one chunk generation of a document, zlib-compressed
+
+    Only written in compact storage mode, where chunks hold offsets into this text
+    instead of their own content.
+    """
+    document = models.ForeignKey(SourceDocument, on_delete=models.CASCADE, related_name='texts')
+    generation = models.IntegerField(default=0)
+    compressed_text = models.BinaryField()
+    length = models.IntegerField(help_text="Length of the decompressed text in characters")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'document_texts'
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'generation'], name='document_texts_document_generation'),
+        ]
+        verbose_name = 'Document Text'
+        verbose_name_plural = 'Document Texts'
+
+    def __str__(self):
+        return f"{self.document.title} - generation {self.generation}"
+
+
 class RAGQueryLog(models.Model):
     """Logs RAG queries and the chunks used for responses"""
     conversation = models.ForeignKey(
@@ -60,17 +231,259 @@ class RAGQueryLog(models.Model):
         null=True,
         blank=True
     )
+    collection = models.ForeignKey(
+        Collection,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='rag_queries'
+    )
     query = models.TextField()
+    route = models.CharField(
+        max_length=20,
+        default='rag',
+        db_index=True,
+        help_text="'rag' for retrieval + LLM, otherwise the intent answered with a template"
+    )
+    route_score = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Similarity to the route's centroid (1.0 for a pattern rule match)"
+    )
+    query_embedding = VectorField(
+        null=True,
+        blank=True,
+        help_text="Embedding of the query, kept so replay_queries can search without calling Gemini"
+    )
+    embedding_model = models.CharField(
+        max_length=150,
+        blank=True,
+        help_text="Embedding version (<model>@<dimension>) of query_embedding"
+    )
     chunks_used = models.ManyToManyField(DocumentChunk, related_name='used_in_queries')
+    chunk_distances = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Cosine distance of each chunk used, best first"
+    )
     response = models.TextField()
+    prompt_tokens = models.IntegerField(default=0, help_text="Prompt tokens reported by Gemini")
+    output_tokens = models.IntegerField(default=0, help_text="Answer tokens reported by Gemini")
+    embedding_tokens = models.IntegerField(
+        default=0,
+        help_text="Estimated tokens of the query embedding (embed_content reports no usage)"
+    )
+    prompt_breakdown = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Estimated prompt tokens per part: instructions, context, history, question"
+    )
+    compression_ratio = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Share of the retrieved words kept by context compression (CONTEXT_COMPRESSION_MODE)"
+    )
+    budget_degraded = models.BooleanField(
+        default=False,
+        help_text="Answered with the smaller context and answer of a nearly used-up token budget"
+    )
     timestamp = models.DateTimeField(auto_now_add=True)
     execution_time = models.FloatField(help_text="Time in seconds")
 
     class Meta:
         db_table = 'rag_query_logs'
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp']),
+            GinIndex(OpClass(Upper('query'), name='gin_trgm_ops'), name='rag_query_logs_query_trgm'),
+            GinIndex(OpClass(Upper('response'), name='gin_trgm_ops'), name='rag_query_logs_response_trgm'),
+        ]
         verbose_name = 'RAG Query Log'
         verbose_name_plural = 'RAG Query Logs'
 
     def __str__(self):
         return f"Query at {self.timestamp}: {self.query[:50]}"
+
+
+class IngestionJob(models.Model):
+    """Tracks asynchronous document ingestion and reindex work"""
+    KIND_CHOICES = [
+        ('ingest', 'Ingest'),
+        ('reindex', 'Reindex'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    STAGE_CHOICES = [
+        ('queued', 'Queued'),
+        ('parsing', 'Parsing'),
+        ('chunking', 'Chunking'),
+        ('embedding', 'Embedding'),
+        ('saving', 'Saving'),
+        ('done', 'Done'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='ingest')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    stage = models.CharField(max_length=10, choices=STAGE_CHOICES, default='queued')
+    document = models.ForeignKey(
+        SourceDocument,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='ingestion_jobs'
+    )
+    collection = models.ForeignKey(
+        Collection,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='ingestion_jobs',
+        help_text="Collection a new document is ingested into (the default one when empty)"
+    )
+    file_path = models.CharField(max_length=500, blank=True)
+    title = models.CharField(max_length=255, blank=True)
+    author = models.CharField(max_length=255, blank=True)
+    metadata = models.JSONField(default=dict, blank=True)
+    uploaded_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='ingestion_jobs'
+    )
+    pages_total = models.IntegerField(default=0)
+    pages_parsed = models.IntegerField(default=0)
+    chunks_total = models.IntegerField(default=0)
+    chunks_embedded = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    error = models.TextField(blank=True)
+    worker_id = models.CharField(max_length=100, blank=True)
+    available_at = models.DateTimeField(auto_now_add=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'ingestion_jobs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+        verbose_name = 'Ingestion Job'
+        verbose_name_plural = 'Ingestion Jobs'
+
+    def __str__(self):
+        return f"{self.get_kind_display()} job {self.id} ({self.status})"
+
+    @property
+    def eta_seconds(self):
+        """Estimated seconds left, extrapolated from the page (or chunk) rate so far"""
+        if self.status != 'running' or not self.started_at:
+            return None
+
+        if self.pages_total and self.pages_parsed:
+            done, total = self.pages_parsed, self.pages_total
+        elif self.chunks_total and self.chunks_embedded:
+            done, total = self.chunks_embedded, self.chunks_total
+        else:
+            return None
+
+        from django.utils import timezone
+
+        elapsed = (timezone.now() - self.started_at).total_seconds()
+        return round(elapsed / done * max(total - done, 0), 1)
+
+
+class IngestionRun(models.Model):
+    """Stage timings, throughput and peak memory of one ingestion or reindex of a file"""
+    STATUS_CHOICES = [
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    document = models.ForeignKey(
+        SourceDocument,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='ingestion_runs'
+    )
+    kind = models.CharField(max_length=10, choices=IngestionJob.KIND_CHOICES, default='ingest')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='succeeded')
+    error = models.TextField(blank=True)
+    file_name = models.CharField(max_length=255, blank=True)
+    file_type = models.CharField(max_length=10, blank=True)
+    file_size = models.BigIntegerField(default=0)
+    pages = models.IntegerField(default=0, help_text="Pages (PDF) or paragraphs (DOCX) parsed")
+    chunks = models.IntegerField(default=0)
+    stage_seconds = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Wall time per stage: parsing, normalizing, compressing, chunking, embedding, saving, other"
+    )
+    total_seconds = models.FloatField(default=0)
+    pages_per_second = models.FloatField(null=True, blank=True)
+    chunks_per_second = models.FloatField(null=True, blank=True)
+    embedding_calls = models.IntegerField(default=0)
+    embedding_tokens = models.IntegerField(
+        default=0,
+        help_text="Estimated tokens sent for embedding (embed_content reports no usage)"
+    )
+    embedding_latency_ms = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="p50, p95 and max of the embedding requests, including waits for quota"
+    )
+    peak_memory_bytes = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text="tracemalloc peak above the start of the run (INGESTION_TRACE_MEMORY)"
+    )
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'ingestion_runs'
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['started_at']),
+        ]
+        verbose_name = 'Ingestion Run'
+        verbose_name_plural = 'Ingestion Runs'
+
+    def __str__(self):
+        return f"{self.get_kind_display()} run {self.id} of {self.file_name} ({self.total_seconds:.1f}s)"
+
+
+class DailyTokenUsage(models.Model):
+    """Gemini tokens spent on one user's chat requests and conversation summaries in a day
+
+    Kept as a running total so token budgets can be checked with one indexed read.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='token_usage')
+    day = models.DateField()
+    prompt_tokens = models.BigIntegerField(default=0)
+    output_tokens = models.BigIntegerField(default=0)
+    embedding_tokens = models.BigIntegerField(default=0, help_text="Estimated")
+    requests = models.IntegerField(default=0, help_text="Chat requests (summaries are not counted)")
+
+    class Meta:
+        db_table = 'daily_token_usage'
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='daily_token_usage_user_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+        verbose_name = 'Daily Token Usage'
+        verbose_name_plural = 'Daily Token Usage'
+
+    def __str__(self):
+        return f"{self.user} on {self.day}: {self.prompt_tokens + self.output_tokens + self.embedding_tokens} tokens"
@@ -0,0 +1,181 @@
+"""
+List partitioning of document_chunks by collection
+
+Django creates document_chunks as a plain table. ``partition_chunk_table`` rebuilds it
+as a table partitioned by ``collection_id``, with one partition per collection plus a
+default partition, and an HNSW index that Postgres creates on every partition. A search
+filtered on a collection then only scans (and only walks the vector index of) that
+collection's partition.
+
+Postgres requires the partition key in every unique constraint of a partitioned table,
+so the primary key becomes (id, collection_id) and the query log's many-to-many table
+loses its database-level foreign key to chunks; Django still removes those rows when
+chunks are deleted.
+"""
+
+from django.db import connection, transaction
+from rag_engine.models import Collection, DocumentChunk
+
+CHUNK_TABLE = DocumentChunk._meta.db_table
+DEFAULT_PARTITION = f"{CHUNK_TABLE}_default"
+VECTOR_INDEX = f"{CHUNK_TABLE}_embedding_hnsw"
+
+
+def partition_name(collection_id: int) -> str:
+    return f"{CHUNK_TABLE}_c{int(collection_id)}"
+
+
+def is_partitioned() -> bool:
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+            [CHUNK_TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def existing_partitions() -> set:
+    """Names of the tables currently attached as partitions of document_chunks"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [CHUNK_TABLE]
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def partition_chunk_table():
+    """Rebuild document_chunks as a list-partitioned table, copying every row
+
+    Runs in one transaction and holds an exclusive lock on the chunk table while rows
+    are copied, so run it in a maintenance window on large installations.
+    """
+    if is_partitioned():
+        return False
+
+    old_table = f"{CHUNK_TABLE}_unpartitioned"
+    q = connection.ops.quote_name
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {q(CHUNK_TABLE)} RENAME TO {q(old_table)}")
+        cursor.execute(
+            f"CREATE TABLE {q(CHUNK_TABLE)} (LIKE {q(old_table)}) PARTITION BY LIST (collection_id)"
+        )
+        cursor.execute(f"ALTER TABLE {q(CHUNK_TABLE)} ADD PRIMARY KEY (id, collection_id)")
+        cursor.execute(f"CREATE TABLE {q(DEFAULT_PARTITION)} PARTITION OF {q(CHUNK_TABLE)} DEFAULT")
+        for collection_id in Collection.objects.values_list('id', flat=True):
+            cursor.execute(
+                f"CREATE TABLE {q(partition_name(collection_id))} PARTITION OF {q(CHUNK_TABLE)} "
+                f"FOR VALUES IN ({int(collection_id)})"
+            )
+
+        cursor.execute(f"INSERT INTO {q(CHUNK_TABLE)} SELECT * FROM {q(old_table)}")
+        # CASCADE also drops the many-to-many foreign key that pointed at the old table,
+        # and the old identity sequence goes with it.
+        cursor.execute(f"DROP TABLE {q(old_table)} CASCADE")
+
+        # Identity columns on partitioned tables need Postgres 17, so ids come from a sequence.
+        sequence = f"{CHUNK_TABLE}_id_seq"
+        cursor.execute(f"CREATE SEQUENCE {q(sequence)} OWNED BY {q(CHUNK_TABLE)}.id")
+        cursor.execute(
+            f"ALTER TABLE {q(CHUNK_TABLE)} ALTER COLUMN id SET DEFAULT nextval(%s::regclass)",
+            [sequence]
+        )
+        cursor.execute(
+            f"SELECT setval(%s::regclass, COALESCE(MAX(id), 0) + 1, false) FROM {q(CHUNK_TABLE)}",
+            [sequence]
+        )
+
+        for field_name in ('document', 'collection'):
+            field = DocumentChunk._meta.get_field(field_name)
+            target = field.target_field
+            cursor.execute(f"CREATE INDEX ON {q(CHUNK_TABLE)} ({q(field.column)})")
+            cursor.execute(
+                f"ALTER TABLE {q(CHUNK_TABLE)} ADD CONSTRAINT {q(f'{CHUNK_TABLE}_{field.column}_fk')} "
+                f"FOREIGN KEY ({q(field.column)}) "
+                f"REFERENCES {q(target.model._meta.db_table)} ({q(target.column)}) "
+                f"DEFERRABLE INITIALLY DEFERRED"
+            )
+
+    with connection.schema_editor() as schema_editor:
+        for index in DocumentChunk._meta.indexes:
+            schema_editor.add_index(DocumentChunk, index)
+
+    create_vector_index()
+    return True
+
+
+def create_vector_index():
+    """Create the HNSW index on the partitioned table; Postgres builds it per partition"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {connection.ops.quote_name(VECTOR_INDEX)} "
+            f"ON {connection.ops.quote_name(CHUNK_TABLE)} USING hnsw (embedding vector_cosine_ops)"
+        )
+
+
+def ensure_partition(collection_id: int) -> bool:
+    """Give a collection its own partition, moving any of its rows out of the default one
+
+    Returns False when the table is not partitioned or the partition already exists.
+    """
+    if not is_partitioned():
+        return False
+
+    name = partition_name(collection_id)
+    if name in existing_partitions():
+        return False
+
+    q = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {q(DEFAULT_PARTITION)} WHERE collection_id = %s)",
+            [collection_id]
+        )
+        if not cursor.fetchone()[0]:
+            cursor.execute(
+                f"CREATE TABLE {q(name)} PARTITION OF {q(CHUNK_TABLE)} FOR VALUES IN ({int(collection_id)})"
+            )
+            return True
+
+        # Postgres refuses to create a partition for values the default partition holds.
+        cursor.execute(f"CREATE TABLE {q(name)} (LIKE {q(CHUNK_TABLE)} INCLUDING DEFAULTS)")
+        cursor.execute(
+            f"INSERT INTO {q(name)} SELECT * FROM {q(DEFAULT_PARTITION)} WHERE collection_id = %s",
+            [collection_id]
+        )
+        cursor.execute(f"DELETE FROM {q(DEFAULT_PARTITION)} WHERE collection_id = %s", [collection_id])
+        cursor.execute(
+            f"ALTER TABLE {q(CHUNK_TABLE)} ATTACH PARTITION {q(name)} FOR VALUES IN ({int(collection_id)})"
+        )
+    return True
+
+
+def drop_partition(collection_id: int) -> bool:
+    """Remove the partition of a deleted collection"""
+    if not is_partitioned():
+        return False
+
+    name = partition_name(collection_id)
+    if name not in existing_partitions():
+        return False
+
+    q = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {q(CHUNK_TABLE)} DETACH PARTITION {q(name)}")
+        cursor.execute(f"DROP TABLE {q(name)}")
+    return True
+
+
+def create_collection_partition(sender, instance, created, **kwargs):
+    """post_save handler: every new collection gets its partition, however it was created"""
+    if created:
+        ensure_partition(instance.id)
+
+
+def drop_collection_partition(sender, instance, **kwargs):
+    """post_delete handler: remove the partition along with its collection"""
+    drop_partition(instance.id)
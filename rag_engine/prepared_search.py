@@ -0,0 +1,92 @@
+"""
+Server-side prepared statement for the chunk similarity search
+
+The nearest-neighbour query runs on every chat message, so each connection prepares
+it once (``PREPARE``) and later searches only send ``EXECUTE`` with the parameters,
+skipping parsing and planning. Postgres keeps prepared statements per session, which
+is why this only pays off with persistent connections (CONN_MAX_AGE) and why it is
+disabled behind pgbouncer in transaction pooling mode, where consecutive statements
+may run on different server connections.
+
+A persistent connection can outlive a schema change to the chunk table (a migration,
+``partition_chunks``); Postgres then refuses the cached plan, so the statement is
+prepared again and the search retried once.
+"""
+
+from typing import List
+from django.db import DatabaseError, connection, transaction
+from rag_engine.models import DocumentChunk, SourceDocument
+
+STATEMENT = 'rag_chunk_search'
+
+# "cached plan must not change result type" (feature_not_supported) and a statement
+# dropped from the session, e.g. by DISCARD ALL (invalid_sql_statement_name).
+STALE_STATEMENT_ERRORS = ('0A000', '26000')
+
+# Cosine distance never exceeds 2, so this bound keeps every hit.
+NO_DISTANCE_LIMIT = 2.0
+
+
+def reset_prepared_state(sender, connection, **kwargs):
+    """connection_created handler: a new session has no prepared statements yet"""
+    connection.chunk_search_prepared = False
+
+
+def _prepare():
+    q = connection.ops.quote_name
+
+    def column(model, name):
+        return q(model._meta.get_field(name).column)
+
+    chunk_table = q(DocumentChunk._meta.db_table)
+    columns = ", ".join(f"c.{q(field.column)}" for field in DocumentChunk._meta.concrete_fields)
+    embedding = column(DocumentChunk, 'embedding')
+
+    # Same filters as RAGEngine.search_similar_chunks: one collection, active generation only.
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", [STATEMENT])
+        if cursor.fetchone() is not None:
+            cursor.execute(f"DEALLOCATE {STATEMENT}")
+        cursor.execute(
+            f"PREPARE {STATEMENT} (vector, bigint, integer, double precision) AS "
+            f"SELECT {columns}, (c.{embedding} <=> $1) AS distance "
+            f"FROM {chunk_table} c "
+            f"JOIN {q(SourceDocument._meta.db_table)} d "
+            f"ON d.{column(SourceDocument, 'id')} = c.{column(DocumentChunk, 'document')} "
+            f"WHERE c.{column(DocumentChunk, 'collection')} = $2 "
+            f"AND c.{column(DocumentChunk, 'generation')} = d.{column(SourceDocument, 'active_generation')} "
+            f"AND (c.{embedding} <=> $1) <= $4 "
+            f"ORDER BY distance LIMIT $3"
+        )
+    connection.chunk_search_prepared = True
+
+
+def prepared_chunk_search(
+    query_embedding: List[float],
+    collection_id: int,
+    top_k: int,
+    max_distance: float = None
+) -> List:
+    """Run the prepared search on this thread's connection, preparing it on first use"""
+    connection.ensure_connection()
+    if not getattr(connection, 'chunk_search_prepared', False):
+        _prepare()
+
+    vector = DocumentChunk._meta.get_field('embedding').get_prep_value(query_embedding)
+    params = [vector, collection_id, top_k, max_distance or NO_DISTANCE_LIMIT]
+    try:
+        return _execute(params)
+    except DatabaseError as e:
+        if getattr(e.__cause__, 'pgcode', None) not in STALE_STATEMENT_ERRORS:
+            raise
+        _prepare()
+        return _execute(params)
+
+
+def _execute(params: List) -> List:
+    query = DocumentChunk.objects.raw(f"EXECUTE {STATEMENT} (%s, %s, %s, %s)", params)
+    if not connection.in_atomic_block:
+        return list(query)
+    # Inside a transaction, a savepoint keeps a stale statement from aborting it.
+    with transaction.atomic():
+        return list(query)
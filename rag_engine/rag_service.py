@@ -1,78 +1,278 @@
+import threading
 import time
 from typing import List, Dict
 from django.conf import settings
-import google.generativeai as genai
-from pgvector.django import CosineDistance
+from django.db.models.functions import Cast
+from pgvector.django import CosineDistance, VectorField
+from rag_engine.chunk_storage import hydrate_chunks
+from rag_engine.context_compression import ContextCompressor
+from rag_engine.embedding_versions import parse_embedding_tag, primary_embedding_tag, search_embedding_tag
+from rag_engine.intent_router import RAG_ROUTE, IntentRouter
+from rag_engine.rate_limit import GeminiRateLimiter
+from rag_engine.single_flight import SingleFlight, flight_key
+from rag_engine.usage import estimate_tokens, record_embedding, record_generation
+
+
+_configured_api_key = None
+_configure_lock = threading.Lock()
+
+
+def _genai():
+    """Import and configure the Gemini SDK on first use
+
+    google.generativeai takes most of a second to import, so processes that never
+    call Gemini (admin, migrations, ingestion-only workers) should not pay for it.
+    Configuration runs once per process, and again only if the key changes.
+    """
+    global _configured_api_key
+    import google.generativeai as genai
+
+    if _configured_api_key != settings.GEMINI_API_KEY:
+        with _configure_lock:
+            if _configured_api_key != settings.GEMINI_API_KEY:
+                genai.configure(api_key=settings.GEMINI_API_KEY)
+                _configured_api_key = settings.GEMINI_API_KEY
+    return genai
 
 
 class GeminiService:
-    """Service for interacting with Google Gemini API"""
+    """Service for interacting with Google Gemini API
+
+    Identical concurrent calls (same model, task and whitespace-normalized input) are
+    coalesced into one upstream request when SINGLE_FLIGHT_ENABLED is set; see
+    SingleFlight. Each upstream request first takes a token from the shared
+    embedding or generation budget; see GeminiRateLimiter. Token usage of each
+    upstream request goes to the enclosing track_usage() block, if any.
+    """
 
     def __init__(self):
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.llm_model = genai.GenerativeModel(settings.LLM_MODEL)
+        self._llm_model = None
         self.embedding_model = settings.EMBEDDING_MODEL
-
-    def generate_response(self, prompt: str, context: str = "") -> str:
+        self.primary_embedding_tag = primary_embedding_tag()
+        self.search_embedding_tag = search_embedding_tag()
+        self.single_flight = SingleFlight('gemini') if settings.SINGLE_FLIGHT_ENABLED else None
+        self.embed_limiter = GeminiRateLimiter('embed', settings.GEMINI_EMBED_CALLS_PER_MINUTE)
+        self.generate_limiter = GeminiRateLimiter('generate', settings.GEMINI_GENERATE_CALLS_PER_MINUTE)
+
+    def _embed_content(self, content, task_type: str, model_tag: str = None):
+        """embed_content for one text or a batch, with the model (and size) of a version tag"""
+        kwargs = {}
+        model = self.embedding_model
+        if model_tag and model_tag != self.primary_embedding_tag:
+            model, kwargs['output_dimensionality'] = parse_embedding_tag(model_tag)
+        return _genai().embed_content(model=model, content=content, task_type=task_type, **kwargs)
+
+    def _coalesced(self, fn, *key_parts):
+        if self.single_flight is None:
+            return fn()
+        return self.single_flight.do(flight_key(*key_parts), fn)
+
+    @property
+    def llm_model(self):
+        if self._llm_model is None:
+            self._llm_model = _genai().GenerativeModel(settings.LLM_MODEL)
+        return self._llm_model
+
+    def generate_response(self, prompt: str, context: str = "", max_output_tokens: int = None) -> str:
         """Generate a response using Gemini LLM"""
-        try:
-            full_prompt = f"{context}\n\n{prompt}" if context else prompt
-            response = self.llm_model.generate_content(full_prompt)
-            return response.text
-        except Exception as e:
-            raise Exception(f"Error generating response: {str(e)}")
+        def call():
+            self.generate_limiter.acquire()
+            try:
+                full_prompt = f"{context}\n\n{prompt}" if context else prompt
+                kwargs = {}
+                if max_output_tokens:
+                    kwargs['generation_config'] = {'max_output_tokens': max_output_tokens}
+                response = self.llm_model.generate_content(full_prompt, **kwargs)
+                record_generation(response)
+                return response.text
+            except Exception as e:
+                raise Exception(f"Error generating response: {str(e)}")
+
+        return self._coalesced(call, 'generate', settings.LLM_MODEL, prompt, context, max_output_tokens)
 
     def generate_embedding(self, text: str) -> List[float]:
         """Generate embeddings using Gemini embedding model"""
-        try:
-            result = genai.embed_content(
-                model=self.embedding_model,
-                content=text,
-                task_type="retrieval_document"
-            )
-            return result['embedding']
-        except Exception as e:
-            raise Exception(f"Error generating embedding: {str(e)}")
+        def call():
+            self.embed_limiter.acquire()
+            try:
+                result = _genai().embed_content(
+                    model=self.embedding_model,
+                    content=text,
+                    task_type="retrieval_document"
+                )
+                record_embedding(text)
+                return result['embedding']
+            except Exception as e:
+                raise Exception(f"Error generating embedding: {str(e)}")
+
+        return self._coalesced(call, 'embed', self.primary_embedding_tag, 'retrieval_document', text)
+
+    def generate_embeddings(
+        self,
+        texts: List[str],
+        task_type: str = "retrieval_document",
+        model_tag: str = None
+    ) -> List[List[float]]:
+        """Generate embeddings for a batch of texts in one request (documents by default)
+
+        ``model_tag`` selects an embedding version other than EMBEDDING_MODEL.
+        """
+        model_tag = model_tag or self.primary_embedding_tag
+
+        def call():
+            self.embed_limiter.acquire()
+            try:
+                result = self._embed_content(texts, task_type, model_tag)
+                record_embedding(texts)
+                return result['embedding']
+            except Exception as e:
+                raise Exception(f"Error generating embeddings: {str(e)}")
+
+        return self._coalesced(call, 'embed_batch', model_tag, task_type, list(texts))
 
     def generate_query_embedding(self, query: str) -> List[float]:
-        """Generate embeddings for search queries"""
-        try:
-            result = genai.embed_content(
-                model=self.embedding_model,
-                content=query,
-                task_type="retrieval_query"
-            )
-            return result['embedding']
-        except Exception as e:
-            raise Exception(f"Error generating query embedding: {str(e)}")
+        """Generate embeddings for search queries with the SEARCH_EMBEDDING_MODEL version"""
+        def call():
+            self.embed_limiter.acquire()
+            try:
+                result = self._embed_content(query, "retrieval_query", self.search_embedding_tag)
+                record_embedding(query)
+                return result['embedding']
+            except Exception as e:
+                raise Exception(f"Error generating query embedding: {str(e)}")
+
+        return self._coalesced(call, 'embed', self.search_embedding_tag, 'retrieval_query', query)
 
 
 class RAGEngine:
     """RAG engine for retrieving relevant documents and generating responses"""
 
-    def __init__(self):
-        self.gemini_service = GeminiService()
+    def __init__(self, gemini_service: GeminiService = None):
+        self.gemini_service = gemini_service or GeminiService()
         self.top_k = settings.TOP_K_RESULTS
+        self.max_top_k = settings.RETRIEVAL_MAX_TOP_K
+        self.max_distance = settings.RETRIEVAL_MAX_DISTANCE
+        self.relative_gap = settings.RETRIEVAL_RELATIVE_GAP
+        self.search_embedding_tag = search_embedding_tag()
+        self.prepared_search = (
+            settings.DB_PREPARED_SEARCH and not settings.DB_PGBOUNCER
+            and self.search_embedding_tag == primary_embedding_tag()
+        )
+        # Centroids are built from the primary embeddings, so routing needs that version.
+        self.document_routing_top_m = (
+            settings.DOCUMENT_ROUTING_TOP_M if self.search_embedding_tag == primary_embedding_tag() else 0
+        )
         self.max_context_tokens = settings.MAX_CONTEXT_TOKENS
+        self.intent_router = IntentRouter(self.gemini_service) if settings.INTENT_ROUTER_ENABLED else None
+        self.context_compressor = (
+            ContextCompressor(self.gemini_service) if settings.CONTEXT_COMPRESSION_MODE != 'off' else None
+        )
+        self._default_collection_id = None
+
+    @property
+    def default_collection_id(self) -> int:
+        if self._default_collection_id is None:
+            from rag_engine.models import get_default_collection_id
+
+            self._default_collection_id = get_default_collection_id()
+        return self._default_collection_id
 
-    def search_similar_chunks(self, query_embedding: List[float], top_k: int = None) -> List:
-        """Search for similar document chunks using vector similarity"""
+    def search_similar_chunks(
+        self,
+        query_embedding: List[float],
+        top_k: int = None,
+        collection_id: int = None
+    ) -> List:
+        """Search for similar document chunks of one collection using vector similarity
+
+        Filtering on the partition key keeps the scan (and the vector index walk) inside
+        the collection's partition of document_chunks. At most ``max_top_k`` chunks are
+        returned, hits beyond ``max_distance`` are dropped, and the list is cut where
+        similarity falls more than ``relative_gap`` below the best hit. With
+        ``prepared_search`` the query runs as a per-connection prepared statement.
+        When SEARCH_EMBEDDING_MODEL names another embedding version, distances come
+        from that version's ChunkEmbedding rows instead of the chunk's own embedding.
+        With ``document_routing_top_m`` only the chunks of the documents picked by
+        ``route_documents`` are ranked.
+        """
         from rag_engine.models import DocumentChunk
 
         if top_k is None:
             top_k = self.top_k
+        top_k = max(1, min(top_k, self.max_top_k))
+        if collection_id is None:
+            collection_id = self.default_collection_id
+
+        document_ids = self.route_documents(query_embedding, collection_id) if self.document_routing_top_m else None
+
+        if self.prepared_search and document_ids is None:
+            from rag_engine.prepared_search import prepared_chunk_search
+
+            return self.cut_at_relative_gap(
+                hydrate_chunks(prepared_chunk_search(query_embedding, collection_id, top_k, self.max_distance))
+            )
 
         # chunks = DocumentChunk.objects.order_by(
         #     DocumentChunk.embedding.cosine_distance(query_embedding)
         # )[:top_k]
 
-        chunks = (
-            DocumentChunk.objects
-            .annotate(distance=CosineDistance('embedding', query_embedding))
-            .order_by('distance')[:top_k]
+        chunks = DocumentChunk.objects.filter(collection_id=collection_id).active()
+        if document_ids is not None:
+            chunks = chunks.filter(document_id__in=document_ids)
+        if self.search_embedding_tag == primary_embedding_tag():
+            chunks = chunks.annotate(distance=CosineDistance('embedding', query_embedding))
+        else:
+            # Cast to the version's dimension so its partial HNSW index applies.
+            _, dimension = parse_embedding_tag(self.search_embedding_tag)
+            chunks = (
+                chunks.filter(embeddings__model=self.search_embedding_tag)
+                .defer('embedding')
+                .annotate(distance=CosineDistance(
+                    Cast('embeddings__embedding', VectorField(dimensions=dimension)), query_embedding
+                ))
+            )
+        if self.max_distance:
+            chunks = chunks.filter(distance__lte=self.max_distance)
+
+        return self.cut_at_relative_gap(hydrate_chunks(list(chunks.order_by('distance')[:top_k])))
+
+    def route_documents(self, query_embedding: List[float], collection_id: int) -> List[int]:
+        """Ids of the documents a routed search ranks chunks from
+
+        The ``document_routing_top_m`` documents of the collection whose centroids are
+        nearest the query, plus any document that has no centroid yet because its
+        first ingestion is still running.
+        """
+        from rag_engine.models import SourceDocument
+
+        documents = SourceDocument.objects.filter(collection_id=collection_id, canonical_document__isnull=True)
+        nearest = (
+            documents.filter(centroid__isnull=False)
+            .annotate(distance=CosineDistance('centroid', query_embedding))
+            .order_by('distance')
+            .values_list('id', flat=True)[:self.document_routing_top_m]
         )
-
-        return list(chunks)
+        return list(nearest) + list(documents.filter(centroid__isnull=True).values_list('id', flat=True))
+
+    def cut_at_relative_gap(self, chunks: List) -> List:
+        """Keep hits whose similarity is within ``relative_gap`` of the best one (adaptive k)
+
+        A relative gap means nothing once the best similarity is zero or negative
+        (possible with RETRIEVAL_MAX_DISTANCE disabled), so no cut is made then.
+        """
+        if not chunks or not self.relative_gap:
+            return chunks
+
+        best_similarity = 1 - chunks[0].distance
+        if best_similarity <= 0:
+            return chunks
+        floor = best_similarity * (1 - self.relative_gap)
+        kept = []
+        for chunk in chunks:
+            if 1 - chunk.distance < floor:
+                break
+            kept.append(chunk)
+        return kept
 
     def build_context(self, chunks: List, max_tokens: int = None) -> str:
         """Build context from retrieved chunks"""
@@ -98,23 +298,55 @@ class RAGEngine:
         self,
         query: str,
         conversation_history: List[Dict] = None,
-        top_k: int = None
+        conversation_summary: str = "",
+        top_k: int = None,
+        collection_id: int = None,
+        message: str = None,
+        max_context_tokens: int = None,
+        max_output_tokens: int = None
     ) -> Dict:
-        """Generate response using RAG"""
+        """Generate response using RAG
+
+        Small talk and off-topic messages are answered by the intent router with a
+        template before retrieval (pattern rules) or right after the query embedding
+        (nearest centroid). ``message`` is the user's text without any instruction
+        prefix and is what gets routed. With CONTEXT_COMPRESSION_MODE set, only the
+        sentences of each chunk that ContextCompressor keeps reach the context, and
+        ``compression_ratio`` gives the share of retrieved words kept.
+        ``max_context_tokens`` and ``max_output_tokens`` tighten the context and
+        answer lengths, as check_token_budget asks for when a budget runs low.
+        """
         start_time = time.time()
+        message = message or query
+
+        routed = self.intent_router.match_rules(message) if self.intent_router else None
+        if routed is not None:
+            return self._routed_response(routed, start_time)
 
         query_embedding = self.gemini_service.generate_query_embedding(query)
-        relevant_chunks = self.search_similar_chunks(query_embedding, top_k)
 
-        context = self.build_context(relevant_chunks)
+        routed = self.intent_router.match_centroid(message, query_embedding) if self.intent_router else None
+        if routed is not None:
+            return self._routed_response(routed, start_time, query_embedding)
+
+        relevant_chunks = self.search_similar_chunks(query_embedding, top_k, collection_id)
+
+        context_chunks, compression_ratio = relevant_chunks, None
+        if self.context_compressor:
+            context_chunks, compression_ratio = self.context_compressor.compress(
+                query, query_embedding, relevant_chunks, self.search_embedding_tag
+            )
+        context = self.build_context(context_chunks, max_context_tokens)
 
         history_context = ""
+        if conversation_summary:
+            history_context = "\nSummary of earlier conversation:\n" + conversation_summary + "\n"
         if conversation_history:
             history_parts = []
-            for msg in conversation_history[-5:]:
+            for msg in conversation_history:
                 role = "User" if msg['sender'] == 'user' else "Assistant"
                 history_parts.append(f"{role}: {msg['content']}")
-            history_context = "\nConversation History:\n" + "\n".join(history_parts) + "\n"
+            history_context += "\nConversation History:\n" + "\n".join(history_parts) + "\n"
 
 
         #         full_context = f"""Improved System Prompt (in English, responses in Spanish)
@@ -174,7 +406,15 @@ User question:
 
 Respond in Spanish, naturally and strictly based on the context above, staying focused on travel and tourism topics:"""
 
-        response = self.gemini_service.generate_response("", full_context)
+        response = self.gemini_service.generate_response("", full_context, max_output_tokens)
+
+        # Estimated share of each part of the prompt; the template is what is left.
+        prompt_breakdown = {
+            'context': estimate_tokens(context),
+            'history': estimate_tokens(history_context),
+            'question': estimate_tokens(query),
+        }
+        prompt_breakdown['instructions'] = max(0, estimate_tokens(full_context) - sum(prompt_breakdown.values()))
 
         execution_time = time.time() - start_time
 
@@ -183,4 +423,28 @@ Respond in Spanish, naturally and strictly based on the context above, staying f
             'chunks_used': relevant_chunks,
             'execution_time': execution_time,
             'num_chunks': len(relevant_chunks),
+            'chunk_distances': [
+                {'chunk_id': chunk.id, 'distance': round(chunk.distance, 4)} for chunk in relevant_chunks
+            ],
+            'route': RAG_ROUTE,
+            'route_score': None,
+            'query_embedding': query_embedding,
+            'embedding_model': self.search_embedding_tag,
+            'prompt_breakdown': prompt_breakdown,
+            'compression_ratio': compression_ratio,
+        }
+
+    def _routed_response(self, routed: Dict, start_time: float, query_embedding: List[float] = None) -> Dict:
+        return {
+            'response': routed['response'],
+            'chunks_used': [],
+            'execution_time': time.time() - start_time,
+            'num_chunks': 0,
+            'chunk_distances': [],
+            'route': routed['route'],
+            'route_score': routed['score'],
+            'query_embedding': query_embedding,
+            'embedding_model': self.search_embedding_tag if query_embedding is not None else '',
+            'prompt_breakdown': {},
+            'compression_ratio': None,
         }
@@ -0,0 +1,172 @@
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+_priority = contextvars.ContextVar('gemini_priority', default=INTERACTIVE)
+_deadline = contextvars.ContextVar('gemini_deadline', default=None)
+
+
+class RateLimited(Exception):
+    """Raised when a call cannot be admitted before its deadline"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+@contextmanager
+def gemini_call_context(priority: str = INTERACTIVE, deadline: float = None):
+    """Set the priority (and, for interactive calls, a time.monotonic() deadline) of
+    the Gemini calls made inside the block"""
+    priority_token = _priority.set(priority)
+    deadline_token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _priority.reset(priority_token)
+        _deadline.reset(deadline_token)
+
+
+def interactive_deadline():
+    """The time.monotonic() deadline of the interactive call being made, if it has one"""
+    if _priority.get() == BACKGROUND:
+        return None
+    return _deadline.get()
+
+
+class GeminiRateLimiter:
+    """Call budget for one kind of Gemini request, shared by every worker through the cache
+
+    Each window of RATE_LIMIT_WINDOW seconds holds ``calls_per_minute * window / 60``
+    tokens, counted with atomic ``cache.incr`` on a key per window, so all workers draw
+    from one budget when CACHES is a shared backend (Redis or Memcached). Background
+    calls (ingestion embeddings, conversation summaries) may only take the first
+    RATE_LIMIT_BACKGROUND_SHARE of each window and wait as long as needed; interactive
+    calls may take the rest, and give up with RateLimited when the next window starts
+    after their deadline or when this process already has RATE_LIMIT_MAX_WAITERS
+    interactive calls waiting.
+    """
+
+    def __init__(self, name: str, calls_per_minute: int):
+        self.name = name
+        self.window = settings.RATE_LIMIT_WINDOW
+        self.capacity = int(calls_per_minute * self.window / 60) if calls_per_minute else 0
+        if calls_per_minute:
+            self.capacity = max(1, self.capacity)
+        self.background_capacity = max(1, int(self.capacity * settings.RATE_LIMIT_BACKGROUND_SHARE))
+        self.max_waiters = settings.RATE_LIMIT_MAX_WAITERS
+
+        self._waiters = 0
+        self._lock = threading.Lock()
+        self._stats = {'admitted': 0, 'waited': 0, 'rejected': 0}
+
+    def acquire(self):
+        """Take one token, waiting for a later window if allowed; raises RateLimited"""
+        if not self.capacity:
+            return
+
+        priority = _priority.get()
+        interactive = priority != BACKGROUND
+        limit = self.capacity if interactive else self.background_capacity
+        deadline = _deadline.get()
+        if interactive and deadline is None:
+            deadline = time.monotonic() + settings.GEMINI_MAX_QUEUE_WAIT
+
+        queued = False
+        try:
+            while True:
+                now = time.time()
+                slot = int(now // self.window)
+                if self._take(slot, limit):
+                    self._count('waited' if queued else 'admitted')
+                    return
+
+                wait = (slot + 1) * self.window - now
+                if interactive:
+                    if time.monotonic() + wait > deadline:
+                        self._count('rejected')
+                        raise RateLimited(f"Gemini {self.name} quota exhausted", wait)
+                    if not queued:
+                        if not self._enter_queue():
+                            self._count('rejected')
+                            raise RateLimited(f"Too many requests waiting for Gemini {self.name} quota", wait)
+                        queued = True
+                # Spread the wake-ups so waiting workers do not all hit the new window at once.
+                time.sleep(wait + random.uniform(0, self.window * 0.1))
+        finally:
+            if queued:
+                with self._lock:
+                    self._waiters -= 1
+
+    def _take(self, slot: int, limit: int) -> bool:
+        key = f"ratelimit:gemini:{self.name}:{slot}"
+        cache.add(key, 0, timeout=int(self.window * 2) + 1)
+        try:
+            used = cache.incr(key)
+        except ValueError:
+            # The window key expired between add and incr.
+            cache.add(key, 0, timeout=int(self.window * 2) + 1)
+            used = cache.incr(key)
+        if used <= limit:
+            return True
+        # Give the token back so failed background attempts do not eat the interactive share.
+        cache.decr(key)
+        return False
+
+    def _enter_queue(self) -> bool:
+        with self._lock:
+            if self._waiters >= self.max_waiters:
+                return False
+            self._waiters += 1
+            return True
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['waiting'] = self._waiters
+        return stats
+
+
+@contextmanager
+def user_concurrency_slot(user_key: str):
+    """Hold one of a user's CHAT_MAX_CONCURRENT_PER_USER in-flight chat slots
+
+    The counter lives in the cache so the limit holds across workers; its timeout
+    releases slots left behind by a worker that died mid-request.
+    """
+    limit = settings.CHAT_MAX_CONCURRENT_PER_USER
+    if not limit:
+        yield
+        return
+
+    key = f"ratelimit:chat:{user_key}"
+    timeout = int(settings.GEMINI_MAX_QUEUE_WAIT) + 120
+    cache.add(key, 0, timeout=timeout)
+    try:
+        in_flight = cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=timeout)
+        in_flight = cache.incr(key)
+
+    if in_flight > limit:
+        cache.decr(key)
+        raise RateLimited("Too many messages in progress for this user", 1)
+
+    try:
+        yield
+    finally:
+        try:
+            cache.decr(key)
+        except ValueError:
+            pass
@@ -1,14 +1,33 @@
 from rest_framework import serializers
-from rag_engine.models import SourceDocument, DocumentChunk, RAGQueryLog
+from rag_engine.chunk_storage import chunk_content
+from rag_engine.models import Collection, SourceDocument, DocumentChunk, RAGQueryLog, IngestionJob, IngestionRun
+
+
+class CollectionSerializer(serializers.ModelSerializer):
+    document_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Collection
+        fields = ['id', 'name', 'slug', 'description', 'document_count', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+    def get_document_count(self, obj):
+        return obj.documents.count()
 
 
 class DocumentChunkSerializer(serializers.ModelSerializer):
     document_title = serializers.CharField(source='document.title', read_only=True)
+    content = serializers.SerializerMethodField()
 
     class Meta:
         model = DocumentChunk
-        fields = ['id', 'document', 'document_title', 'content', 'chunk_index', 'metadata', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = [
+            'id', 'document', 'document_title', 'content', 'chunk_index', 'generation', 'metadata', 'created_at'
+        ]
+        read_only_fields = ['id', 'generation', 'created_at']
+
+    def get_content(self, obj):
+        return chunk_content(obj)
 
 
 class SourceDocumentSerializer(serializers.ModelSerializer):
@@ -18,13 +37,17 @@ class SourceDocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = SourceDocument
         fields = [
-            'id', 'title', 'author', 'file_path', 'file_type', 'file_size',
-            'upload_date', 'metadata', 'uploaded_by', 'uploaded_by_username', 'chunk_count'
+            'id', 'collection', 'title', 'author', 'file_path', 'file_type', 'file_size', 'content_hash',
+            'canonical_document', 'active_generation', 'upload_date', 'metadata', 'uploaded_by',
+            'uploaded_by_username', 'chunk_count'
+        ]
+        read_only_fields = [
+            'id', 'collection', 'upload_date', 'file_size', 'content_hash', 'canonical_document',
+            'active_generation'
         ]
-        read_only_fields = ['id', 'upload_date', 'file_size']
 
     def get_chunk_count(self, obj):
-        return obj.chunks.count()
+        return obj.chunk_source.chunks.active().count()
 
 
 class DocumentUploadSerializer(serializers.Serializer):
@@ -32,6 +55,9 @@ class DocumentUploadSerializer(serializers.Serializer):
     title = serializers.CharField(required=False, allow_blank=True)
     author = serializers.CharField(required=False, allow_blank=True)
     metadata = serializers.JSONField(required=False)
+    collection = serializers.SlugRelatedField(
+        slug_field='slug', queryset=Collection.objects.all(), required=False
+    )
 
 
 class RAGQueryLogSerializer(serializers.ModelSerializer):
@@ -40,5 +66,34 @@ class RAGQueryLogSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = RAGQueryLog
-        fields = ['id', 'conversation_id', 'query', 'chunks_used', 'response', 'timestamp', 'execution_time']
+        fields = [
+            'id', 'conversation_id', 'collection', 'query', 'route', 'route_score', 'chunks_used',
+            'chunk_distances', 'response', 'prompt_tokens', 'output_tokens', 'embedding_tokens', 'prompt_breakdown',
+            'compression_ratio', 'budget_degraded', 'timestamp', 'execution_time'
+        ]
         read_only_fields = ['id', 'timestamp']
+
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    eta_seconds = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = IngestionJob
+        fields = [
+            'id', 'kind', 'status', 'stage', 'document', 'collection', 'title', 'pages_total', 'pages_parsed',
+            'chunks_total', 'chunks_embedded', 'eta_seconds', 'attempts', 'max_attempts', 'error',
+            'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+
+class IngestionRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestionRun
+        fields = [
+            'id', 'document', 'kind', 'status', 'error', 'file_name', 'file_type', 'file_size', 'pages', 'chunks',
+            'stage_seconds', 'total_seconds', 'pages_per_second', 'chunks_per_second', 'embedding_calls',
+            'embedding_tokens', 'embedding_latency_ms', 'peak_memory_bytes', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
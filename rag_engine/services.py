@@ -0,0 +1,161 @@
+import threading
+import time
+from typing import Callable, Dict
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+
+_registry = {}
+_registry_lock = threading.RLock()
+
+_warm_state = {
+    'warm': False,
+    'warming': False,
+    'warmed_at': None,
+    'duration': None,
+    'steps': {},
+    'errors': {},
+}
+_warm_lock = threading.Lock()
+
+
+def get_service(name: str, factory: Callable):
+    """Return the process-wide instance registered under name, creating it once"""
+    service = _registry.get(name)
+    if service is None:
+        with _registry_lock:
+            service = _registry.get(name)
+            if service is None:
+                service = factory()
+                _registry[name] = service
+    return service
+
+
+def reset_services():
+    """Drop all registered instances so the next lookup rebuilds them"""
+    with _registry_lock:
+        _registry.clear()
+
+
+def get_gemini_service():
+    from rag_engine.rag_service import GeminiService
+    return get_service('gemini', GeminiService)
+
+
+def get_rag_engine():
+    from rag_engine.rag_service import RAGEngine
+    return get_service('rag_engine', lambda: RAGEngine(gemini_service=get_gemini_service()))
+
+
+def get_ingestion_service():
+    from document_processor.ingestion_service import DocumentIngestionService
+    return get_service(
+        'ingestion',
+        lambda: DocumentIngestionService(gemini_service=get_gemini_service())
+    )
+
+
+def warm_up(embedding: bool = True, vector_index: bool = True) -> Dict:
+    """Build services, open connections and prime caches before taking traffic
+
+    Runs a dummy query embedding (opening the Gemini HTTP connection) and a nearest
+    neighbour search with it, so the chunk table and its vector index pages are in
+    shared buffers. Failed steps are recorded and leave the process not warm.
+    """
+    with _warm_lock:
+        if _warm_state['warming']:
+            return readiness()
+        _warm_state['warming'] = True
+
+    started = time.monotonic()
+    steps = {}
+    errors = {}
+
+    def timed(name, step):
+        step_started = time.monotonic()
+        try:
+            result = step()
+        except Exception as e:
+            errors[name] = str(e)
+            return None
+        steps[name] = round(time.monotonic() - step_started, 3)
+        return result
+
+    engine = timed('services', lambda: get_ingestion_service() and get_rag_engine())
+    # The Gemini SDK is imported lazily; load it here so the first request does not pay for it.
+    if engine is not None:
+        timed('sdk', lambda: engine.gemini_service.llm_model)
+    timed('database', connection.ensure_connection)
+
+    query_embedding = None
+    if engine is not None and embedding:
+        query_embedding = timed(
+            'embedding', lambda: engine.gemini_service.generate_query_embedding('warm-up')
+        )
+        if engine.intent_router is not None:
+            timed('intent_router', engine.intent_router.prepare)
+
+    if engine is not None and vector_index:
+        vector = query_embedding or [1.0] + [0.0] * (settings.EMBEDDING_DIMENSION - 1)
+        timed('vector_index', lambda: engine.search_similar_chunks(vector, top_k=1))
+        timed('prewarm', _prewarm_chunk_relations)
+
+    with _warm_lock:
+        _warm_state.update(
+            warm=not errors,
+            warming=False,
+            warmed_at=timezone.now().isoformat(),
+            duration=round(time.monotonic() - started, 3),
+            steps=steps,
+            errors=errors,
+        )
+    return readiness()
+
+
+def _prewarm_chunk_relations():
+    """Load the chunk table and its indexes into shared buffers when pg_prewarm is installed"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_prewarm'")
+        if cursor.fetchone() is None:
+            return
+        # Once partitioned, the parent has no storage of its own; warm its partitions instead.
+        cursor.execute(
+            "WITH tables AS ("
+            "  SELECT 'document_chunks'::regclass AS oid"
+            "  UNION ALL SELECT inhrelid FROM pg_inherits WHERE inhparent = 'document_chunks'::regclass"
+            ") "
+            "SELECT pg_prewarm(c.oid) FROM pg_class c JOIN tables t ON c.oid = t.oid WHERE c.relkind = 'r' "
+            "UNION ALL SELECT pg_prewarm(i.indexrelid) FROM pg_index i JOIN tables t ON i.indrelid = t.oid "
+            "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relkind = 'i'"
+        )
+
+
+def warm_up_in_background():
+    """Start warm_up on a daemon thread (used from AppConfig.ready)"""
+    def target():
+        try:
+            warm_up()
+        finally:
+            connection.close()
+
+    threading.Thread(target=target, name='service-warm-up', daemon=True).start()
+
+
+def readiness() -> Dict:
+    """Snapshot of the warm-up state for the readiness endpoint"""
+    with _warm_lock:
+        state = dict(_warm_state)
+    state['services'] = sorted(_registry)
+    gemini = _registry.get('gemini')
+    if gemini is not None and gemini.single_flight is not None:
+        state['single_flight'] = gemini.single_flight.stats()
+    if gemini is not None:
+        state['rate_limits'] = {
+            'embed': gemini.embed_limiter.stats(),
+            'generate': gemini.generate_limiter.stats(),
+        }
+    engine = _registry.get('rag_engine')
+    if engine is not None and engine.context_compressor is not None:
+        state['context_compression'] = engine.context_compressor.stats()
+    return state
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Callable, Dict, Tuple
+from django.conf import settings
+from rag_engine.rate_limit import RateLimited, interactive_deadline
+
+
+def flight_key(*parts) -> str:
+    """Stable key for a call; string parts are compared with whitespace collapsed"""
+    normalized = [' '.join(part.split()) if isinstance(part, str) else part for part in parts]
+    payload = json.dumps(normalized, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Makes identical concurrent calls share one execution
+
+    The first caller for a key runs the function; callers arriving while it is in
+    flight wait for it and get the same result (or exception). With ``shared`` set,
+    the leader also takes a lock key in the Django cache with ``cache.add`` so leaders
+    in other worker processes wait for it too, and publishes its result there for
+    ``result_ttl`` seconds for them to collect. A caller that finds no call in flight
+    always runs the function, so this is not a result cache. Sharing only spans
+    processes when CACHES points at a shared backend such as Redis or Memcached.
+
+    Waiting is bounded by ``wait_timeout``; a caller that gives up runs the function
+    itself, so a stuck or crashed leader never blocks anyone for longer than that.
+    An interactive caller with a deadline (see ``gemini_call_context``) waits no
+    longer than that deadline and then gets RateLimited.
+    """
+
+    def __init__(self, namespace: str, shared: bool = None, wait_timeout: float = None, result_ttl: int = None):
+        self.namespace = namespace
+        self.shared = settings.SINGLE_FLIGHT_SHARED if shared is None else shared
+        self.wait_timeout = settings.SINGLE_FLIGHT_WAIT_TIMEOUT if wait_timeout is None else wait_timeout
+        self.result_ttl = settings.SINGLE_FLIGHT_RESULT_TTL if result_ttl is None else result_ttl
+        self.poll_interval = 0.05
+
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'executed': 0, 'coalesced': 0, 'shared': 0, 'timeouts': 0, 'errors': 0}
+
+    def do(self, key: str, fn: Callable):
+        """Run fn once for all concurrent callers passing the same key"""
+        with self._lock:
+            self._stats['calls'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            wait, bounded_by_deadline = self._wait_budget()
+            if flight.done.wait(wait):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+            return self._on_timeout(fn, bounded_by_deadline)
+
+        try:
+            flight.result = self._shared_do(key, fn) if self.shared else self._execute(fn)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        return flight.result
+
+    def _shared_do(self, key: str, fn: Callable):
+        from django.core.cache import cache
+
+        lock_key = f"singleflight:{self.namespace}:{key}:lock"
+        result_key = f"singleflight:{self.namespace}:{key}:result"
+
+        wait, bounded_by_deadline = self._wait_budget()
+        deadline = time.monotonic() + wait
+        while True:
+            if cache.add(lock_key, 1, timeout=max(1, int(self.wait_timeout))):
+                break
+            # Another worker holds the call; its result shows up once it finishes.
+            cached = cache.get(result_key)
+            if cached is not None:
+                self._count('shared')
+                return cached['value']
+            if time.monotonic() >= deadline:
+                # The other worker is too slow (or died holding the lock).
+                return self._on_timeout(fn, bounded_by_deadline)
+            time.sleep(self.poll_interval)
+
+        try:
+            value = self._execute(fn)
+            cache.set(result_key, {'value': value}, timeout=self.result_ttl)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    def _wait_budget(self) -> Tuple[float, bool]:
+        """How long a follower may wait, and whether the caller's deadline set that limit"""
+        deadline = interactive_deadline()
+        if deadline is None:
+            return self.wait_timeout, False
+        remaining = max(0.0, deadline - time.monotonic())
+        if remaining < self.wait_timeout:
+            return remaining, True
+        return self.wait_timeout, False
+
+    def _on_timeout(self, fn: Callable, bounded_by_deadline: bool):
+        self._count('timeouts')
+        if bounded_by_deadline:
+            raise RateLimited("Timed out waiting for an identical Gemini call", 1)
+        # Call upstream ourselves rather than wait on a stuck leader any longer.
+        return self._execute(fn)
+
+    def _execute(self, fn: Callable):
+        self._count('executed')
+        try:
+            return fn()
+        except Exception:
+            self._count('errors')
+            raise
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict:
+        """Counters since process start; coalesced + shared calls never reached upstream"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights)
+        return stats
@@ -1,3 +1,805 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from chatbot.models import User
+from document_processor.ingestion_service import DocumentIngestionService
+from document_processor.storage import store_content
+from document_processor.telemetry import percentile
+from rag_engine.chunk_storage import compress_text
+from rag_engine.context_compression import EMBEDDING, ContextCompressor
+from rag_engine.embedding_versions import search_embedding_tag
+from rag_engine.intent_router import DEFAULT_EXAMPLES, RAG_ROUTE, IntentRouter
+from rag_engine.management.commands.replay_queries import jaccard, recall
+from rag_engine.management.commands.startup_profile import LAZY_MODULES, STARTUP_SCRIPT
+from rag_engine.models import (
+    Collection, DailyTokenUsage, DocumentChunk, DocumentText, IngestionJob, IngestionRun, RAGQueryLog,
+    SourceDocument
+)
+from rag_engine.partitioning import existing_partitions, partition_chunk_table, partition_name
+from rag_engine.prepared_search import prepared_chunk_search
+from rag_engine.rag_service import RAGEngine
+from rag_engine.rate_limit import BACKGROUND, INTERACTIVE, GeminiRateLimiter, RateLimited, gemini_call_context
+from rag_engine.single_flight import SingleFlight
+from rag_engine.usage import TokenBudgetExceeded, TokenUsage, check_token_budget, estimate_tokens, record_daily_usage
 
-# Create your tests here.
+
+class CollectionPartitionTests(TestCase):
+    def setUp(self):
+        # DDL is transactional in Postgres, so the test transaction undoes the rebuild.
+        partition_chunk_table()
+
+    def partition_of(self, chunk: DocumentChunk) -> str:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tableoid::regclass::text FROM document_chunks WHERE id = %s", [chunk.id])
+            return cursor.fetchone()[0]
+
+    def create_chunk(self, collection: Collection) -> DocumentChunk:
+        document = SourceDocument.objects.create(
+            collection=collection, title='Handbook', file_path='handbook.pdf', file_type='pdf', file_size=1
+        )
+        return DocumentChunk.objects.create(
+            document=document,
+            collection=collection,
+            chunk_index=0,
+            content='Vacation policy',
+            embedding=[0.1] * settings.EMBEDDING_DIMENSION
+        )
+
+    def test_new_collection_chunks_go_to_its_own_partition(self):
+        collection = Collection.objects.create(name='Legal', slug='legal')
+
+        self.assertIn(partition_name(collection.id), existing_partitions())
+        chunk = self.create_chunk(collection)
+        self.assertEqual(self.partition_of(chunk), partition_name(collection.id))
+
+    def test_default_collection_created_on_demand_gets_a_partition(self):
+        Collection.objects.filter(slug=settings.DEFAULT_COLLECTION_SLUG).delete()
+
+        collection = Collection.get_default()
+
+        chunk = self.create_chunk(collection)
+        self.assertEqual(self.partition_of(chunk), partition_name(collection.id))
+
+    def test_deleting_a_collection_drops_its_partition(self):
+        collection = Collection.objects.create(name='Archive', slug='archive')
+        name = partition_name(collection.id)
+
+        collection.delete()
+
+        self.assertNotIn(name, existing_partitions())
+
+
+@override_settings(RETRIEVAL_RELATIVE_GAP=0.25)
+class RelativeGapCutTests(SimpleTestCase):
+    def setUp(self):
+        self.engine = RAGEngine(gemini_service=object())
+
+    def hits(self, *distances):
+        return [SimpleNamespace(distance=distance) for distance in distances]
+
+    def test_cuts_where_similarity_drops_below_the_gap(self):
+        kept = self.engine.cut_at_relative_gap(self.hits(0.1, 0.2, 0.3, 0.5))
+        self.assertEqual([hit.distance for hit in kept], [0.1, 0.2, 0.3])
+
+    def test_keeps_every_hit_when_the_best_similarity_is_not_positive(self):
+        hits = self.hits(1.0, 1.1, 1.6)
+        self.assertEqual(self.engine.cut_at_relative_gap(hits), hits)
+        hits = self.hits(1.2, 1.3, 1.9)
+        self.assertEqual(self.engine.cut_at_relative_gap(hits), hits)
+
+
+def unit_vector(*leading):
+    return list(leading) + [0.0] * (settings.EMBEDDING_DIMENSION - len(leading))
+
+
+@override_settings(
+    DB_PREPARED_SEARCH=True, DB_PGBOUNCER=False, DOCUMENT_ROUTING_TOP_M=0, RETRIEVAL_MAX_DISTANCE=0.5,
+    RETRIEVAL_RELATIVE_GAP=0
+)
+class PreparedSearchTests(TestCase):
+    def setUp(self):
+        self.collection = Collection.get_default()
+        document = SourceDocument.objects.create(
+            collection=self.collection, title='Guide', file_path='guide.pdf', file_type='.pdf', file_size=1,
+            active_generation=1, latest_generation=1
+        )
+        for index, (generation, y) in enumerate([(1, 0.1), (1, 0.5), (1, 0.9), (1, 3.0), (0, 0.0)]):
+            DocumentChunk.objects.create(
+                document=document, collection=self.collection, chunk_index=index, generation=generation,
+                content=f'chunk {index}', embedding=unit_vector(1.0, y)
+            )
+        self.engine = RAGEngine(gemini_service=object())
+        self.query = unit_vector(1.0, 0.2)
+
+    def search(self, prepared):
+        self.engine.prepared_search = prepared
+        return [(chunk.id, round(chunk.distance, 6)) for chunk in self.engine.search_similar_chunks(self.query, 10)]
+
+    def test_prepared_search_returns_the_orm_rows(self):
+        self.assertTrue(self.engine.prepared_search)
+        expected = self.search(prepared=False)
+
+        self.assertEqual(len(expected), 3)
+        self.assertEqual(self.search(prepared=True), expected)
+
+    def test_statement_is_prepared_again_after_a_schema_change(self):
+        expected = self.search(prepared=True)
+        with connection.cursor() as cursor:
+            # Deferred foreign key checks would block the ALTER inside the test transaction.
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute("ALTER TABLE document_chunks ALTER COLUMN chunk_index TYPE bigint")
+
+        self.assertEqual(self.search(prepared=True), expected)
+        self.assertEqual(len(prepared_chunk_search(self.query, self.collection.id, 10)), 4)
+
+    @override_settings(DB_PGBOUNCER=True)
+    def test_disabled_behind_pgbouncer(self):
+        self.assertFalse(RAGEngine(gemini_service=object()).prepared_search)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def start_leader(self, flight, key='k', result='answer'):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_call():
+            started.set()
+            release.wait(5)
+            return result
+
+        thread = threading.Thread(target=flight.do, args=(key, slow_call))
+        thread.start()
+        started.wait(5)
+        return release, thread
+
+    def test_concurrent_callers_share_one_execution(self):
+        flight = SingleFlight('test', shared=False, wait_timeout=5)
+        release, thread = self.start_leader(flight)
+        results = []
+        follower = threading.Thread(target=lambda: results.append(flight.do('k', lambda: 'other')))
+        follower.start()
+        time.sleep(0.05)
+        release.set()
+        thread.join()
+        follower.join()
+
+        self.assertEqual(results, ['answer'])
+        self.assertEqual(flight.stats()['executed'], 1)
+
+    def test_follower_gives_up_at_the_interactive_deadline(self):
+        flight = SingleFlight('test', shared=False, wait_timeout=60)
+        release, thread = self.start_leader(flight)
+        try:
+            started = time.monotonic()
+            with gemini_call_context(INTERACTIVE, started + 0.2):
+                with self.assertRaises(RateLimited):
+                    flight.do('k', lambda: 'other')
+            self.assertLess(time.monotonic() - started, 2)
+            self.assertEqual(flight.stats()['timeouts'], 1)
+        finally:
+            release.set()
+            thread.join()
+
+    def test_background_follower_without_deadline_calls_upstream_after_wait_timeout(self):
+        flight = SingleFlight('test', shared=False, wait_timeout=0.1)
+        release, thread = self.start_leader(flight)
+        try:
+            with gemini_call_context(BACKGROUND, time.monotonic()):
+                self.assertEqual(flight.do('k', lambda: 'own'), 'own')
+        finally:
+            release.set()
+            thread.join()
+
+    def test_shared_results_are_not_served_to_later_callers(self):
+        cache.clear()
+        flight = SingleFlight('test', shared=True, wait_timeout=5, result_ttl=60)
+
+        self.assertEqual(flight.do('k', lambda: 'first'), 'first')
+        self.assertEqual(flight.do('k', lambda: 'second'), 'second')
+        self.assertEqual(flight.stats()['shared'], 0)
+
+
+class Waited(Exception):
+    pass
+
+
+@override_settings(RATE_LIMIT_WINDOW=10, RATE_LIMIT_BACKGROUND_SHARE=0.5, RATE_LIMIT_MAX_WAITERS=1, GEMINI_MAX_QUEUE_WAIT=5)
+class GeminiRateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        # Freeze the window clock 10 seconds before the next window; sleeping means waiting.
+        patcher = mock.patch('rag_engine.rate_limit.time')
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock.time.return_value = 1000.0
+        self.clock.monotonic.side_effect = time.monotonic
+        self.clock.sleep.side_effect = Waited
+        # 60 calls per minute: 10 per window, 5 of them for background calls.
+        self.limiter = GeminiRateLimiter('test', 60)
+
+    def acquire(self, priority=INTERACTIVE, deadline=None):
+        with gemini_call_context(priority, deadline):
+            self.limiter.acquire()
+
+    def test_background_calls_only_use_their_share_of_the_window(self):
+        for _ in range(5):
+            self.acquire(BACKGROUND)
+        with self.assertRaises(Waited):
+            self.acquire(BACKGROUND)
+
+        # The interactive share is untouched by the background call that had to wait.
+        for _ in range(5):
+            self.acquire()
+        with self.assertRaises(RateLimited):
+            self.acquire()
+
+    def test_interactive_call_is_rejected_when_quota_returns_after_its_deadline(self):
+        for _ in range(10):
+            self.acquire()
+
+        with self.assertRaises(RateLimited) as raised:
+            self.acquire(deadline=time.monotonic() + 1)
+        self.assertEqual(raised.exception.retry_after, 10)
+        # A deadline past the next window waits for it instead.
+        with self.assertRaises(Waited):
+            self.acquire(deadline=time.monotonic() + 60)
+        self.assertEqual(self.limiter.stats()['rejected'], 1)
+
+    def test_interactive_calls_beyond_max_waiters_are_rejected(self):
+        for _ in range(10):
+            self.acquire()
+        waiting, release = threading.Event(), threading.Event()
+
+        def block(seconds):
+            waiting.set()
+            release.wait(5)
+            raise Waited
+
+        self.clock.sleep.side_effect = block
+        waiter = threading.Thread(target=lambda: self.assertRaises(Waited, self.acquire, deadline=time.monotonic() + 60))
+        waiter.start()
+        try:
+            waiting.wait(5)
+            self.assertEqual(self.limiter.stats()['waiting'], 1)
+            with self.assertRaisesMessage(RateLimited, 'Too many requests waiting'):
+                self.acquire(deadline=time.monotonic() + 60)
+        finally:
+            release.set()
+            waiter.join()
+        self.assertEqual(self.limiter.stats()['waiting'], 0)
+
+
+@override_settings(
+    TOKEN_BUDGET_USER_DAILY=1000, TOKEN_BUDGET_DAILY=0, TOKEN_BUDGET_DEGRADE_AT=0.8, MAX_CONTEXT_TOKENS=4000,
+    TOKEN_BUDGET_DEGRADED_CONTEXT_TOKENS=1500, TOKEN_BUDGET_DEGRADED_MAX_OUTPUT_TOKENS=300, TIME_ZONE='UTC'
+)
+class TokenBudgetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ana', password='secret')
+
+    def spend(self, prompt_tokens, output_tokens=0):
+        usage = TokenUsage()
+        usage.prompt_tokens = prompt_tokens
+        usage.output_tokens = output_tokens
+        record_daily_usage(self.user.id, usage)
+
+    def at(self, moment):
+        """Freeze the local clock the usage module reads"""
+        moment = timezone.make_aware(moment)
+        return mock.patch.multiple(
+            'rag_engine.usage.timezone', localdate=mock.Mock(return_value=moment.date()),
+            localtime=mock.Mock(return_value=moment)
+        )
+
+    def test_usage_accumulates_in_one_row_per_user_and_day(self):
+        self.spend(100, 20)
+        self.spend(50)
+
+        row = DailyTokenUsage.objects.get(user=self.user)
+        self.assertEqual((row.prompt_tokens, row.output_tokens, row.requests), (150, 20, 2))
+
+    def test_budget_degrades_then_rejects(self):
+        self.assertEqual(check_token_budget(self.user), {})
+
+        self.spend(799)
+        self.assertEqual(check_token_budget(self.user), {})
+
+        self.spend(1)
+        self.assertEqual(check_token_budget(self.user), {'max_context_tokens': 1500, 'max_output_tokens': 300})
+
+        self.spend(150, 50)
+        with self.assertRaises(TokenBudgetExceeded):
+            check_token_budget(self.user)
+
+    def test_exhausted_budget_resets_at_midnight(self):
+        with self.at(datetime.datetime(2026, 3, 9, 23, 59, 30)):
+            self.spend(1000)
+            with self.assertRaises(TokenBudgetExceeded) as raised:
+                check_token_budget(self.user)
+        self.assertEqual(raised.exception.retry_after, 30)
+
+        with self.at(datetime.datetime(2026, 3, 10, 0, 0, 1)):
+            self.assertEqual(check_token_budget(self.user), {})
+            self.spend(10)
+
+        self.assertEqual(
+            dict(DailyTokenUsage.objects.values_list('day', 'prompt_tokens')),
+            {datetime.date(2026, 3, 9): 1000, datetime.date(2026, 3, 10): 10}
+        )
+
+
+class TokenUsageViewTests(TestCase):
+    def test_non_numeric_user_is_a_bad_request(self):
+        response = APIClient().get('/api/rag/usage/', {'user': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_filters_by_user(self):
+        ana = User.objects.create_user(username='ana', password='secret')
+        bob = User.objects.create_user(username='bob', password='secret')
+        today = timezone.localdate()
+        DailyTokenUsage.objects.create(user=ana, day=today, prompt_tokens=10, requests=1)
+        DailyTokenUsage.objects.create(user=bob, day=today, prompt_tokens=99, requests=1)
+
+        response = APIClient().get('/api/rag/usage/', {'user': ana.id, 'group_by': 'user'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['user'] for row in response.data['results']], [ana.id])
+
+
+class DocumentUploadViewTests(TestCase):
+    url = '/api/rag/documents/upload/'
+    content = b'%PDF-1.4 travel guide'
+
+    def setUp(self):
+        media = override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+        media.enable()
+        self.addCleanup(media.disable)
+        self.service = DocumentIngestionService(gemini_service=object())
+        patcher = mock.patch('rag_engine.views.get_ingestion_service', return_value=self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def upload(self, title='Guide'):
+        upload = SimpleUploadedFile('guide.pdf', self.content, content_type='application/pdf')
+        return self.client.post(self.url, {'file': upload, 'title': title}, format='multipart')
+
+    def test_new_content_is_queued_with_a_status_url(self):
+        response = self.upload()
+
+        self.assertEqual(response.status_code, 202)
+        job = IngestionJob.objects.get()
+        self.assertEqual(response.data['id'], job.id)
+        self.assertEqual(response.data['status'], 'pending')
+        self.assertEqual(response.data['status_url'], f'http://testserver/api/rag/ingestion-jobs/{job.id}/')
+        self.assertEqual(self.client.get(response.data['status_url']).data['id'], job.id)
+
+        # The same file while it is still queued returns the existing job.
+        self.assertEqual(self.upload().data['id'], job.id)
+        self.assertEqual(IngestionJob.objects.count(), 1)
+
+    def test_ingested_content_creates_an_alias_with_201(self):
+        file_path, content_hash = store_content([self.content], '.pdf')
+        canonical = SourceDocument.objects.create(
+            collection=Collection.get_default(), title='Guide', file_path=file_path, file_type='.pdf', file_size=1,
+            content_hash=content_hash, ingestion_signature=self.service.ingestion_signature
+        )
+        DocumentChunk.objects.create(
+            document=canonical, collection=canonical.collection, chunk_index=0, content='Beaches',
+            embedding=unit_vector(1.0)
+        )
+
+        response = self.upload(title='Copy of the guide')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['deduplicated'])
+        self.assertEqual(response.data['canonical_document'], canonical.id)
+        self.assertFalse(IngestionJob.objects.exists())
+
+
+class IngestionRunViewTests(TestCase):
+    url = '/api/rag/ingestion-runs/'
+
+    def setUp(self):
+        self.document = SourceDocument.objects.create(
+            collection=Collection.get_default(), title='Handbook', file_path='handbook.pdf', file_type='.pdf',
+            file_size=1
+        )
+        hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        self.slow = IngestionRun.objects.create(
+            document=self.document, file_type='.pdf', total_seconds=30, started_at=hour_ago
+        )
+        self.failed = IngestionRun.objects.create(
+            document=self.document, kind='reindex', status='failed', file_type='.pdf', total_seconds=2,
+            started_at=hour_ago + datetime.timedelta(minutes=1)
+        )
+        self.other = IngestionRun.objects.create(
+            file_type='.docx', total_seconds=5, started_at=hour_ago + datetime.timedelta(minutes=2)
+        )
+
+    def ids(self, params=None):
+        response = APIClient().get(self.url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return [run['id'] for run in response.data]
+
+    def test_lists_newest_first(self):
+        self.assertEqual(self.ids(), [self.other.id, self.failed.id, self.slow.id])
+
+    def test_filters_and_ordering(self):
+        self.assertEqual(self.ids({'document': self.document.id, 'ordering': '-total_seconds'}),
+                         [self.slow.id, self.failed.id])
+        self.assertEqual(self.ids({'status': 'failed'}), [self.failed.id])
+        self.assertEqual(self.ids({'kind': 'reindex', 'file_type': '.pdf'}), [self.failed.id])
+        self.assertEqual(self.ids({'file_type': '.docx'}), [self.other.id])
+        since = self.failed.started_at.isoformat()
+        self.assertEqual(self.ids({'since': since}), [self.other.id, self.failed.id])
+
+    def test_malformed_filters_are_bad_requests(self):
+        for params in ({'document': 'abc'}, {'since': '2024-13-45T00:00:00'}):
+            response = APIClient().get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.data)
+
+
+class RecordingEmbeddings:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def generate_embeddings(self, texts, task_type='retrieval_document', model_tag=None):
+        self.batches.append(len(texts))
+        if self.fail:
+            raise RuntimeError('batch too large')
+        return [[1.0, float(len(text))] for text in texts]
+
+
+@override_settings(INGESTION_BATCH_SIZE=3, CONTEXT_COMPRESSION_MAX_WORDS=0)
+class ContextCompressionEmbeddingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.chunks = [
+            SimpleNamespace(content='Beaches are warm. Hotels are near the beach. Flights leave daily. Rain is rare.'),
+            SimpleNamespace(content='Diving costs little. Ferries run hourly. Taxis are cheap.'),
+        ]
+
+    def test_sentence_embeddings_are_fetched_in_api_sized_batches(self):
+        gemini = RecordingEmbeddings()
+        compressor = ContextCompressor(gemini, mode=EMBEDDING)
+
+        compressor.compress('beach hotels', [1.0, 0.0], self.chunks)
+
+        self.assertEqual(gemini.batches, [3, 3, 1])
+        self.assertEqual(compressor.stats()['embedding_scored'], 1)
+
+    def test_failed_embeddings_fall_back_to_lexical_and_are_counted(self):
+        compressor = ContextCompressor(RecordingEmbeddings(fail=True), mode=EMBEDDING)
+
+        compressed, ratio = compressor.compress('beach hotels', [1.0, 0.0], self.chunks)
+
+        self.assertTrue(compressed)
+        stats = compressor.stats()
+        self.assertEqual(stats['lexical_fallbacks'], 1)
+        self.assertEqual(stats['last_fallback_error'], 'batch too large')
+
+
+@override_settings(CHUNK_STORAGE_MODE='compact')
+class DocumentChunkAdminTests(TestCase):
+    url = '/admin/rag_engine/documentchunk/'
+    text = 'Lisbon trams climb the hills. Porto is known for its wine cellars by the river.'
+
+    def setUp(self):
+        admin_user = User.objects.create_superuser(username='admin', password='secret', email='admin@example.com')
+        self.client.force_login(admin_user)
+        collection = Collection.get_default()
+        for title in ('Portugal guide', 'Spain guide'):
+            document = SourceDocument.objects.create(
+                collection=collection, title=title, file_path=f'{title}.pdf', file_type='.pdf', file_size=1
+            )
+            DocumentText.objects.create(document=document, compressed_text=compress_text(self.text), length=len(self.text))
+            DocumentChunk.objects.create(
+                document=document, collection=collection, chunk_index=0, content='', start_offset=30,
+                end_offset=len(self.text), embedding=unit_vector(1.0)
+            )
+
+    def test_changelist_shows_hydrated_compact_chunks(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Porto is known for its wine cellars by the river.', count=2)
+
+    def test_compact_mode_searches_document_titles(self):
+        response = self.client.get(self.url, {'q': 'portugal'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([chunk.document.title for chunk in response.context['cl'].result_list], ['Portugal guide'])
+        self.assertContains(response, 'Searches document titles')
+
+
+class ReplayMetricTests(SimpleTestCase):
+    def test_jaccard(self):
+        self.assertEqual(jaccard({1, 2, 3}, {2, 3, 4}), 0.5)
+        self.assertEqual(jaccard(set(), set()), 1.0)
+        self.assertEqual(jaccard({1}, set()), 0.0)
+
+    def test_recall(self):
+        self.assertEqual(recall({1, 2, 5}, {1, 2, 3, 4}), 0.5)
+        self.assertIsNone(recall({1}, set()))
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.50), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile([7], 0.99), 7)
+
+
+@override_settings(
+    DB_PREPARED_SEARCH=False, DOCUMENT_ROUTING_TOP_M=0, RETRIEVAL_MAX_DISTANCE=0.5, RETRIEVAL_RELATIVE_GAP=0,
+    CONTEXT_COMPRESSION_MODE='off'
+)
+class ReplayQueriesCommandTests(TestCase):
+    def setUp(self):
+        collection = Collection.get_default()
+        document = SourceDocument.objects.create(
+            collection=collection, title='Guide', file_path='guide.pdf', file_type='.pdf', file_size=1
+        )
+        self.near, self.middle, self.far = [
+            DocumentChunk.objects.create(
+                document=document, collection=collection, chunk_index=index, content=f'Beach number {index}',
+                embedding=unit_vector(1.0, y)
+            )
+            for index, y in enumerate([0.0, 0.3, 5.0])
+        ]
+        self.log = RAGQueryLog.objects.create(
+            collection=collection, query='beaches', route=RAG_ROUTE, response='...',
+            query_embedding=unit_vector(1.0, 0.1), embedding_model=search_embedding_tag(),
+            chunk_distances=[{'chunk_id': self.near.id, 'distance': 0.0}, {'chunk_id': self.far.id, 'distance': 0.4}],
+            prompt_breakdown={'context': 40}, execution_time=0.5
+        )
+
+    def test_reports_overlap_with_logged_chunks_and_comparable_context_tokens(self):
+        output = StringIO()
+        json_path = os.path.join(tempfile.mkdtemp(), 'replay.json')
+
+        call_command('replay_queries', json_path=json_path, stdout=output)
+
+        with open(json_path) as replay:
+            result = json.load(replay)['queries'][0]['A']
+        self.assertEqual(result['chunk_ids'], [self.near.id, self.middle.id])
+        self.assertAlmostEqual(result['chunk_jaccard'], 1 / 3)
+        self.assertEqual(result['chunk_recall'], 0.5)
+        self.assertEqual(result['document_recall'], 1.0)
+        expected_context = RAGEngine(gemini_service=object()).build_context([self.near, self.middle])
+        self.assertEqual(result['context_tokens'], estimate_tokens(expected_context))
+        self.assertEqual(result['logged_context_tokens'], 40)
+
+        report = output.getvalue()
+        self.assertIn('Replaying 1 logged queries', report)
+        self.assertRegex(report, r'chunk recall vs logged\s+0\.500')
+        self.assertRegex(report, r'logged context tokens \(mean\)\s+40')
+
+
+ROUTE_AXES = ['greeting', 'thanks', 'farewell', 'off_topic', RAG_ROUTE]
+
+
+def route_vector(**weights):
+    """A 6-dimensional vector with one axis per route plus one that belongs to none"""
+    return [weights.get(route, 0.0) for route in ROUTE_AXES] + [weights.get('other', 0.0)]
+
+
+class ExampleEmbeddings:
+    """Embeds each labelled example as its route's axis"""
+
+    search_embedding_tag = 'test@6'
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def generate_embeddings(self, texts, task_type='retrieval_document', model_tag=None):
+        self.calls.append((task_type, model_tag))
+        if self.fail:
+            raise RuntimeError('Gemini unavailable')
+        routes = {text: route for route, examples in DEFAULT_EXAMPLES.items() for text in examples}
+        return [route_vector(**{routes[text]: 1.0}) for text in texts]
+
+
+@override_settings(
+    INTENT_ROUTER_RULES_FILE='', INTENT_CENTROID_THRESHOLD=0.8, INTENT_CENTROID_MARGIN=0.05, INTENT_ROUTER_MAX_WORDS=20
+)
+class IntentRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.gemini = ExampleEmbeddings()
+        self.router = IntentRouter(self.gemini)
+
+    def test_rules_match_whole_small_talk_messages(self):
+        for message, route in [
+            ('Hola, ¿qué tal?', 'greeting'), ('¡Buenos días!', 'greeting'), ('Muchas gracias por la ayuda', 'thanks'),
+            ('Thank you', 'thanks'), ('Gracias, hasta luego', 'farewell'), ('ADIÓS', 'farewell'),
+        ]:
+            routed = self.router.match_rules(message)
+            self.assertEqual((routed['route'], routed['stage']), (route, 'rules'), message)
+            self.assertIn(routed['response'], self.router.responses[route])
+
+    def test_rules_leave_questions_to_rag(self):
+        for message in ['Hola, ¿qué hoteles hay en Cartagena?', 'Gracias. ¿Y los museos?', '', '¿?']:
+            self.assertIsNone(self.router.match_rules(message), message)
+
+    def test_centroids_use_query_embeddings_of_the_search_version(self):
+        self.assertEqual(self.router.prepare()['greeting'], route_vector(greeting=1.0))
+        self.router.prepare()
+        self.assertEqual(self.gemini.calls, [('retrieval_query', 'test@6')])
+
+    def test_nearest_centroid_above_the_threshold_routes(self):
+        routed = self.router.match_centroid('¿Cuánto es 2 + 2?', route_vector(off_topic=0.9, other=0.3))
+
+        self.assertEqual((routed['route'], routed['stage']), ('off_topic', 'centroid'))
+        self.assertAlmostEqual(routed['score'], 0.9487, places=4)
+
+    def test_nearest_centroid_below_the_threshold_falls_back_to_rag(self):
+        # cos = 0.7 / sqrt(0.7² + 0.6²) ≈ 0.76 < 0.8
+        self.assertIsNone(self.router.match_centroid('¿Y eso?', route_vector(greeting=0.7, other=0.6)))
+
+    def test_nearest_rag_centroid_uses_rag(self):
+        self.assertIsNone(self.router.match_centroid('Hoteles', route_vector(**{RAG_ROUTE: 1.0})))
+
+    def test_route_must_lead_rag_by_the_margin(self):
+        query = route_vector(greeting=1.0, **{RAG_ROUTE: 0.15})
+        greeting = route_vector(greeting=1.0)
+
+        # Similarities 0.989 (greeting) and 0.955 (rag): ahead by less than 0.05.
+        self.router._centroids = {'greeting': greeting, RAG_ROUTE: route_vector(greeting=0.9, **{RAG_ROUTE: 0.436})}
+        self.assertIsNone(self.router.match_centroid('Hola, playas', query))
+
+        # Similarities 0.989 and 0.880.
+        self.router._centroids = {'greeting': greeting, RAG_ROUTE: route_vector(greeting=0.8, **{RAG_ROUTE: 0.6})}
+        self.assertEqual(self.router.match_centroid('Hola, playas', query)['route'], 'greeting')
+
+    def test_long_messages_are_never_routed_by_centroid(self):
+        message = 'hola ' * 21
+        self.assertIsNone(self.router.match_centroid(message, route_vector(greeting=1.0)))
+
+    def test_failed_centroid_embedding_falls_back_to_rag_without_retrying_at_once(self):
+        gemini = ExampleEmbeddings(fail=True)
+        router = IntentRouter(gemini)
+
+        self.assertIsNone(router.match_centroid('Hola', route_vector(greeting=1.0)))
+        self.assertIsNone(router.match_centroid('Hola', route_vector(greeting=1.0)))
+        self.assertEqual(len(gemini.calls), 1)
+
+
+@override_settings(
+    DOCUMENT_ROUTING_TOP_M=1, DB_PREPARED_SEARCH=False, RETRIEVAL_MAX_DISTANCE=0, RETRIEVAL_RELATIVE_GAP=0
+)
+class DocumentRoutingTests(TestCase):
+    def setUp(self):
+        self.collection = Collection.get_default()
+        self.service = DocumentIngestionService(gemini_service=object())
+        self.engine = RAGEngine(gemini_service=object())
+        self.query = unit_vector(1.0, 0.1)
+        # The guide is about the query's topic; the mixed document has one chunk closer to
+        # the query than any of the guide's, but its centroid points elsewhere.
+        self.guide = self.create_document('Guide', [(1.0, 0.3), (1.0, 0.4)])
+        self.mixed = self.create_document('Mixed', [(1.0, 0.1), (0.0, 1.0), (-0.2, 1.0)])
+
+    def create_document(self, title, embeddings):
+        document = SourceDocument.objects.create(
+            collection=self.collection, title=title, file_path=f'{title}.pdf', file_type='.pdf', file_size=1
+        )
+        for index, leading in enumerate(embeddings):
+            DocumentChunk.objects.create(
+                document=document, collection=self.collection, chunk_index=index, content=f'{title} {index}',
+                embedding=unit_vector(*leading)
+            )
+        return document
+
+    def documents_searched(self):
+        return {chunk.document_id for chunk in self.engine.search_similar_chunks(self.query, top_k=10)}
+
+    def test_update_centroid_stores_the_mean_chunk_embedding(self):
+        self.service.update_centroid(self.guide)
+
+        centroid = SourceDocument.objects.get(id=self.guide.id).centroid
+        self.assertAlmostEqual(float(centroid[0]), 1.0, places=5)
+        self.assertAlmostEqual(float(centroid[1]), 0.35, places=5)
+
+    def test_search_only_ranks_chunks_of_the_nearest_documents(self):
+        for document in (self.guide, self.mixed):
+            self.service.update_centroid(document)
+
+        self.assertEqual(self.engine.route_documents(self.query, self.collection.id), [self.guide.id])
+        self.assertEqual(self.documents_searched(), {self.guide.id})
+
+    def test_documents_without_a_centroid_are_always_searched(self):
+        self.service.update_centroid(self.guide)
+
+        self.assertEqual(self.engine.route_documents(self.query, self.collection.id), [self.guide.id, self.mixed.id])
+        self.assertEqual(self.documents_searched(), {self.guide.id, self.mixed.id})
+
+    def test_without_any_centroid_every_document_is_searched(self):
+        routed = self.engine.search_similar_chunks(self.query, top_k=10)
+        self.engine.document_routing_top_m = 0
+        unrouted = self.engine.search_similar_chunks(self.query, top_k=10)
+
+        self.assertEqual([chunk.id for chunk in routed], [chunk.id for chunk in unrouted])
+        self.assertEqual(len(routed), 5)
+
+
+class PromptRecordingGemini:
+    """Embeds every query on the first axis and records the prompts it answers"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate_query_embedding(self, query):
+        return unit_vector(1.0)
+
+    def generate_response(self, prompt, context='', max_output_tokens=None):
+        self.prompts.append(context)
+        return 'Te recomiendo la playa.'
+
+
+@override_settings(INTENT_ROUTER_ENABLED=False, CONTEXT_COMPRESSION_MODE='off', DOCUMENT_ROUTING_TOP_M=0)
+class PromptBreakdownTests(TestCase):
+    def setUp(self):
+        collection = Collection.get_default()
+        document = SourceDocument.objects.create(
+            collection=collection, title='Guide', file_path='guide.pdf', file_type='.pdf', file_size=1
+        )
+        for index, content in enumerate(['Beaches of the north coast', 'Museums open late on Fridays']):
+            DocumentChunk.objects.create(
+                document=document, collection=collection, chunk_index=index, content=content,
+                embedding=unit_vector(1.0, 0.1 * index)
+            )
+        self.gemini = PromptRecordingGemini()
+        self.engine = RAGEngine(gemini_service=self.gemini)
+
+    def test_parts_add_up_to_the_prompt_sent(self):
+        history = [
+            {'sender': 'user', 'content': 'Quiero viajar en verano'},
+            {'sender': 'assistant', 'content': 'Claro, ¿playa o ciudad?'},
+        ]
+        query = 'Where should I go?'
+
+        result = self.engine.generate_rag_response(
+            query, conversation_history=history, conversation_summary='Planning a summer trip'
+        )
+
+        breakdown = result['prompt_breakdown']
+        prompt = self.gemini.prompts[0]
+        self.assertEqual(result['num_chunks'], 2)
+        self.assertEqual(sum(breakdown.values()), estimate_tokens(prompt))
+        self.assertEqual(breakdown['context'], estimate_tokens(self.engine.build_context(result['chunks_used'])))
+        self.assertEqual(breakdown['question'], estimate_tokens(query))
+        self.assertGreater(breakdown['history'], estimate_tokens('Planning a summer trip'))
+        self.assertGreater(breakdown['instructions'], 0)
+        self.assertIn('Museums open late on Fridays', prompt)
+
+
+class StartupImportTests(SimpleTestCase):
+    def test_cold_start_leaves_sdk_and_parsers_unimported(self):
+        script = STARTUP_SCRIPT + "print('\\n'.join(sys.modules))\n"
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=str(settings.BASE_DIR), capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        loaded = set(result.stdout.split())
+
+        self.assertIn('rag_engine.admin', loaded)
+        self.assertIn('chatbot.views', loaded)
+        for name in LAZY_MODULES:
+            self.assertNotIn(name, loaded)
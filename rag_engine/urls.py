@@ -1,12 +1,20 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from rag_engine.views import SourceDocumentViewSet, DocumentChunkViewSet, RAGQueryLogViewSet
+from rag_engine.views import (
+    CollectionViewSet, SourceDocumentViewSet, DocumentChunkViewSet, RAGQueryLogViewSet, IngestionJobViewSet,
+    IngestionRunViewSet, readiness_check, token_usage
+)
 
 router = DefaultRouter()
+router.register(r'collections', CollectionViewSet, basename='collection')
 router.register(r'documents', SourceDocumentViewSet, basename='document')
 router.register(r'chunks', DocumentChunkViewSet, basename='chunk')
 router.register(r'query-logs', RAGQueryLogViewSet, basename='query-log')
+router.register(r'ingestion-jobs', IngestionJobViewSet, basename='ingestion-job')
+router.register(r'ingestion-runs', IngestionRunViewSet, basename='ingestion-run')
 
 urlpatterns = [
+    path('health/ready/', readiness_check, name='readiness'),
+    path('usage/', token_usage, name='token-usage'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,158 @@
+import contextvars
+import datetime
+from contextlib import contextmanager
+from typing import Dict
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from rag_engine.rate_limit import RateLimited
+
+CHARS_PER_TOKEN = 4
+
+_usage = contextvars.ContextVar('gemini_usage', default=None)
+
+
+def estimate_tokens(content) -> int:
+    """Approximate token count of a text or a batch of texts
+
+    embed_content does not report usage, so embedding tokens (and the per-part
+    breakdown of a prompt) are estimated at CHARS_PER_TOKEN characters per token.
+    """
+    if isinstance(content, str):
+        return -(-len(content) // CHARS_PER_TOKEN)
+    return sum(estimate_tokens(text) for text in content)
+
+
+class TokenUsage:
+    """Tokens spent by the Gemini calls made inside a track_usage() block"""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.embedding_tokens = 0
+        self.generation_calls = 0
+        self.embedding_calls = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.output_tokens + self.embedding_tokens
+
+    def add_generation(self, response):
+        metadata = getattr(response, 'usage_metadata', None)
+        self.generation_calls += 1
+        self.prompt_tokens += getattr(metadata, 'prompt_token_count', 0) or 0
+        self.output_tokens += getattr(metadata, 'candidates_token_count', 0) or 0
+
+    def add_embedding(self, content):
+        self.embedding_calls += 1
+        self.embedding_tokens += estimate_tokens(content)
+
+    def as_dict(self) -> Dict:
+        return {
+            'prompt_tokens': self.prompt_tokens,
+            'output_tokens': self.output_tokens,
+            'embedding_tokens': self.embedding_tokens,
+            'total_tokens': self.total_tokens,
+        }
+
+
+@contextmanager
+def track_usage(usage: TokenUsage = None):
+    """Add the usage of every Gemini call made inside the block to ``usage`` (a new
+    TokenUsage by default), which is yielded
+
+    Calls coalesced onto another caller's request spent nothing and are not counted.
+    """
+    usage = usage or TokenUsage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def record_generation(response):
+    usage = _usage.get()
+    if usage is not None:
+        usage.add_generation(response)
+
+
+def record_embedding(content):
+    usage = _usage.get()
+    if usage is not None:
+        usage.add_embedding(content)
+
+
+def record_daily_usage(user_id: int, usage: TokenUsage, requests: int = 1):
+    """Add a request's tokens to the user's DailyTokenUsage row for today"""
+    from rag_engine.models import DailyTokenUsage
+
+    if not usage.total_tokens and not requests:
+        return
+    today = timezone.localdate()
+    increments = {
+        'prompt_tokens': F('prompt_tokens') + usage.prompt_tokens,
+        'output_tokens': F('output_tokens') + usage.output_tokens,
+        'embedding_tokens': F('embedding_tokens') + usage.embedding_tokens,
+        'requests': F('requests') + requests,
+    }
+    rows = DailyTokenUsage.objects.filter(user_id=user_id, day=today)
+    if rows.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            DailyTokenUsage.objects.create(
+                user_id=user_id,
+                day=today,
+                prompt_tokens=usage.prompt_tokens,
+                output_tokens=usage.output_tokens,
+                embedding_tokens=usage.embedding_tokens,
+                requests=requests,
+            )
+    except IntegrityError:
+        # Another request created today's row first.
+        rows.update(**increments)
+
+
+class TokenBudgetExceeded(RateLimited):
+    """Raised when a daily token budget is used up; retry_after is the time to midnight"""
+
+
+def _seconds_until_tomorrow() -> float:
+    now = timezone.localtime()
+    tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(), now.tzinfo)
+    return (tomorrow - now).total_seconds()
+
+
+def check_token_budget(user) -> Dict:
+    """Generation limits for the next chat request of ``user`` under today's budgets
+
+    Returns no limits while less than TOKEN_BUDGET_DEGRADE_AT of both
+    TOKEN_BUDGET_USER_DAILY and TOKEN_BUDGET_DAILY is used, then a smaller context
+    and a shorter answer until a budget is used up, after which TokenBudgetExceeded
+    is raised. A budget of 0 is not enforced.
+    """
+    from rag_engine.models import DailyTokenUsage
+
+    budgets = []
+    today = DailyTokenUsage.objects.filter(day=timezone.localdate())
+    total = Sum(F('prompt_tokens') + F('output_tokens') + F('embedding_tokens'))
+    if settings.TOKEN_BUDGET_USER_DAILY:
+        used = today.filter(user=user).aggregate(total=total)['total'] or 0
+        budgets.append(('Daily token budget for this user', used / settings.TOKEN_BUDGET_USER_DAILY))
+    if settings.TOKEN_BUDGET_DAILY:
+        used = today.aggregate(total=total)['total'] or 0
+        budgets.append(('Daily token budget', used / settings.TOKEN_BUDGET_DAILY))
+    if not budgets:
+        return {}
+
+    name, share = max(budgets, key=lambda budget: budget[1])
+    if share >= 1:
+        raise TokenBudgetExceeded(f'{name} exhausted', _seconds_until_tomorrow())
+    if share >= settings.TOKEN_BUDGET_DEGRADE_AT:
+        return {
+            'max_context_tokens': min(settings.MAX_CONTEXT_TOKENS, settings.TOKEN_BUDGET_DEGRADED_CONTEXT_TOKENS),
+            'max_output_tokens': settings.TOKEN_BUDGET_DEGRADED_MAX_OUTPUT_TOKENS,
+        }
+    return {}
@@ -1,30 +1,64 @@
 import os
+from django.db.models import Count, F, Max, ProtectedError, Sum
+from django.db.models.functions import TruncDate
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.conf import settings
-from rag_engine.models import SourceDocument, DocumentChunk, RAGQueryLog
+from rag_engine.models import (
+    Collection, SourceDocument, DocumentChunk, RAGQueryLog, IngestionJob, IngestionRun, DailyTokenUsage
+)
 from rag_engine.serializers import (
-    SourceDocumentSerializer, DocumentChunkSerializer,
-    RAGQueryLogSerializer, DocumentUploadSerializer
+    CollectionSerializer, SourceDocumentSerializer, DocumentChunkSerializer,
+    RAGQueryLogSerializer, DocumentUploadSerializer, IngestionJobSerializer, IngestionRunSerializer
 )
-from document_processor.ingestion_service import DocumentIngestionService
+from rag_engine.services import get_ingestion_service, readiness
+from document_processor.ingestion_jobs import enqueue_ingestion_job
+from document_processor.storage import remove_if_unreferenced, store_content
+
+
+class CollectionViewSet(viewsets.ModelViewSet):
+    """ViewSet for managing collections (separately searched knowledge bases)"""
+    queryset = Collection.objects.all()
+    serializer_class = CollectionSerializer
+    lookup_field = 'slug'
+
+    def destroy(self, request, *args, **kwargs):
+        """Delete an empty collection (its chunk partition goes with it)"""
+        collection = self.get_object()
+        try:
+            collection.delete()
+        except ProtectedError:
+            return Response(
+                {'error': 'Delete the documents of this collection first'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class SourceDocumentViewSet(viewsets.ModelViewSet):
     """ViewSet for managing source documents"""
-    queryset = SourceDocument.objects.all()
+    queryset = SourceDocument.objects.defer('centroid')
     serializer_class = SourceDocumentSerializer
     parser_classes = (MultiPartParser, FormParser)
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.ingestion_service = DocumentIngestionService()
+        self.ingestion_service = get_ingestion_service()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        collection = self.request.query_params.get('collection')
+        if collection:
+            queryset = queryset.filter(collection__slug=collection)
+        return queryset
 
     @action(detail=False, methods=['post'])
     def upload(self, request):
-        """Upload and ingest a document"""
+        """Upload a document and queue it for ingestion"""
         serializer = DocumentUploadSerializer(data=request.data)
         
         if not serializer.is_valid():
@@ -34,6 +68,7 @@ class SourceDocumentViewSet(viewsets.ModelViewSet):
         title = serializer.validated_data.get('title', '')
         author = serializer.validated_data.get('author', '')
         metadata = serializer.validated_data.get('metadata', {})
+        collection = serializer.validated_data.get('collection') or Collection.get_default()
 
         file_extension = os.path.splitext(uploaded_file.name)[1].lower()
         if file_extension not in ['.pdf', '.docx']:
@@ -42,32 +77,47 @@ class SourceDocumentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        media_root = settings.MEDIA_ROOT
-        os.makedirs(media_root, exist_ok=True)
-        
-        file_path = os.path.join(media_root, uploaded_file.name)
-        
-        with open(file_path, 'wb+') as destination:
-            for chunk in uploaded_file.chunks():
-                destination.write(chunk)
+        file_path, content_hash = store_content(uploaded_file.chunks(), file_extension)
 
         try:
             user = request.user if request.user.is_authenticated else None
-            
-            document = self.ingestion_service.ingest_document(
+
+            duplicate = self.ingestion_service.find_ingested_duplicate(content_hash, collection)
+            if duplicate is not None:
+                document = self.ingestion_service.create_alias(
+                    duplicate,
+                    title=title or uploaded_file.name,
+                    author=author,
+                    user=user,
+                    additional_metadata=metadata
+                )
+                data = SourceDocumentSerializer(document).data
+                data['deduplicated'] = True
+                return Response(data, status=status.HTTP_201_CREATED)
+
+            queued = IngestionJob.objects.filter(
+                kind='ingest',
+                file_path=file_path,
+                collection=collection,
+                status__in=('pending', 'running')
+            ).first()
+            if queued is not None:
+                return self._job_accepted(request, queued)
+
+            job = enqueue_ingestion_job(
+                kind='ingest',
+                collection=collection,
                 file_path=file_path,
                 title=title or uploaded_file.name,
-                author=author,
-                user=user,
-                additional_metadata=metadata
+                author=author or '',
+                uploaded_by=user,
+                metadata=metadata
             )
 
-            serializer = SourceDocumentSerializer(document)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return self._job_accepted(request, job)
 
         except Exception as e:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            remove_if_unreferenced(file_path)
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -75,30 +125,38 @@ class SourceDocumentViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def reindex(self, request, pk=None):
-        """Reindex a document"""
-        try:
-            document = self.ingestion_service.reindex_document(pk)
-            serializer = SourceDocumentSerializer(document)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except SourceDocument.DoesNotExist:
-            return Response(
-                {'error': 'Document not found'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        except Exception as e:
-            return Response(
-                {'error': str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        """Queue a document for reindexing"""
+        document = self.get_object().chunk_source
+        job = enqueue_ingestion_job(
+            kind='reindex',
+            document=document,
+            collection_id=document.collection_id,
+            file_path=document.file_path,
+            title=document.title,
+            uploaded_by=request.user if request.user.is_authenticated else None
+        )
+        return self._job_accepted(request, job)
+
+    def _job_accepted(self, request, job):
+        data = IngestionJobSerializer(job).data
+        data['status_url'] = reverse('ingestion-job-detail', args=[job.id], request=request)
+        return Response(data, status=status.HTTP_202_ACCEPTED)
 
     @action(detail=True, methods=['get'])
     def chunks(self, request, pk=None):
         """Get all chunks for a document"""
         document = self.get_object()
-        chunks = document.chunks.all()
+        chunks = document.chunk_source.chunks.active()
         serializer = DocumentChunkSerializer(chunks, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def ingestion_runs(self, request, pk=None):
+        """Get the timings of each ingestion and reindex of a document, newest first"""
+        document = self.get_object()
+        serializer = IngestionRunSerializer(document.ingestion_runs.all(), many=True)
+        return Response(serializer.data)
+
     def destroy(self, request, *args, **kwargs):
         """Delete a document"""
         document = self.get_object()
@@ -114,12 +172,137 @@ class SourceDocumentViewSet(viewsets.ModelViewSet):
 
 class DocumentChunkViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for viewing document chunks"""
-    queryset = DocumentChunk.objects.all()
+    queryset = DocumentChunk.objects.active()
     serializer_class = DocumentChunkSerializer
 
 
 class RAGQueryLogViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for viewing RAG query logs"""
-    queryset = RAGQueryLog.objects.all()
+    queryset = RAGQueryLog.objects.defer('query_embedding')
     serializer_class = RAGQueryLogSerializer
 
+
+
+class IngestionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for tracking asynchronous ingestion jobs"""
+    queryset = IngestionJob.objects.all()
+    serializer_class = IngestionJobSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        job_status = self.request.query_params.get('status')
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+        return queryset
+
+
+class IngestionRunViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for ingestion telemetry, to find slow files and follow throughput over time"""
+    queryset = IngestionRun.objects.all()
+    serializer_class = IngestionRunSerializer
+    ORDERINGS = [
+        'started_at', '-started_at', 'total_seconds', '-total_seconds', 'pages_per_second',
+        '-pages_per_second', 'chunks_per_second', '-chunks_per_second', 'peak_memory_bytes', '-peak_memory_bytes'
+    ]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        try:
+            document = int(params['document']) if params.get('document') else None
+            since = parse_datetime(params.get('since', ''))
+        except ValueError as e:
+            raise ValidationError({'error': str(e)})
+        if document is not None:
+            queryset = queryset.filter(document=document)
+        for name in ('kind', 'status', 'file_type'):
+            if params.get(name):
+                queryset = queryset.filter(**{name: params[name]})
+        if since is not None:
+            queryset = queryset.filter(started_at__gte=since)
+        if params.get('ordering') in self.ORDERINGS:
+            queryset = queryset.order_by(params['ordering'])
+        return queryset
+
+
+@api_view(['GET'])
+def readiness_check(request):
+    """Report whether this process has finished warming up its services"""
+    state = readiness()
+    code = status.HTTP_200_OK if state['warm'] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return Response(state, status=code)
+
+
+USAGE_GROUPS = {
+    'day': ['day'],
+    'user': ['user', 'user__username'],
+    'conversation': ['conversation', 'conversation__title', 'conversation__user'],
+}
+TOKEN_TOTAL = F('prompt_tokens') + F('output_tokens') + F('embedding_tokens')
+
+
+@api_view(['GET'])
+def token_usage(request):
+    """Gemini tokens spent on chat, summed per day, user or conversation
+
+    ``group_by`` is day (default), user or conversation; ``since`` and ``until``
+    are inclusive dates and ``user`` keeps one user's usage. Days and users include
+    conversation summaries and, per day without ``user``, the embedding tokens of
+    ingestion runs; conversations add their lifetime summary tokens to the chat
+    requests in the range. Embedding tokens are estimates.
+    """
+    params = request.query_params
+    group_by = params.get('group_by', 'day')
+    if group_by not in USAGE_GROUPS:
+        return Response({'group_by': [f"Choose one of: {', '.join(USAGE_GROUPS)}"]}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        since = parse_date(params.get('since', ''))
+        until = parse_date(params.get('until', ''))
+        limit = max(1, min(int(params.get('limit', 100)), 1000))
+        user = int(params['user']) if params.get('user') else None
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if group_by == 'conversation':
+        queryset = RAGQueryLog.objects.filter(conversation__isnull=False)
+        day_field, user_field = 'timestamp__date', 'conversation__user'
+        totals = {
+            'requests': Count('id'),
+            'summary_tokens': Max('conversation__summary_tokens'),
+            'total': Sum(TOKEN_TOTAL) + Max('conversation__summary_tokens'),
+        }
+    else:
+        queryset = DailyTokenUsage.objects.all()
+        day_field, user_field = 'day', 'user'
+        totals = {'requests': Sum('requests'), 'total': Sum(TOKEN_TOTAL)}
+    if since:
+        queryset = queryset.filter(**{f'{day_field}__gte': since})
+    if until:
+        queryset = queryset.filter(**{f'{day_field}__lte': until})
+    if user is not None:
+        queryset = queryset.filter(**{user_field: user})
+
+    rows = (
+        queryset.values(*USAGE_GROUPS[group_by])
+        .annotate(
+            prompt=Sum('prompt_tokens'), output=Sum('output_tokens'), embedding=Sum('embedding_tokens'), **totals
+        )
+        .order_by('-day' if group_by == 'day' else '-total')[:limit]
+    )
+    results = []
+    for row in rows:
+        row['prompt_tokens'] = row.pop('prompt')
+        row['output_tokens'] = row.pop('output')
+        row['embedding_tokens'] = row.pop('embedding')
+        row['total_tokens'] = row.pop('total')
+        results.append(row)
+
+    if group_by == 'day' and user is None and results:
+        runs = IngestionRun.objects.annotate(day=TruncDate('started_at')).filter(
+            day__gte=results[-1]['day'], day__lte=results[0]['day']
+        )
+        ingestion = dict(runs.values('day').annotate(tokens=Sum('embedding_tokens')).values_list('day', 'tokens'))
+        for row in results:
+            row['ingestion_embedding_tokens'] = ingestion.get(row['day']) or 0
+
+    return Response({'group_by': group_by, 'results': results})